@@ -0,0 +1,103 @@
+import time
+
+import metrics
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Admission Control
+# ------------------------------------------------------------------------------------------------------------------------------
+# Every message a client sends costs us something: decoding it, taking game_state_lock, and
+# usually a reply. A client that sends FLIP_CARD a thousand times a second would make every
+# other player at the table wait behind it. So each connection gets a token bucket: it may send
+# --rate-limit messages a second on average, and up to --rate-burst at once after a quiet spell.
+#
+# Messages over the limit are thrown away without being read or answered. Each one also takes a
+# token from a second, slower bucket; a client that keeps going over the limit empties that one
+# too and is disconnected (Flooding is raised and the connection's normal disconnect handling
+# runs). A person clicking never gets anywhere near the limit.
+#
+# Size limits are the Decoder's job (protocol.MAX_CLIENT_FRAME_BYTES).
+
+DEFAULT_RATE = 20   # Messages a second one client may send, on average (0 = no limit)
+DEFAULT_BURST = 40  # Messages one client may send at once
+EXCESS_SHARE = 0.5  # Going over the limit by more than this share of it, for long enough, gets you disconnected
+
+rate = DEFAULT_RATE
+burst = DEFAULT_BURST
+
+
+class Flooding(ValueError):
+    """
+    A client kept sending faster than we allow.
+    """
+
+
+class TokenBucket:
+    """
+    Holds up to burst tokens and gains rate of them a second.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Admission:
+    """
+    Decides which of one client's messages we act on.
+    """
+
+    def __init__(self):
+        self.allowed = TokenBucket(rate, burst)
+        self.excess = TokenBucket(rate * EXCESS_SHARE, burst)
+        self.dropped = 0  # Messages we threw away for this client
+
+    def messages(self, decoder):
+        """
+        The messages in decoder we should act on. Call after every feed().
+        """
+        if not rate:
+            message = decoder.next_message()
+            while message is not None:
+                yield message
+                message = decoder.next_message()
+            return
+        # One clock read per recv(), not one per message
+        now = time.monotonic()
+        self.allowed.refill(now)
+        self.excess.refill(now)
+        while True:
+            if self.allowed.tokens >= 1:
+                message = decoder.next_message()
+                if message is None:
+                    return
+                self.allowed.take()
+                yield message
+                continue
+            if not decoder.skip_message():
+                return
+            self.dropped += 1
+            metrics.inc('messages_dropped_total', 'rate_limited')
+            if not self.excess.take():
+                metrics.inc('flood_disconnects_total')
+                raise Flooding(f"more than {rate:g} messages a second")
+
+
+def configure(args):
+    """
+    Pick up --rate-limit and --rate-burst.
+    """
+    global rate, burst
+    rate = args.rate_limit
+    burst = args.rate_burst
@@ -0,0 +1,88 @@
+import collections
+
+import pygame
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Asset Manager
+# ------------------------------------------------------------------------------------------------------------------------------
+# Loads every image once, straight into the display's pixel format, so blits never have to
+# convert pixels on the fly. The originals are kept, and scaled copies are made from them (never
+# from another scaled copy) and cached by size, so resizing the window back and forth stays
+# sharp and cheap. The cache is bounded by bytes rather than entries: a full-window background
+# is several MB, so a drag-resize would otherwise pin one of those for every size it passed
+# through. Needs pygame.display.set_mode() to have been called first.
+
+SCALED_CACHE_BYTES = 16 * 1024 * 1024  # Pixels of scaled copies we keep (about two 1080p backgrounds)
+
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class AssetManager:
+    """
+    Named images in display format, plus a cache of scaled copies and optional atlases.
+    """
+
+    def __init__(self):
+        self.originals = {}                        # name -> surface at its original size
+        self.scaled_cache = collections.OrderedDict()  # (name, size) -> scaled surface, oldest first
+        self.scaled_bytes = 0                      # Memory the scaled copies in the cache take up
+
+    def load(self, name, path, opaque=False):
+        """
+        Load an image and convert it for fast blitting. opaque=True flattens any transparency onto
+        black (use it for backgrounds, so redrawing one over old pixels always gives the same result).
+        """
+        image = pygame.image.load(path)
+        has_alpha = bool(image.get_flags() & pygame.SRCALPHA) or image.get_colorkey() is not None
+        if opaque and has_alpha:
+            surface = pygame.Surface(image.get_size()).convert()
+            surface.fill((0, 0, 0))
+            surface.blit(image.convert_alpha(), (0, 0))
+        elif has_alpha:
+            surface = image.convert_alpha()
+        else:
+            surface = image.convert()
+        self.originals[name] = surface
+        return surface
+
+    def scaled(self, name, size):
+        """
+        The image at the given size, scaled from the original the first time it's asked for.
+        """
+        size = (int(size[0]), int(size[1]))
+        key = (name, size)
+        surface = self.scaled_cache.get(key)
+        if surface is not None:
+            self.scaled_cache.move_to_end(key)
+            return surface
+        original = self.originals[name]
+        if original.get_size() == size:
+            # Costs nothing extra to keep, we hold on to the original anyway
+            self.scaled_cache[key] = original
+            return original
+        surface = pygame.transform.scale(original, size)
+        self.scaled_cache[key] = surface
+        self.scaled_bytes += surface_bytes(surface)
+        # Throw out the least recently used copies until we fit (never the one we just made)
+        while self.scaled_bytes > SCALED_CACHE_BYTES and len(self.scaled_cache) > 1:
+            (old_name, _), old_surface = self.scaled_cache.popitem(last=False)
+            if old_surface is not self.originals[old_name]:
+                self.scaled_bytes -= surface_bytes(old_surface)
+        return surface
+
+    def atlas(self, names, size):
+        """
+        Pack the given images, all scaled to one size, side by side into a single surface.
+        Returns name -> subsurface; they blit just like separate images but share one block of memory.
+        """
+        width, height = int(size[0]), int(size[1])
+        sheet = pygame.Surface((width * len(names), height), pygame.SRCALPHA).convert_alpha()
+        sheet.fill((0, 0, 0, 0))
+        sprites = {}
+        for i, name in enumerate(names):
+            area = pygame.Rect(i * width, 0, width, height)
+            sheet.blit(pygame.transform.scale(self.originals[name], (width, height)), area)
+            sprites[name] = sheet.subsurface(area)
+        return sprites
@@ -0,0 +1,457 @@
+import asyncio
+import signal
+import time
+
+import admission
+import metrics
+import tracing
+import outbound
+from matchmaking import DEFAULT_MAX_WAITING, Matchmaker
+from protocol import JSON, MAX_CLIENT_FRAME_BYTES, Decoder, encode_message
+from rooms import NullLock, RoomRegistry, send_message_to_client
+from spectators import DEFAULT_FRAME_SECONDS, DEFAULT_MAX_SPECTATORS
+from workers import SPECTATOR
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  asyncio Server Engine
+# ------------------------------------------------------------------------------------------------------------------------------
+# Same newline-JSON protocol and the same Room rules as the threaded server, but every
+# player, turn and broadcast runs on one event loop. No thread per player and no real
+# locks: nothing else can run between two lines of code unless we await.
+
+LISTEN_BACKLOG = 4096      # Lots of players may connect at once
+READ_CHUNK_BYTES = 4096    # How much we ask for per read
+TYPICAL_MESSAGE_BYTES = 128 # Used to turn --send-queue-size (messages) into a send buffer limit (bytes)
+
+
+class StreamConnection:
+    """
+    Wraps an asyncio StreamWriter so the Room can send to it like any other connection.
+    write() never blocks; the transport's write buffer is this client's outbound queue,
+    and when it grows past max_buffer_bytes the slow-client policy kicks in.
+    """
+
+    def __init__(self, writer, name, max_buffer_bytes, policy):
+        self.writer = writer
+        self.name = name
+        self.encoding = JSON      # What we send them in
+        # How we read what they send us
+        self.decoder = Decoder(max_frame=MAX_CLIENT_FRAME_BYTES)
+        self.wants_state_updates = False  # Batched STATE_UPDATE frames instead of single messages
+        self.wants_heartbeat = False      # Pinged when quiet, and disconnected when silent (see heartbeat.py)
+        self.heard_from = True            # They've sent something since the last heartbeat check
+        self.quiet_checks = 0             # Heartbeat checks in a row they've been quiet for
+        self.max_buffer_bytes = max_buffer_bytes
+        self.policy = policy
+        self.queued = 0       # Messages handed to the transport
+        self.sent = 0         # asyncio doesn't tell us when bytes leave, so we only count queued
+        self.high_water = 0   # Biggest this client's send buffer has been (bytes)
+        self.dropped = 0
+
+    def queue_depth(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def is_backlogged(self):
+        return self.queue_depth() * 2 >= self.max_buffer_bytes
+
+    def send_payload(self, payload):
+        if self.writer.is_closing():
+            # Client might have gone away, we can't do much.
+            return
+        depth = self.queue_depth()
+        if depth >= self.max_buffer_bytes:
+            self.dropped += 1
+            metrics.inc('outbound_dropped_total')
+            if self.policy == outbound.POLICY_DROP:
+                outbound.totals.add(dropped=1)
+                return
+            print(f"{self.name} is too slow to keep up, disconnecting them.")
+            metrics.inc('slow_client_disconnects_total')
+            outbound.totals.add(dropped=1, slow_disconnects=1)
+            # The reader sees the connection drop and runs the normal disconnect handling
+            self.writer.transport.abort()
+            return
+        self.writer.write(payload)
+        metrics.inc('bytes_out_total', amount=len(payload))
+        self.queued += 1
+        depth += len(payload)
+        if depth > self.high_water:
+            self.high_water = depth
+            outbound.totals.add(depth=depth)
+
+    def hang_up(self):
+        """
+        Disconnect them; their reader sees the connection drop and runs the normal disconnect handling.
+        """
+        self.writer.transport.abort()
+
+    def close(self):
+        outbound.totals.add(queued=self.queued)
+        self.queued = 0
+        self.writer.close()
+
+
+class AsyncGameServer:
+    """
+    Accepts players with asyncio streams and seats them in rooms.
+    """
+
+    def __init__(self, expected_players, max_rooms, reveal_seconds, send_queue_size, slow_client_policy, num_pairs,
+                 spectator_seconds=DEFAULT_FRAME_SECONDS, max_spectators=DEFAULT_MAX_SPECTATORS,
+                 max_waiting=DEFAULT_MAX_WAITING):
+        loop = self.loop = asyncio.get_running_loop()
+        # The event loop is our scheduler: mismatched cards are hidden (and spectators updated) with loop.call_later()
+        self.registry = RoomRegistry(expected_players, max_rooms, loop, lock_factory=NullLock,
+                                     rlock_factory=NullLock, reveal_seconds=reveal_seconds, num_pairs=num_pairs,
+                                     spectator_seconds=spectator_seconds, max_spectators=max_spectators)
+        self.registry.register_gauges()
+        # Players wait in line here until there's a seat for them
+        self.matchmaker = Matchmaker(self.registry, max_waiting)
+        self.matchmaker.register_gauges()
+        self.matchmaker_timer = None
+        self.registry.on_seat_freed = self.seat_freed
+        self.send_buffer_bytes = send_queue_size * TYPICAL_MESSAGE_BYTES
+        self.slow_client_policy = slow_client_policy
+        self.next_player_id = 1
+        self.connection_tasks = set()  # One task per connected player, so shutdown can wait for them
+
+    async def handle_client_connection(self, reader, writer, player_id=None):
+        """
+        Called by asyncio for every new connection. Keeps track of the task so shutdown can wait for it.
+        """
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        try:
+            await self.play(reader, writer, player_id)
+        finally:
+            self.connection_tasks.discard(task)
+
+    async def handle_handoff(self, client_sock, player_id):
+        """
+        A player the coordinator accepted and passed to this worker (see workers.py).
+        """
+        reader, writer = await asyncio.open_connection(sock=client_sock)
+        await self.handle_client_connection(reader, writer, player_id)
+
+    async def handle_spectator_handoff(self, client_sock):
+        reader, writer = await asyncio.open_connection(sock=client_sock)
+        await self.handle_spectator_connection(reader, writer)
+
+    async def handle_spectator_connection(self, reader, writer):
+        """
+        Someone who only wants to watch. The hub sends them the game (see spectators.py),
+        we just listen in case they want another room or encoding.
+        """
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        client_addr = writer.get_extra_info('peername')
+        client_conn = StreamConnection(writer, f"Spectator {client_addr}", self.send_buffer_bytes,
+                                       self.slow_client_policy)
+        hub = self.registry.spectators
+        try:
+            if not hub.add(client_conn):
+                send_message_to_client(client_conn, {"type": "ERROR", "message": "Sorry, too many spectators."})
+                return
+            print(f"Spectator connected from {client_addr}")
+            decoder = client_conn.decoder
+            gate = admission.Admission()
+            try:
+                while True:
+                    data = await reader.read(READ_CHUNK_BYTES)
+                    if not data:
+                        break
+                    metrics.inc('bytes_in_total', amount=len(data))
+                    decoder.feed(data)
+                    for message in gate.messages(decoder):
+                        hub.handle_message(client_conn, message)
+                    await writer.drain()
+            except Exception as error:
+                print(f"Oops, error with spectator {client_addr}: {error}")
+            print(f"Spectator {client_addr} left.")
+            hub.remove(client_conn)
+        finally:
+            client_conn.close()
+            await self.close_connection(writer)
+            self.connection_tasks.discard(task)
+
+    async def play(self, reader, writer, player_id=None):
+        """
+        When someone joins:
+          - Wait in line until there's a seat for them (see seat() for the rest of the hello)
+          - Listen for their flip requests until they disconnect
+        """
+        client_addr = writer.get_extra_info('peername')
+        numbered_here = player_id is None  # The coordinator numbers players when there are workers
+        if numbered_here:
+            player_id = self.next_player_id
+        client_conn = StreamConnection(writer, f"Player {player_id}", self.send_buffer_bytes,
+                                       self.slow_client_policy)
+        ticket = self.matchmaker.admit(client_conn, client_addr, player_id, time.monotonic())
+        if ticket is None:
+            # Every table is full and so is the line—tell them to come back later
+            writer.write(encode_message({"type": "ERROR", "message": "Sorry, game is full."}))
+            await self.close_connection(writer)
+            return
+        if numbered_here:
+            self.next_player_id += 1
+
+        gate = admission.Admission()
+        ticket.seated = self.loop.create_future()
+        self.schedule_matchmaker()
+        try:
+            room = await self.wait_for_seat(reader, ticket, gate)
+        except Exception as error:
+            print(f"Player {player_id} left while waiting for a seat ({error}).")
+            # If they'd just been seated, the read loop below sees the same error and gives the seat back
+            room = ticket.seated.result() if ticket.seated.done() else None
+        if room is None:
+            self.matchmaker.leave(ticket)
+            client_conn.close()
+            await self.close_connection(writer)
+            return
+
+        decoder = client_conn.decoder
+        try:
+            # Anything they sent just as they sat down
+            for message in gate.messages(decoder):
+                room.handle_message(player_id, client_conn, message)
+            while True:
+                data = await reader.read(READ_CHUNK_BYTES)
+                if not data:
+                    # Client closed the connection
+                    break
+                metrics.inc('bytes_in_total', amount=len(data))
+                client_conn.heard_from = True
+                decoder.feed(data)
+                for message in tracing.messages(gate.messages(decoder), player_id, room):
+                    room.handle_message(player_id, client_conn, message)
+                # Don't let one chatty player hog the loop or grow their send buffer forever
+                await writer.drain()
+        except Exception as error:
+            print(f"Oops, error with player {player_id}: {error}")
+        finally:
+            self.handle_client_disconnection(client_conn, player_id, room)
+            client_conn.close()
+            await self.close_connection(writer)
+
+    async def wait_for_seat(self, reader, ticket, gate):
+        """
+        Listen to a player without a seat (JOIN, or hanging up) until the matchmaker seats them.
+        Returns their Room, or None if they left first.
+        """
+        decoder = ticket.conn.decoder
+        while not ticket.seated.done():
+            read = asyncio.ensure_future(reader.read(READ_CHUNK_BYTES))
+            await asyncio.wait((read, ticket.seated), return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                # Seated; whatever they send next is for the room
+                read.cancel()
+                await asyncio.wait((read,))
+                if read.cancelled():
+                    break
+            data = read.result()
+            if not data and not ticket.seated.done():
+                return None
+            metrics.inc('bytes_in_total', amount=len(data))
+            decoder.feed(data)
+            if ticket.seated.done():
+                # Sat down while this arrived, it's for the room too (and so is a hang-up)
+                break
+            for message in gate.messages(decoder):
+                reply = self.matchmaker.handle_message(ticket, message)
+                if reply is not None:
+                    send_message_to_client(ticket.conn, reply)
+            self.schedule_matchmaker()
+        return ticket.seated.result()
+
+    def seat(self, ticket, players):
+        """
+        The matchmaker found a player a seat (seat_player says hi and tells them their player
+        number), and once enough players are at their table, start (or restart) the game.
+        """
+        client_conn, client_addr, player_id = ticket.conn, ticket.addr, ticket.player_id
+        room = self.registry.seat_player(client_conn, client_addr, player_id, players, ticket.name)
+        if room is not None:
+            print(f"Player {player_id} connected from {client_addr} (room {room.room_id})")
+            if room.start_if_full():
+                print(f"All {room.expected_players} players connected to room {room.room_id}, the game has started!")
+        ticket.seated.set_result(room)
+
+    def seat_freed(self):
+        """
+        Someone gave up a seat (always on the event loop here), let whoever is waiting have it.
+        """
+        self.matchmaker.seat_freed()
+        self.schedule_matchmaker()
+
+    def schedule_matchmaker(self):
+        """
+        Make sure run_matchmaker() runs when the matchmaker next has something to do.
+        """
+        timeout = self.matchmaker.timeout(time.monotonic())
+        if timeout is None:
+            return
+        when = self.loop.time() + timeout
+        if self.matchmaker_timer is not None:
+            if self.matchmaker_timer.when() <= when:
+                return
+            self.matchmaker_timer.cancel()
+        self.matchmaker_timer = self.loop.call_at(when, self.run_matchmaker)
+
+    def run_matchmaker(self):
+        """
+        Seat whoever we can and tell the rest where they are in line.
+        """
+        self.matchmaker_timer = None
+        now = time.monotonic()
+        self.matchmaker.place(now, self.seat)
+        for ticket, message in self.matchmaker.updates(now):
+            send_message_to_client(ticket.conn, message)
+        self.schedule_matchmaker()
+
+    def handle_client_disconnection(self, client_conn, player_id, room):
+        """
+        When someone disconnects:
+          - Remove them from their room
+          - Tell everyone else at that table they left
+          - Hold the table until a new player sits down (see Room.start_if_full)
+        """
+        print(f"Player {player_id} disconnected from room {room.room_id}.")
+        room.hold_for_replacement(player_id)
+        self.registry.remove_player(room, player_id)
+        room.broadcast_message({"type": "DISCONNECT", "player_id": player_id, })
+
+    async def close_connection(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def shutdown(self):
+        """
+        Tell everyone we're going away and give their send buffers a chance to empty.
+        """
+        if self.matchmaker_timer is not None:
+            self.matchmaker_timer.cancel()
+        for room in self.registry.all_rooms():
+            room.broadcast_message({"type": "SHUTDOWN", "message": "Server is shutting down."})
+        waiting = [ticket.conn for ticket in self.matchmaker.everyone()]
+        for client_conn in waiting:
+            send_message_to_client(client_conn, {"type": "SHUTDOWN", "message": "Server is shutting down."})
+        connections = self.registry.all_connections() + self.registry.spectators.shutdown() + waiting
+        outbound.print_summary(connections)
+        writers = [conn.writer for conn in connections]
+        await asyncio.gather(*(writer.drain() for writer in writers), return_exceptions=True)
+        for writer in writers:
+            writer.close()
+        # Let every player's task notice its connection closed and clean up
+        if self.connection_tasks:
+            await asyncio.wait(self.connection_tasks, timeout=1)
+
+
+def raise_open_file_limit():
+    """
+    Every player is a file descriptor, so ask for as many as the OS will give us.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def serve(args, host, port):
+    game_server = AsyncGameServer(args.players, args.max_rooms, args.reveal_delay,
+                                  args.send_queue_size, args.slow_client_policy, args.pairs,
+                                  args.spectator_interval, args.max_spectators, args.max_waiting)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, stop_event.set)
+    except NotImplementedError:
+        # Windows event loops don't support signal handlers, CTRL + c raises KeyboardInterrupt instead
+        pass
+
+    server = await asyncio.start_server(
+        game_server.handle_client_connection, host, port,
+        backlog=LISTEN_BACKLOG, reuse_address=True
+    )
+    spectator_server = None
+    if args.spectator_port is not None:
+        spectator_server = await asyncio.start_server(
+            game_server.handle_spectator_connection, host, args.spectator_port,
+            backlog=LISTEN_BACKLOG, reuse_address=True
+        )
+        print(f"Spectators can watch on {host}:{args.spectator_port}")
+    print(
+        f"Ready on {host}:{port} (asyncio), "
+        f"hosting up to {args.max_rooms} games of {args.players} players..."
+    )
+    async with server:
+        await stop_event.wait()
+        server.close()
+        if spectator_server is not None:
+            spectator_server.close()
+        await game_server.shutdown()
+
+
+async def serve_handoffs(args, channel):
+    """
+    Worker mode: players arrive from the coordinator over channel instead of from our own listening socket.
+    """
+    game_server = AsyncGameServer(args.players, args.max_rooms, args.reveal_delay,
+                                  args.send_queue_size, args.slow_client_policy, args.pairs,
+                                  args.spectator_interval, args.max_spectators, args.max_waiting)
+    registry = game_server.registry
+    registry.on_seats_changed = lambda: channel.report(registry)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, stop_event.set)
+
+    def receive_handoff():
+        try:
+            handoff = channel.receive()
+        except BlockingIOError:
+            return
+        if handoff is None:
+            # The coordinator is gone
+            stop_event.set()
+            return
+        client_sock, player_id = handoff
+        if player_id == SPECTATOR:
+            loop.create_task(game_server.handle_spectator_handoff(client_sock))
+        else:
+            loop.create_task(game_server.handle_handoff(client_sock, player_id))
+
+    channel.sock.setblocking(False)
+    loop.add_reader(channel.sock, receive_handoff)
+    print(f"Worker {channel.index} ready (asyncio), hosting up to {args.max_rooms} games...")
+    await stop_event.wait()
+    loop.remove_reader(channel.sock)
+    await game_server.shutdown()
+
+
+def run_worker(args, channel):
+    """
+    Entry point used by workers.py for a worker process running the asyncio engine.
+    """
+    raise_open_file_limit()
+    asyncio.run(serve_handoffs(args, channel))
+
+
+def run(args, host, port):
+    """
+    Entry point used by server.py when started with --engine asyncio.
+    """
+    raise_open_file_limit()
+    try:
+        asyncio.run(serve(args, host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,390 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from protocol import BINARY, JSON, STATE_UPDATES, Decoder, encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Load Generator
+# ------------------------------------------------------------------------------------------------------------------------------
+# Launches N simulated players across M games against a local server. The bots speak the real
+# protocol (JOIN, WELCOME, FLIP_CARD, PLAY_AGAIN, and optionally binary / state updates), play legal
+# games with a perfect memory, and start a new game as soon as one ends.
+#
+# Reports flips/sec, flip -> CARD_REVEALED latency, connection setup time and server memory per
+# connection. Use --json to save the numbers so runs can be compared across changes and engines.
+#
+# Run from the project folder, for example:
+#   python -m benchmarks.loadgen --players 200 --games 100 --duration 20 --server-args "--engine asyncio"
+
+DEFAULT_PORT = 12399  # Not the game's usual port, so a benchmark never lands on a real server
+
+
+class Stats:
+    """
+    Numbers collected by the bots in one process.
+    """
+
+    def __init__(self):
+        self.flip_latencies = []   # seconds, FLIP_CARD sent -> CARD_REVEALED received
+        self.connect_times = []    # seconds, connect() started -> WELCOME received
+        self.flips = 0
+        self.games_finished = 0
+        self.errors = 0
+        self.disconnects = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class Bot:
+    """
+    One simulated player. Remembers every card it has seen and always takes a pair it knows.
+    """
+
+    def __init__(self, host, port, encoding, state_updates, stats, stop_at):
+        self.host = host
+        self.port = port
+        self.encoding = encoding
+        self.state_updates = state_updates
+        self.stats = stats
+        self.stop_at = stop_at
+        self.send_encoding = JSON
+        self.decoder = Decoder()
+        self.writer = None
+        self.player_id = None
+        self.player_index = None
+        self.reset_board(16)
+        self.flip_sent_at = {}    # card_index -> when we asked to flip it
+        self.turn_flips = []      # cards we've flipped so far this turn
+        self.my_turn = False
+        self.in_game = False
+
+    def reset_board(self, num_cards):
+        self.num_cards = num_cards
+        self.known = {}           # card_index -> identity, for cards we've seen and that aren't matched
+        self.matched = set()
+
+    def send(self, message):
+        self.writer.write(encode_message(message, self.send_encoding))
+
+    def flip(self, card_index):
+        self.flip_sent_at[card_index] = time.perf_counter()
+        self.turn_flips.append(card_index)
+        self.send({"type": "FLIP_CARD", "card_index": card_index})
+
+    def unknown_cards(self):
+        return [i for i in range(self.num_cards) if i not in self.known and i not in self.matched]
+
+    def take_turn(self):
+        """
+        First flip of a turn: a pair we already know if there is one, otherwise a card we haven't seen.
+        """
+        if time.monotonic() >= self.stop_at:
+            return
+        self.turn_flips = []
+        seen = {}
+        for card_index, identity in self.known.items():
+            if identity in seen:
+                self.flip(seen[identity])
+                self.flip(card_index)
+                return
+            seen[identity] = card_index
+        unknown = self.unknown_cards()
+        if unknown:
+            self.flip(unknown[0])
+
+    def second_flip(self, first_index, identity):
+        """
+        Second flip: the partner if we've seen it, otherwise another card we haven't seen.
+        """
+        for card_index, known_identity in self.known.items():
+            if known_identity == identity and card_index != first_index:
+                self.flip(card_index)
+                return
+        unknown = [i for i in self.unknown_cards() if i != first_index]
+        if unknown:
+            self.flip(unknown[0])
+
+    def handle(self, message, in_frame=False):
+        msg_type = message.get("type")
+        if msg_type == "WELCOME":
+            self.player_id = message["player_id"]
+            self.player_index = message["player_index"]
+            if self.encoding == BINARY and BINARY in message.get("encodings", []):
+                self.send({"type": "SET_ENCODING", "encoding": BINARY})
+                self.send_encoding = BINARY
+            if self.state_updates and STATE_UPDATES in message.get("features", []):
+                self.send({"type": "ENABLE_FEATURE", "feature": STATE_UPDATES})
+        elif msg_type == "ENCODING":
+            self.decoder.encoding = message["encoding"]
+        elif msg_type == "STATE_UPDATE":
+            for event in message["events"]:
+                self.handle(event, in_frame=True)
+        elif msg_type == "GAME_START":
+            self.reset_board(message.get("num_cards", 16))
+            self.in_game = True
+            # An older server can start the game before our WELCOME gets here; WELCOME has our seat too
+            if self.player_id in message["players"]:
+                self.player_index = message["players"].index(self.player_id) + 1
+        elif msg_type == "YOUR_TURN":
+            self.my_turn = message["player_id"] == self.player_id
+            if self.my_turn:
+                self.take_turn()
+        elif msg_type == "CARD_REVEALED":
+            card_index = message["card_index"]
+            self.known[card_index] = message["identity"]
+            sent_at = self.flip_sent_at.pop(card_index, None)
+            if sent_at is not None:
+                self.stats.flip_latencies.append(time.perf_counter() - sent_at)
+                self.stats.flips += 1
+                if len(self.turn_flips) == 1:
+                    self.second_flip(card_index, message["identity"])
+        elif msg_type == "MATCH_RESULT":
+            for card_index in message["cards"]:
+                self.matched.add(card_index)
+                self.known.pop(card_index, None)
+            if message["player_id"] == self.player_id and len(self.matched) < self.num_cards:
+                # A match means we go again
+                self.take_turn()
+        elif msg_type == "GAME_OVER":
+            self.in_game = False
+            self.my_turn = False
+            if self.player_index == 1:
+                # One player per table asks for the next game
+                self.stats.games_finished += 1
+                if time.monotonic() < self.stop_at:
+                    self.send({"type": "PLAY_AGAIN"})
+        elif msg_type == "ERROR":
+            self.stats.errors += 1
+            if self.my_turn and message.get("message") == "Please wait, cards are being hidden.":
+                self.turn_flips = []
+
+    async def run(self, ready_event, connected_counter):
+        started = time.perf_counter()
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.send({"type": "JOIN"})
+        try:
+            while time.monotonic() < self.stop_at:
+                try:
+                    data = await asyncio.wait_for(reader.read(65536), timeout=max(0.1, self.stop_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    self.stats.disconnects += 1
+                    break
+                self.decoder.feed(data)
+                message = self.decoder.next_message()
+                while message is not None:
+                    if message.get("type") == "WELCOME":
+                        self.stats.connect_times.append(time.perf_counter() - started)
+                        connected_counter[0] += 1
+                        if connected_counter[0] == connected_counter[1]:
+                            ready_event.set()
+                    self.handle(message)
+                    message = self.decoder.next_message()
+        finally:
+            self.writer.close()
+
+
+async def run_bots(host, port, count, encoding, state_updates, duration, connect_rate, report_ready):
+    stats = Stats()
+    ready_event = asyncio.Event()
+    connected_counter = [0, count]
+    stop_at = time.monotonic() + duration
+    bots = [Bot(host, port, encoding, state_updates, stats, stop_at) for _ in range(count)]
+    tasks = []
+    for i, bot in enumerate(bots):
+        tasks.append(asyncio.create_task(bot.run(ready_event, connected_counter)))
+        if connect_rate and i % connect_rate == connect_rate - 1:
+            # Don't flood the listen backlog all at once
+            await asyncio.sleep(0.01)
+    if report_ready is not None:
+        await asyncio.wait([asyncio.create_task(ready_event.wait())], timeout=duration)
+        report_ready()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    stats.errors += sum(1 for r in results if isinstance(r, Exception))
+    return stats
+
+
+def bot_process(host, port, count, encoding, state_updates, duration, connect_rate, ready_queue, result_queue):
+    """
+    Runs one share of the bots on its own event loop (one per process).
+    """
+    stats = asyncio.run(run_bots(host, port, count, encoding, state_updates, duration, connect_rate,
+                                 lambda: ready_queue.put(True)))
+    result_queue.put(stats.as_dict())
+
+
+def server_rss_kb(pid):
+    """
+    Resident memory of the server, plus its worker processes if it has any (Linux only).
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            rss = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            for child in children.read().split():
+                rss += server_rss_kb(int(child)) or 0
+        return rss
+    except (OSError, StopIteration):
+        return None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(results, args, elapsed, rss_before, rss_after):
+    latencies = sorted(x for r in results for x in r["flip_latencies"])
+    connects = sorted(x for r in results for x in r["connect_times"])
+    flips = sum(r["flips"] for r in results)
+    summary = {
+        "players": args.players,
+        "games": args.games,
+        "server_args": args.server_args,
+        "encoding": args.encoding,
+        "state_updates": args.state_updates,
+        "duration_s": round(elapsed, 3),
+        "connected": len(connects),
+        "flips": flips,
+        "flips_per_sec": round(flips / elapsed, 1) if elapsed else 0,
+        "games_finished": sum(r["games_finished"] for r in results),
+        "errors": sum(r["errors"] for r in results),
+        "disconnects": sum(r["disconnects"] for r in results),
+        "flip_latency_ms": {name: round(percentile(latencies, q) * 1000, 3) if latencies else None
+                            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "connect_ms": {name: round(percentile(connects, q) * 1000, 3) if connects else None
+                       for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))},
+        "server_rss_kb": rss_after,
+        "rss_per_connection_kb": (round((rss_after - rss_before) / max(1, len(connects)), 2)
+                                  if rss_before is not None and rss_after is not None else None),
+    }
+    return summary
+
+
+def print_summary(summary):
+    print(f"players {summary['players']} in {summary['games']} games, server args: {summary['server_args'] or '(none)'}")
+    print(f"  connected          {summary['connected']}")
+    print(f"  flips              {summary['flips']} ({summary['flips_per_sec']}/s over {summary['duration_s']}s)")
+    print(f"  games finished     {summary['games_finished']}")
+    print(f"  errors/disconnects {summary['errors']}/{summary['disconnects']}")
+    lat = summary['flip_latency_ms']
+    print(f"  flip latency ms    p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    con = summary['connect_ms']
+    print(f"  connect ms         p50 {con['p50']}  p95 {con['p95']}  p99 {con['p99']}  max {con['max']}")
+    if summary['rss_per_connection_kb'] is not None:
+        print(f"  server memory      {summary['server_rss_kb']} KB, {summary['rss_per_connection_kb']} KB per connection")
+
+
+def start_server(args):
+    """
+    Start server.py for this run and wait until it's listening.
+    """
+    project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    players_per_game = args.players // args.games
+    command = [sys.executable, '-u', os.path.join(project, 'server.py'), '--host', args.host, '--port', str(args.port),
+               '--players', str(players_per_game), '--max-rooms', str(args.games),
+               '--reveal-delay', str(args.reveal_delay),
+               # Bots flip as fast as the server answers, far quicker than any person (override in --server-args)
+               '--rate-limit', '0'] + args.server_args.split()
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=project, text=True)
+    # Wait for the server to say it's listening (a test connection would take a seat)
+    output = []
+    for line in server.stdout:
+        output.append(line)
+        if line.startswith('Ready on'):
+            # Keep reading what it prints so it never blocks on a full pipe
+            threading.Thread(target=server.stdout.read, daemon=True).start()
+            return server
+    server.wait()
+    raise SystemExit("server exited early:\n" + ''.join(output))
+
+
+def stop_server(server):
+    server.send_signal(2)  # CTRL + c
+    try:
+        server.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load generator and latency benchmark for server.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--players', '-n', type=int, default=40, help='Simulated players in total (default 40)')
+    parser.add_argument('--games', '-m', type=int, default=20, help='Games they are split across (default 20)')
+    parser.add_argument('--duration', '-d', type=float, default=10, help='Seconds to play for (default 10)')
+    parser.add_argument('--encoding', choices=(JSON, BINARY), default=JSON, help='Wire encoding the bots ask for')
+    parser.add_argument('--state-updates', action='store_true', help='Bots ask for batched STATE_UPDATE frames')
+    parser.add_argument('--processes', type=int, default=1, help='Bot processes, for when one core cannot keep up')
+    parser.add_argument('--connect-rate', type=int, default=200, help='Connections opened per 10ms (0 = all at once)')
+    parser.add_argument('--no-server', action='store_true', help="Use a server that's already running on --host/--port")
+    parser.add_argument('--server-pid', type=int, help='With --no-server: pid to read memory use from')
+    parser.add_argument('--server-args', default='', help='Extra arguments for server.py, e.g. "--engine asyncio"')
+    parser.add_argument('--reveal-delay', type=float, default=0.0,
+                        help='Mismatch reveal delay for the server we start (default 0, so turns never wait)')
+    parser.add_argument('--json', help='Also write the summary to this file')
+    args = parser.parse_args()
+    if args.players % args.games:
+        parser.error('--players must be a multiple of --games')
+    return args
+
+
+def main():
+    args = parse_args()
+    server = None if args.no_server else start_server(args)
+    server_pid = args.server_pid if args.no_server else server.pid
+    rss = {"before": server_rss_kb(server_pid) if server_pid else None, "after": None}
+
+    def all_connected():
+        # Everyone has their WELCOME; that's the memory cost of the connections
+        if server_pid:
+            rss["after"] = server_rss_kb(server_pid)
+
+    started = time.perf_counter()
+    try:
+        if args.processes <= 1:
+            stats = asyncio.run(run_bots(args.host, args.port, args.players, args.encoding, args.state_updates,
+                                         args.duration, args.connect_rate, all_connected))
+            results = [stats.as_dict()]
+        else:
+            ready_queue = multiprocessing.Queue()
+            result_queue = multiprocessing.Queue()
+            shares = [args.players // args.processes + (1 if i < args.players % args.processes else 0)
+                      for i in range(args.processes)]
+            workers = [multiprocessing.Process(target=bot_process, args=(
+                args.host, args.port, share, args.encoding, args.state_updates, args.duration,
+                args.connect_rate, ready_queue, result_queue)) for share in shares]
+            for worker in workers:
+                worker.start()
+            for _ in workers:
+                ready_queue.get()
+            all_connected()
+            results = [result_queue.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    summary = summarize(results, args, elapsed, rss["before"], rss["after"])
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(summary, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import timeit
+
+from protocol import BINARY, JSON, Decoder, encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Wire Protocol Benchmark
+# ------------------------------------------------------------------------------------------------------------------------------
+# Compares newline-JSON with the binary encoding: bytes on the wire, and how long it takes
+# to encode a message and to decode it back out of a stream.
+#
+# Run from the project folder:  python -m benchmarks.protocol_bench
+
+SCORES = {1: 3, 2: 1, 3: 0, 4: 2}
+
+SAMPLE_MESSAGES = [
+    {"type": "FLIP_CARD", "card_index": 11},
+    {"type": "CARD_REVEALED", "card_index": 11, "identity": 5},
+    {"type": "MATCH_RESULT", "player_id": 2, "cards": [3, 11]},
+    {"type": "HIDE_CARDS", "cards": [3, 11]},
+    {"type": "YOUR_TURN", "player_id": 3, "scores": SCORES, "current_player": 3},
+    {"type": "GAME_START", "players": [1, 2, 3, 4], "scores": SCORES, "num_cards": 16},
+    {"type": "GAME_OVER", "scores": SCORES},
+    {"type": "ERROR", "message": "It's not your turn."},
+    # A mismatch as one batched frame (replaces CARD_REVEALED + HIDE_CARDS + YOUR_TURN)
+    {"type": "STATE_UPDATE", "seq": 42, "score_deltas": {}, "events": [
+        {"type": "HIDE_CARDS", "cards": [3, 11]},
+        {"type": "YOUR_TURN", "player_id": 3, "current_player": 3},
+    ]},
+]
+
+
+def decode_all(data, encoding):
+    decoder = Decoder(encoding)
+    decoder.feed(data)
+    while decoder.next_message() is not None:
+        pass
+
+
+def bench_message(message, encoding, number):
+    encode_seconds = timeit.timeit(lambda: encode_message(message, encoding), number=number)
+    payload = encode_message(message, encoding)
+    # Decode a stream of the same message so the per-message framing cost is included
+    burst = payload * 100
+    decode_seconds = timeit.timeit(lambda: decode_all(burst, encoding), number=max(1, number // 100))
+    return len(payload), encode_seconds / number * 1e6, decode_seconds / (max(1, number // 100) * 100) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the JSON and binary wire encodings')
+    parser.add_argument('--number', '-n', type=int, default=20000, help='Encodes per message type (default 20000)')
+    args = parser.parse_args()
+
+    print(f"{'message':<15}{'json B':>8}{'bin B':>8}{'json enc us':>13}{'bin enc us':>12}{'json dec us':>13}{'bin dec us':>12}")
+    totals = {JSON: [0, 0.0, 0.0], BINARY: [0, 0.0, 0.0]}
+    for message in SAMPLE_MESSAGES:
+        row = {}
+        for encoding in (JSON, BINARY):
+            row[encoding] = bench_message(message, encoding, args.number)
+            for i in range(3):
+                totals[encoding][i] += row[encoding][i]
+        print(
+            f"{message['type']:<15}{row[JSON][0]:>8}{row[BINARY][0]:>8}"
+            f"{row[JSON][1]:>13.2f}{row[BINARY][1]:>12.2f}{row[JSON][2]:>13.2f}{row[BINARY][2]:>12.2f}"
+        )
+    print(
+        f"{'total':<15}{totals[JSON][0]:>8}{totals[BINARY][0]:>8}"
+        f"{totals[JSON][1]:>13.2f}{totals[BINARY][1]:>12.2f}{totals[JSON][2]:>13.2f}{totals[BINARY][2]:>12.2f}"
+    )
+    print(f"binary is {totals[BINARY][0] / totals[JSON][0]:.0%} of the JSON bytes")
+
+
+if __name__ == '__main__':
+    main()
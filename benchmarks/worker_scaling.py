@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Worker Scaling Benchmark
+# ------------------------------------------------------------------------------------------------------------------------------
+# Runs the load generator against the server with 1, 2, 4... worker processes and prints how
+# flips/sec and latency change. Throughput should grow with the worker count until it runs out
+# of cores (the bots need cores too, so give the load generator some with --bot-processes).
+#
+# Run from the project folder:
+#   python -m benchmarks.worker_scaling --workers 1 2 4 --players 800 --games 400 --bot-processes 4
+
+
+def run_once(args, workers):
+    with tempfile.TemporaryDirectory() as folder:
+        result_path = os.path.join(folder, 'result.json')
+        server_args = f'--workers {workers} --engine {args.engine} {args.server_args}'.strip()
+        command = [sys.executable, '-m', 'benchmarks.loadgen',
+                   '--players', str(args.players), '--games', str(args.games),
+                   '--duration', str(args.duration), '--processes', str(args.bot_processes),
+                   '--server-args', server_args, '--json', result_path]
+        if args.state_updates:
+            command.append('--state-updates')
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path) as result:
+            return json.load(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='How server throughput scales with --workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts to try (default 1 2 4)')
+    parser.add_argument('--players', '-n', type=int, default=400, help='Simulated players in total (default 400)')
+    parser.add_argument('--games', '-m', type=int, default=200, help='Games they are split across (default 200)')
+    parser.add_argument('--duration', '-d', type=float, default=10, help='Seconds per run (default 10)')
+    parser.add_argument('--bot-processes', type=int, default=os.cpu_count() or 1,
+                        help='Load generator processes (default: one per core)')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='asyncio')
+    parser.add_argument('--state-updates', action='store_true', help='Bots ask for batched STATE_UPDATE frames')
+    parser.add_argument('--server-args', default='', help='Extra arguments for server.py')
+    parser.add_argument('--json', help='Also write every run to this file')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.players} players in {args.games} games, {args.engine} engine")
+    print(f"{'workers':>8}{'flips/s':>10}{'speedup':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    runs = []
+    baseline = None
+    for workers in args.workers:
+        summary = run_once(args, workers)
+        runs.append(dict(summary, workers=workers))
+        if baseline is None:
+            baseline = summary['flips_per_sec'] or 1
+        latency = summary['flip_latency_ms']
+        print(f"{workers:>8}{summary['flips_per_sec']:>10}{summary['flips_per_sec'] / baseline:>8.2f}x"
+              f"{latency['p50']:>9}{latency['p99']:>9}{summary['errors'] + summary['disconnects']:>8}")
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(runs, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,268 +1,401 @@
-import pygame
-import socket
-import threading
-import json
-import sys
+import math
+
+from game_client import GameClient
+from protocol import BINARY
 
 SERVER_HOST = 'localhost'
 SERVER_PORT = 12345
+SPECTATE = False             # Watch a game instead of playing (the server needs --spectator-port)
+SPECTATOR_PORT = 12346
+TABLE_SIZE = None            # Players you'd like at your table (2-4), None for whatever the server has going
+PLAYER_NAME = None           # Your name on the server's leaderboard (up to 24 characters), None to stay off it
+PREFERRED_ENCODING = BINARY  # Ask the server for the compact binary encoding (set to JSON to stay on JSON)
+USE_STATE_UPDATES = True     # Ask for one batched STATE_UPDATE per change instead of separate messages
+USE_CARD_ATLAS = False       # Pack all card art into one surface (one allocation) instead of one surface per card
 
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-client_socket.connect((SERVER_HOST, SERVER_PORT))
-client_socket.settimeout(1)  # Non-blocking recv
-recv_buffer = ''
-player_id = None
-my_turn = False
-game_started = False
-game_over = False
-current_player = 1                      # who's turn it is: player 1 to 4
-game_full = False
-player_disconnected = (False, None)     # (disconnected, player_id)
-pid_list = []
-running = True
-
-state_lock = threading.Lock()
-
-# save cards revealed and matched
-revealed_identities = [None] * 16
-matched_cards = [False] * 16
-max_players = 4
-scores = {} # {pid: score}
-
-
-# listening to server messages and responses, run on a thread
-def listen_to_server():
-    global recv_buffer, player_id, running
-    while running:
-        try:
-            try:
-                data = client_socket.recv(4096).decode()
-            except socket.timeout:
-                continue
-            if not data:
-                break
-            recv_buffer += data
-            while '\n' in recv_buffer:
-                line, recv_buffer = recv_buffer.split('\n', 1)
-                message = json.loads(line)
-                handle_server_message(message)
-        except Exception as e:
-            print("Server error:", e)
-            break
-
-# prints out messages from the server and changes variables based on player and game state
-def handle_server_message(message):
-    global player_id, my_turn, game_started, revealed_identities, matched_cards, scores, max_players, current_player, game_over, game_full, player_disconnected, pid_list, running, client_socket
+# The connection, the protocol and the game state live in game_client.py; this file only draws
+# the game and turns clicks into messages. pygame is imported when the window is opened (see
+# main()), so importing this file (or game_client.py) never starts a display.
+pygame = None
+game = None   # Our GameClient
 
+# prints what the player should know about, as messages arrive
+def on_server_message(message):
     msg_type = message.get("type")
-    with state_lock:
-        if msg_type == "WELCOME":
-            player_id = message["player_id"]
-            max_players = message["max_players"]
-            player_index = message["player_index"]
-            print(f"Welcome! You are Player {player_index}, there is a maximum of {max_players} players.")
-        elif msg_type == "CARD_REVEALED":
-            idx = message["card_index"]
-            identity = message["identity"]
-            revealed_identities[idx] = identity
-        elif msg_type == "MATCH_RESULT":
-            for idx in message["cards"]:
-                matched_cards[idx] = True
-            scores[str(message["player_id"])] += 1
-        elif msg_type == "HIDE_CARDS":
-            for idx in message["cards"]:
-                revealed_identities[idx] = None
-        elif msg_type == "GAME_START":
-            game_started = True
-            game_over = False
-            revealed_identities = [None] * 16
-            matched_cards = [False] * 16
-            scores = message["scores"]
-            pid_list = message["players"]
-        elif msg_type == "GAME_OVER":
-            game_over = True
-            scores = message["scores"]
-        elif msg_type == "ERROR":
-            print("Error:", message["message"])
-            if message["message"] == "Sorry, game is full.":
-                game_full = True
-        elif msg_type == "YOUR_TURN":
-            if message["player_id"] == player_id:
-                my_turn = True
-            else:
-                my_turn = False
-                current_player = message["current_player"]
-            scores = message["scores"]
-        elif msg_type == "DISCONNECT":
-            player_disconnected = True, message["player_id"]
-            game_full = False
-        elif msg_type == "GAME_FULL":
-            game_full = True
-            player_disconnected = (False, None)
-        elif msg_type == "SHUTDOWN":
-            print("Server is shutting down...")
-            running = False
-            client_socket.close()
-
-pygame.init()
-pygame.font.init()
+    if msg_type == "WELCOME":
+        print(f"Welcome! You are Player {message['player_index']}, there is a maximum of {message['max_players']} players.")
+    elif msg_type == "QUEUED":
+        eta = message.get("eta_seconds")
+        wait = f", about {eta:.0f}s to go" if eta is not None else ""
+        print(f"Every table is taken, you're number {message['position']} in line{wait}.")
+    elif msg_type == "SPECTATING":
+        if message["room_id"] is None:
+            print("Nobody is playing yet, waiting for a game to watch...")
+        else:
+            print(f"Watching room {message['room_id']}.")
+    elif msg_type == "ERROR":
+        print("Error:", message["message"])
+    elif msg_type == "SHUTDOWN":
+        print("Server is shutting down...")
+    elif msg_type == "STATE_UPDATE":
+        for event in message["events"]:
+            on_server_message(event)
 
 #  setup screen and it's parameters
 gameWidth = 1050
 gameHeight = 1000
-cardImgSize = 150
-cardColumns = 4
-cardRows = 4
-padding = 10
-leftMargin = (gameWidth - ((cardImgSize + padding) * cardColumns)) // 2
-topMargin = (gameHeight - ((cardImgSize + padding) * cardRows)) // 2
-
-screen = pygame.display.set_mode((gameWidth, gameHeight), pygame.RESIZABLE)
-
-#  setup the window and it's parameters
-pygame.display.set_caption('Memory Match')
-gameIcon = pygame.image.load('resources/assets/icon.png')
-pygame.display.set_icon(gameIcon)
-
-#  setup background and it's parameters
-bgImage = pygame.image.load('resources/assets/background.png')
-bgImage = pygame.transform.scale(bgImage, (gameWidth, gameHeight))
-bgImageRectangle = bgImage.get_rect()
-
-#  setup card images same as we have on the server
-cards = list(range(8)) * 2
-
-card_image_map = {}
-for identity in range(8):
-    image = pygame.image.load(f'resources/images/cardArt/{identity}.png')
-    image = pygame.transform.scale(image, (cardImgSize, cardImgSize))
-    card_image_map[identity] = image
-
-# Placeholder image for face-down cards
-back_image = pygame.image.load('resources/images/cardArt/back.png')
-back_image = pygame.transform.scale(back_image, (cardImgSize, cardImgSize))
-
-# Create card rects for placement
-cardRects = []
-for i in range(len(cards)):
-    rect = pygame.Rect(0, 0, cardImgSize, cardImgSize)
-    rect.x = leftMargin + ((cardImgSize + padding) * (i % cardColumns))
-    rect.y = topMargin + ((cardImgSize + padding) * (i // cardRows))
-    cardRects.append(rect)
-# Create player score text
-font = pygame.font.SysFont("Comic Sans MS", 30)
-score_texts = {i+1: font.render(f"Player {i + 1}: 0", True, (255, 255, 255)) for i in range(max_players)}
-
-threading.Thread(target=listen_to_server, daemon=True).start()
-play_again_rect = pygame.Rect(0, 0, 0, 0)
-
-while running:
-    #  load background image
-    screen.blit(bgImage, bgImageRectangle)
-
-    with state_lock:
-        # Draw cards based on current revealed/matched state
-        if game_over:
-            top_text = font.render("Game Over! Here's the results!", True, (255, 255, 255))
-            screen.blit(top_text, (gameWidth // 2 - top_text.get_width() // 2, 10))
-
-            # Display leader board
-            sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-            leader_board = []
-            for pid, score in sorted_scores:
-                pid = int(pid)
-                score_text = f"Player {pid_list.index(pid) + 1}: {score}"
-                if pid == player_id:
-                    score_text = f"Your Score: {score}"
-                leader_board.append(font.render(score_text, True, (255, 255, 255)))
-            for i, text in enumerate(leader_board):
-                if i >= max_players:
-                    break
-                x = gameWidth // 2 - text.get_width() // 2
-                y = 50 + i * 40
-                screen.blit(text, (x, y))
-            
-            # Display play again option
-            play_again_text = font.render("Click to play again", True, (255, 255, 255))
-            if player_disconnected[0]:
-                play_again_text = font.render(f"Player {pid_list.index(player_disconnected[1]) + 1} has disconnected. Waiting for new player...", True, (255, 255, 255))
-            play_again_size = play_again_text.get_size()
-            play_again_bg = pygame.Surface((play_again_size[0] + 20, play_again_size[1] + 20))
-            play_again_bg.fill((0, 0, 0))
-            play_again_bg.set_alpha(150)
-            play_again_rect = play_again_bg.get_rect(center=(gameWidth // 2, gameHeight // 2 + 100))
-            screen.blit(play_again_bg, play_again_rect)
-            
-            screen.blit(play_again_text, (play_again_rect.x + 10, play_again_rect.y + 10))
+MAX_CARD_SIZE = 150     # cards never get bigger than this
+BOARD_TOP_MARGIN = 180  # room above (and below) the board for the scores and messages
+BOARD_SIDE_MARGIN = 20
+CARD_ART_COUNT = 8      # pictures we have; bigger boards reuse them with a number on top
+FLIPPING_TINT = (70, 70, 20)  # brightens the back of a card while we wait to hear what's on it
+PREDICTION_CHECK_MS = 1000    # how often we look for flips the server never answered while waiting on one
+
+# works out the grid and card size for num_cards in the current window, and scales the card art to fit
+def layout_board():
+    global cardImgSize, padding, cardColumns, cardRows, leftMargin, topMargin, cardRects, card_image_map, back_image, flipping_image, card_faces, laid_out_cards
+    num_cards = game.num_cards
+    cardColumns = max(1, math.ceil(math.sqrt(num_cards)))
+    cardRows = max(1, math.ceil(num_cards / cardColumns))
+    # Biggest square cell that fits (16 cards in the starting window get 150px cards with 10px gaps)
+    cell = min(MAX_CARD_SIZE + MAX_CARD_SIZE // 15,
+               (gameWidth - 2 * BOARD_SIDE_MARGIN) // cardColumns,
+               (gameHeight - 2 * BOARD_TOP_MARGIN) // cardRows)
+    cell = max(cell, 3)
+    padding = max(1, cell // 16)
+    cardImgSize = cell - padding
+    leftMargin = (gameWidth - ((cardImgSize + padding) * cardColumns)) // 2
+    topMargin = (gameHeight - ((cardImgSize + padding) * cardRows)) // 2
+
+    card_names = list(range(CARD_ART_COUNT)) + ['back']
+    if USE_CARD_ATLAS:
+        card_images = assets.atlas(card_names, (cardImgSize, cardImgSize))
+    else:
+        card_images = {name: assets.scaled(name, (cardImgSize, cardImgSize)) for name in card_names}
+    card_image_map = {identity: card_images[identity] for identity in range(CARD_ART_COUNT)}
+    back_image = card_images['back']
+    # A card we've flipped but never seen the face of, shown until the server tells us what it is
+    flipping_image = back_image.copy()
+    flipping_image.fill(FLIPPING_TINT, special_flags=pygame.BLEND_RGB_ADD)
+    card_faces = {}
+
+    # Create card rects for placement
+    cardRects = []
+    for i in range(num_cards):
+        rect = pygame.Rect(0, 0, cardImgSize, cardImgSize)
+        rect.x = leftMargin + ((cardImgSize + padding) * (i % cardColumns))
+        rect.y = topMargin + ((cardImgSize + padding) * (i // cardColumns))
+        cardRects.append(rect)
+    laid_out_cards = num_cards
+
+# the picture for a card: its art, with the identity written on it when there are more pairs than pictures
+def card_face(identity):
+    surface = card_faces.get(identity)
+    if surface is None:
+        art = card_image_map[identity % CARD_ART_COUNT]
+        if identity < CARD_ART_COUNT:
+            surface = art
+        else:
+            surface = art.copy()
+            label_font = pygame.font.SysFont("Comic Sans MS", max(8, cardImgSize // 3))
+            label = label_font.render(str(identity), True, (255, 255, 255), (0, 0, 0))
+            surface.blit(label, label.get_rect(center=surface.get_rect().center))
+        card_faces[identity] = surface
+    return surface
+
+# which card is under this point, if any
+def card_at(pos):
+    col = (pos[0] - leftMargin) // (cardImgSize + padding)
+    row = (pos[1] - topMargin) // (cardImgSize + padding)
+    if 0 <= col < cardColumns and 0 <= row < cardRows:
+        i = row * cardColumns + col
+        if i < len(cardRects) and cardRects[i].collidepoint(pos):
+            return i
+    return None
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Drawing Only What Changed
+# ------------------------------------------------------------------------------------------------------------------------------
+# Each frame we describe the screen as a list of (key, surface, rect), compare it with what's
+# already drawn, and repaint only the rectangles that changed. Text is rendered once per string
+# and reused, so an unchanged screen costs nothing. When nothing is going on the loop sleeps
+# until there's input or a message from the server.
+
+MAX_FPS = 30                          # Never draw more often than this
+TEXT_CACHE_SIZE = 256                 # Rendered strings we keep around
+WHITE = (255, 255, 255)
+
+text_cache = {}      # string -> rendered surface
+drawn_scene = {}     # key -> (surface, rect) currently on the screen
+play_again_bgs = {}  # size -> translucent box behind the play again text
+
+
+# let the main loop know there's something new to draw (safe to call from the listener thread)
+def wake_up_main_loop():
+    if pygame.get_init():
+        pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+
+# renders a line of text, or hands back the one we rendered last time
+def render_text(text):
+    surface = text_cache.get(text)
+    if surface is None:
+        if len(text_cache) >= TEXT_CACHE_SIZE:
+            text_cache.clear()
+        surface = text_cache[text] = font.render(text, True, WHITE)
+    return surface
+
+# a translucent black box of the given size, made once per size
+def play_again_background(size):
+    surface = play_again_bgs.get(size)
+    if surface is None:
+        surface = play_again_bgs[size] = pygame.Surface(size)
+        surface.fill((0, 0, 0))
+        surface.set_alpha(150)
+    return surface
+
+# the all-time leaderboard lines for the game over screen
+def leaderboard_lines(message):
+    lines = ["Top players"]
+    for rank, player in enumerate(message["top"], 1):
+        lines.append(f"{rank}. {player['name']}: {player['wins']} wins, {player['points']} points")
+    you = message.get("you")
+    if you is not None:
+        rank = f"#{you['rank']}, " if you["rank"] is not None else ""
+        lines.append(f"You ({you['name']}): {rank}{you['wins']} wins in {you['games']} games")
+    return lines
+
+# everything that should be on the screen right now, in drawing order (call with game.lock held)
+def build_scene():
+    global play_again_rect
+    scene = []
+    pid_list = game.pid_list
+    player_disconnected = game.player_disconnected
+
+    def add_centered(key, text, y):
+        surface = render_text(text)
+        scene.append((key, surface, surface.get_rect(topleft=(gameWidth // 2 - surface.get_width() // 2, y))))
+
+    if game.game_over:
+        add_centered("top", "Game Over! Here's the results!", 10)
+
+        # Display leader board
+        sorted_scores = sorted(game.scores.items(), key=lambda x: x[1], reverse=True)
+        for i, (pid, score) in enumerate(sorted_scores[:game.max_players]):
+            pid = int(pid)
+            score_text = f"Player {pid_list.index(pid) + 1}: {score}"
+            if pid == game.player_id:
+                score_text = f"Your Score: {score}"
+            add_centered(("leader", i), score_text, 50 + i * 40)
+
+        # The all-time leaderboard, if the server keeps one (it arrives a moment after the game ends)
+        if game.leaderboard is not None:
+            board_top = 50 + game.max_players * 40 + 20
+            fits = (gameHeight // 2 + 60 - board_top) // 36  # lines above the play again box
+            for i, text in enumerate(leaderboard_lines(game.leaderboard)[:max(0, fits)]):
+                add_centered(("board", i), text, board_top + i * 36)
+
+        # Display play again option
+        play_again_text = "Click to play again"
+        if not game.connected:
+            play_again_text = "The server stopped answering." if game.server_lost else "Lost connection to the server."
+        elif game.spectator:
+            play_again_text = "Waiting for the next game..."
+        elif player_disconnected[0]:
+            play_again_text = f"Player {pid_list.index(player_disconnected[1]) + 1} has disconnected. Waiting for new player..."
+        text_surface = render_text(play_again_text)
+        play_again_size = text_surface.get_size()
+        play_again_bg = play_again_background((play_again_size[0] + 20, play_again_size[1] + 20))
+        play_again_rect = play_again_bg.get_rect(center=(gameWidth // 2, gameHeight // 2 + 100))
+        scene.append(("play_again_bg", play_again_bg, play_again_rect))
+        scene.append(("play_again", text_surface, text_surface.get_rect(topleft=(play_again_rect.x + 10, play_again_rect.y + 10))))
+        return scene
+
+    # Draw cards based on current revealed/matched state, and our flips the server hasn't answered yet
+    revealed_identities = game.revealed_identities
+    matched_cards = game.matched_cards
+    predicted = game.predicted_flips()
+    for i, rect in enumerate(cardRects):
+        if matched_cards[i] or revealed_identities[i] is not None:
+            identity = revealed_identities[i] if revealed_identities[i] is not None else 0
+            scene.append((("card", i), card_face(identity), rect))
+        elif i in predicted:
+            identity = predicted[i]
+            scene.append((("card", i), card_face(identity) if identity is not None else flipping_image, rect))
         else:
-            for i, rect in enumerate(cardRects):
-                if matched_cards[i] or revealed_identities[i] is not None:
-                    identity = revealed_identities[i] if revealed_identities[i] is not None else 0
-                    screen.blit(card_image_map[identity], rect)
-                else:
-                    screen.blit(back_image, rect)
-            # update player scores
-            for pid, score in scores.items():
-                pid = int(pid)
-                player_idx = pid_list.index(pid) + 1
-                score_text = f"Player {player_idx}: {score}"
-                if pid == player_id:
-                    score_text = f"Your Score: {score}"
-                score_texts[player_idx] = font.render(score_text, True, (255, 255, 255))
-            # Draw player scores
-            for i, text in score_texts.items():
-                if i > max_players:
-                    break
-                screen.blit(text, (10, 10 + int(i) * 40))
-            # Draw top text
-            if not game_started and not game_full:
-                top_text = font.render("Waiting for players", True, (255, 255, 255))
-            elif game_full and player_id is None:
-                top_text = font.render("Game is full. Please retry later.", True, (255, 255, 255))
-            elif player_disconnected[0] and not game_full:
-                top_text = font.render(f"Player {pid_list.index(player_disconnected[1]) + 1} has disconnected. Waiting for new player...", True, (255, 255, 255))
-            else:
-                if my_turn:
-                    top_text = font.render("Your turn! Click to flip a card.", True, (255, 255, 255))
-                else:
-                    top_text = font.render(f"Player {current_player}'s turn: Waiting for your turn...", True, (255, 255, 255))
-    screen.blit(top_text, (gameWidth // 2 - top_text.get_width() // 2, 10))
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        #  screen resizing
-        elif event.type == pygame.VIDEORESIZE:
-            gameWidth = event.w
-            gameHeight = event.h
-            screen = pygame.display.set_mode((gameWidth, gameHeight), pygame.RESIZABLE)
-            bgImage = pygame.transform.scale(bgImage, (gameWidth, gameHeight))
-            leftMargin = (gameWidth - ((cardImgSize + padding) * cardColumns)) // 2
-            topMargin = (gameHeight - ((cardImgSize + padding) * cardRows)) // 2
-            for i in range(len(cardRects)):
-                cardRects[i].x = leftMargin + ((cardImgSize + padding) * (i % cardColumns))
-                cardRects[i].y = topMargin + ((cardImgSize + padding) * (i // cardRows))
-        #  on click
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            with state_lock:
-                if not game_started:
-                    continue
-                if not my_turn and not game_over:
-                    continue
-                if game_over:
-                    if play_again_rect.collidepoint(event.pos):
-                        message = {"type": "PLAY_AGAIN"}
-                        client_socket.sendall((json.dumps(message) + '\n').encode())
-                    continue
-            # sending flip card messages to the server
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            for i, rect in enumerate(cardRects):
-                if rect.collidepoint(mouse_x, mouse_y):
-                    if player_id is not None and not player_disconnected[0]:
-                        message = {"type": "FLIP_CARD", "card_index": i}
-                        client_socket.sendall((json.dumps(message) + '\n').encode())
-                    break
-
-    pygame.display.update()
-
-client_socket.close()
-pygame.quit()
+            scene.append((("card", i), back_image, rect))
+    # update player scores
+    for pid, score in game.scores.items():
+        pid = int(pid)
+        player_idx = pid_list.index(pid) + 1
+        score_text = f"Player {player_idx}: {score}"
+        if pid == game.player_id:
+            score_text = f"Your Score: {score}"
+        score_lines[player_idx] = score_text
+    # Draw player scores
+    for i, text in score_lines.items():
+        if i > game.max_players:
+            break
+        surface = render_text(text)
+        scene.append((("score", i), surface, surface.get_rect(topleft=(10, 10 + int(i) * 40))))
+    # Draw top text
+    if not game.connected:
+        top_text = "The server stopped answering." if game.server_lost else "Lost connection to the server."
+    elif game.queue_position is not None:
+        top_text = f"Waiting for a seat: number {game.queue_position} in line"
+        if game.queue_eta is not None:
+            top_text += f" (about {game.queue_eta:.0f}s)"
+    elif not game.game_started and not game.game_full:
+        top_text = "Waiting for players"
+    elif game.spectator:
+        top_text = f"Watching room {game.watching_room}: Player {game.current_player}'s turn"
+    elif game.game_full and game.player_id is None:
+        top_text = "Game is full. Please retry later."
+    elif player_disconnected[0] and not game.game_full:
+        top_text = f"Player {pid_list.index(player_disconnected[1]) + 1} has disconnected. Waiting for new player..."
+    elif game.my_turn:
+        top_text = "Your turn! Click to flip a card."
+    else:
+        top_text = f"Player {game.current_player}'s turn: Waiting for your turn..."
+    add_centered("top", top_text, 10)
+    return scene
+
+# draws whatever changed since last frame and returns the rectangles of the screen to update
+def draw_scene(scene, full_redraw=False):
+    global drawn_scene
+    new_scene = {key: (surface, rect) for key, surface, rect in scene}
+    if full_redraw:
+        dirty = [screen.get_rect()]
+    else:
+        dirty = []
+        for key, (surface, rect) in new_scene.items():
+            old = drawn_scene.get(key)
+            if old is None or old[0] is not surface or old[1] != rect:
+                dirty.append(rect.copy())
+                if old is not None:
+                    dirty.append(old[1])
+        for key, (_, rect) in drawn_scene.items():
+            if key not in new_scene:
+                dirty.append(rect)
+    # Remember copies, so moving a card rect later still counts as a change
+    drawn_scene = {key: (surface, rect.copy()) for key, (surface, rect) in new_scene.items()}
+
+    # Repaint each changed area: background first, then everything that overlaps it, in order
+    for area in dirty:
+        screen.set_clip(area)
+        screen.blit(bgImage, area, area)
+        for _, surface, rect in scene:
+            if rect.colliderect(area):
+                screen.blit(surface, rect)
+    screen.set_clip(None)
+    return dirty
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Window
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def main():
+    global pygame, game, assets, screen, bgImage, bgImageRectangle, font, score_lines, play_again_rect, NETWORK_EVENT, gameWidth, gameHeight
+    game = GameClient(PREFERRED_ENCODING, USE_STATE_UPDATES)
+    game.on_message = on_server_message
+    game.connect(SERVER_HOST, SPECTATOR_PORT if SPECTATE else SERVER_PORT)
+    if not SPECTATE:
+        game.join(TABLE_SIZE, PLAYER_NAME)
+
+    import pygame
+    from assets import AssetManager
+    pygame.init()
+    pygame.font.init()
+    NETWORK_EVENT = pygame.USEREVENT + 1  # Posted by the listener thread when the game state changed
+
+    screen = pygame.display.set_mode((gameWidth, gameHeight), pygame.RESIZABLE)
+
+    #  setup the window and it's parameters
+    pygame.display.set_caption('Memory Match')
+    gameIcon = pygame.image.load('resources/assets/icon.png')
+    pygame.display.set_icon(gameIcon)
+
+    #  load every image once, already in the screen's pixel format
+    assets = AssetManager()
+    assets.load('background', 'resources/assets/background.png', opaque=True)
+    for identity in range(CARD_ART_COUNT):
+        assets.load(identity, f'resources/images/cardArt/{identity}.png')
+    assets.load('back', 'resources/images/cardArt/back.png')  # Placeholder image for face-down cards
+
+    #  setup background and it's parameters
+    bgImage = assets.scaled('background', (gameWidth, gameHeight))
+    bgImageRectangle = bgImage.get_rect()
+
+    with game.lock:
+        layout_board()
+    # Create player score text
+    font = pygame.font.SysFont("Comic Sans MS", 30)
+    score_lines = {i+1: f"Player {i + 1}: 0" for i in range(game.max_players)}
+
+    game.on_update = wake_up_main_loop
+    game.start_listener()
+    play_again_rect = pygame.Rect(0, 0, 0, 0)
+    # Nothing on screen follows the mouse, so don't wake up every time it moves
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    clock = pygame.time.Clock()
+    full_redraw = True
+    running = True
+
+    while running and game.running:
+        events = pygame.event.get()
+        if not events and not full_redraw:
+            # Nothing to do: sleep until the player does something or the server tells us something
+            # (waking up now and then while a flip is unanswered, so it can time out)
+            with game.lock:
+                waiting_on_server = bool(game.pending_flips)
+            events = [pygame.event.wait(PREDICTION_CHECK_MS if waiting_on_server else 0)]
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            #  screen resizing
+            elif event.type == pygame.VIDEORESIZE:
+                gameWidth = event.w
+                gameHeight = event.h
+                screen = pygame.display.set_mode((gameWidth, gameHeight), pygame.RESIZABLE)
+                # Always scaled from the original, and cached, so resizing back and forth stays sharp and cheap
+                bgImage = assets.scaled('background', (gameWidth, gameHeight))
+                with game.lock:
+                    layout_board()
+                full_redraw = True
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                full_redraw = True
+            #  on click
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                with game.lock:
+                    if not game.game_started or game.spectator:
+                        continue
+                    if not game.my_turn and not game.game_over:
+                        continue
+                    if game.game_over:
+                        if play_again_rect.collidepoint(event.pos):
+                            game.play_again()
+                        continue
+                    can_flip = game.player_id is not None and not game.player_disconnected[0]
+                # sending flip card messages to the server; the card shows as flipped this frame, not when the server answers
+                i = card_at(event.pos)
+                if i is not None and can_flip:
+                    game.flip_card(i)
+
+        with game.lock:
+            if game.num_cards != laid_out_cards:
+                # The server started a game with a different board size
+                layout_board()
+                full_redraw = True
+            scene = build_scene()
+        dirty = draw_scene(scene, full_redraw)
+        full_redraw = False
+        if dirty:
+            pygame.display.update(dirty)
+        # Cap the frame rate for when events keep coming
+        clock.tick(MAX_FPS)
+
+    game.close()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+import selectors
+import socket
+import threading
+import time
+
+from protocol import BINARY, CARD_DOWN, CARD_MATCHED, HEARTBEAT, JSON, STATE_UPDATES, Decoder, encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Headless Game Client
+# ------------------------------------------------------------------------------------------------------------------------------
+# Everything a player needs except the window: the connection, the protocol, and our copy of
+# the table. client.py draws it with pygame, but it works on its own too (no display, no pygame),
+# so bots and tests can start as many players as they like:
+#
+#   game = GameClient()
+#   game.on_message = lambda message: print(message["type"])
+#   game.connect('localhost', 12345)
+#   game.join()            # or game.join(3) for a table of three, game.join(name="sam") to be on the leaderboard
+#   while game.running and game.connected:
+#       game.poll()
+#
+# The socket is non-blocking. poll() waits for the server and handles whatever arrived. To run
+# lots of players from one thread, put each one's fileno() in a selector and call receive() when
+# it's readable (and flush() when it's writable, while wants_write()). feed() and data_to_send()
+# don't touch the socket at all, for driving the client from something else (like asyncio).
+#
+# join() tells the server we're ready for a seat. While every table is taken the server sends
+# QUEUED messages instead, and queue_position / queue_eta say where we are in line until WELCOME.
+# Servers with a leaderboard send one after each game; it's kept in leaderboard until the next game starts.
+#
+# flip_card() doesn't wait for the server to show the card: if the flip looks legal from here it
+# goes in pending_flips straight away, and predicted_flips() says what to draw for it (the face,
+# if we've seen that card before this game, otherwise None for "being flipped"). The server still
+# decides. CARD_REVEALED confirms a pending flip; an ERROR naming the card ("It's not your turn.",
+# "Cannot flip that card.") takes it back, and so does anything that ends the turn. Older servers
+# don't name the card, so any ERROR takes back every pending flip, and one the server never
+# answers is forgotten after PREDICTION_TIMEOUT_SECONDS.
+#
+# If the server offers heartbeats we turn them on: it PINGs us when we've been quiet, and we
+# PING it when it has. poll() notices a server that has gone silent for longer than its
+# timeout (say, the network dropped without the connection closing), and then connected goes
+# False and server_lost True, just like the connection closing. (Drive the client yourself
+# and call check_server() now and then to get the same.)
+#
+# Connect to the server's --spectator-port instead (and don't join()) and the same client watches a game: the server
+# says SPECTATING, sends a SNAPSHOT and then STATE_UPDATE frames, and player_id stays None.
+
+DEFAULT_NUM_CARDS = 16   # Board size for servers that don't send num_cards
+READ_CHUNK_BYTES = 65536  # How much we ask for per recv
+PREDICTION_TIMEOUT_SECONDS = 5.0  # Give up on a flip the server hasn't answered by then
+
+
+class GameClient:
+    """
+    One player's connection to the server and their view of the game.
+    The game state only changes while holding lock, so another thread (like a GUI) can read it safely.
+    """
+
+    def __init__(self, preferred_encoding=BINARY, use_state_updates=True, use_heartbeat=True):
+        self.preferred_encoding = preferred_encoding  # Encoding we ask for if the server offers it
+        self.use_state_updates = use_state_updates    # Ask for batched STATE_UPDATE frames if offered
+        self.use_heartbeat = use_heartbeat            # Ask for heartbeats if offered
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.sock = None
+        self.selector = None
+        self.listener = None
+        self.connected = False
+        self.running = True       # False once we close or the server shuts down
+        self.decoder = Decoder()  # Reads newline-JSON until the server confirms another encoding
+        self.send_encoding = JSON  # What we send the server in
+        self.outgoing = bytearray()  # Bytes the socket couldn't take yet
+        self.on_message = None    # Called (without lock held) with every message, after it's applied
+        self.on_update = None     # Called after each batch of messages, and when the connection ends
+        self.ping_interval = None # Heartbeat settings from the server (None until it agrees to heartbeats)
+        self.ping_timeout = None
+        self.last_heard = time.monotonic()  # When the server last sent us anything
+        self.is_ping_sent = False # We've asked a quiet server whether it's still there
+        self.server_lost = False  # The server went silent for longer than ping_timeout
+
+        # Our copy of the table
+        self.last_seq = None      # seq of the last STATE_UPDATE we applied (None until the first SNAPSHOT)
+        self.player_id = None
+        self.spectator = False    # True once the server says we're only watching
+        self.watching_room = None # Room we're watching (None while there's no game to watch)
+        self.max_players = 4
+        self.my_turn = False
+        self.game_started = False
+        self.game_over = False
+        self.current_player = 1   # whose turn it is: player 1 to 4
+        self.game_full = False
+        self.queue_position = None  # Our place in line while waiting for a seat (None once we have one)
+        self.queue_eta = None       # Server's guess at how many seconds that will take (None if it can't tell)
+        self.player_disconnected = (False, None)  # (disconnected, player_id)
+        self.pid_list = []
+        self.scores = {}          # {pid: score}
+        self.leaderboard = None   # The last LEADERBOARD message ("top" players, and "you"), until the next game
+        self.pending_flips = {}   # {card_index: when we sent it}, flips we show before the server answers
+        self.reset_board(DEFAULT_NUM_CARDS)
+
+    def reset_board(self, num_cards):
+        self.num_cards = num_cards
+        self.revealed_identities = [None] * num_cards
+        self.matched_cards = bytearray(num_cards)
+        self.seen_identities = [None] * num_cards  # Every face we've been shown this game, for predicting flips
+        self.pending_flips.clear()
+
+    def connect(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.connected = True
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, message):
+        """
+        Queue a message for the server and send as much as the socket will take right now.
+        """
+        with self.send_lock:
+            self.outgoing += encode_message(message, self.send_encoding)
+            self._flush_locked()
+
+    def join(self, players=None, name=None):
+        """
+        Ask for a seat at a table for players people (2-4), or at any table if None,
+        as name on the leaderboard (None to stay off it).
+        """
+        message = {"type": "JOIN"}
+        if players is not None:
+            message["players"] = players
+        if name is not None:
+            message["name"] = name
+        self.send(message)
+
+    def flip_card(self, card_index):
+        """
+        Ask the server to flip a card, and show it flipping right away if that looks allowed (see pending_flips).
+        """
+        with self.lock:
+            if self.can_predict_flip(card_index):
+                self.pending_flips[card_index] = time.monotonic()
+        self.send({"type": "FLIP_CARD", "card_index": card_index})
+
+    def can_predict_flip(self, card_index):
+        """
+        True if, as far as we know, the server will let us flip this card (call with lock held).
+        """
+        if not (self.game_started and self.my_turn) or self.game_over or self.spectator:
+            return False
+        if not 0 <= card_index < self.num_cards or card_index in self.pending_flips:
+            return False
+        if self.matched_cards[card_index] or self.revealed_identities[card_index] is not None:
+            return False
+        # Two cards up already (ours, or a mismatch still on show) and the server says "please wait"
+        face_up = sum(1 for idx, identity in enumerate(self.revealed_identities)
+                      if identity is not None and not self.matched_cards[idx])
+        return face_up + len(self.pending_flips) < 2
+
+    def predicted_flips(self):
+        """
+        {card_index: identity} for the flips we're showing before the server has answered (call with lock held).
+        identity is None for a card we've never seen face-up.
+        """
+        pending = self.pending_flips
+        if not pending:
+            return {}
+        too_old = time.monotonic() - PREDICTION_TIMEOUT_SECONDS
+        for idx in [idx for idx, sent in pending.items() if sent < too_old]:
+            del pending[idx]
+        return {idx: self.seen_identities[idx] for idx in pending}
+
+    def play_again(self):
+        self.send({"type": "PLAY_AGAIN"})
+
+    def wants_write(self):
+        return bool(self.outgoing)
+
+    def flush(self):
+        """
+        Send what's waiting. True once everything has gone out.
+        """
+        with self.send_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        if self.sock is None or not self.connected:
+            # Not on a socket (see data_to_send), or the connection is gone
+            return not self.outgoing
+        while self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # The reader will notice the connection is gone
+                self.outgoing.clear()
+                break
+            del self.outgoing[:sent]
+        return not self.outgoing
+
+    def data_to_send(self):
+        """
+        Take the bytes waiting to go to the server, for when something else does the sending.
+        """
+        with self.send_lock:
+            data = bytes(self.outgoing)
+            self.outgoing.clear()
+        return data
+
+    def receive(self):
+        """
+        Read and handle everything the server has sent so far, without waiting.
+        False once the connection has closed.
+        """
+        try:
+            while True:
+                try:
+                    data = self.sock.recv(READ_CHUNK_BYTES)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    data = b''
+                if not data:
+                    self.connected = False
+                    break
+                self.last_heard = time.monotonic()
+                self.is_ping_sent = False
+                self.feed(data)
+                if len(data) < READ_CHUNK_BYTES:
+                    # That's all for now
+                    break
+        finally:
+            if self.on_update is not None:
+                self.on_update()
+        return self.connected
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) for the server, then handle what it sent.
+        False once the connection has closed.
+        """
+        if not self.connected:
+            return False
+        events = selectors.EVENT_READ
+        if self.outgoing:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(self.sock, events)
+        if self.ping_interval is not None:
+            # Wake up in time to check on a quiet server
+            timeout = self.ping_interval if timeout is None else min(timeout, self.ping_interval)
+        for _, mask in self.selector.select(timeout):
+            if mask & selectors.EVENT_WRITE:
+                self.flush()
+            if mask & selectors.EVENT_READ:
+                self.receive()
+        if self.connected:
+            self.check_server()
+        return self.connected
+
+    def check_server(self):
+        """
+        PING a server that's been quiet for ping_interval, and give up on one that's been silent
+        for ping_timeout. False once we've given up (or the connection closed).
+        """
+        if self.ping_interval is None or not self.connected:
+            return self.connected
+        quiet = time.monotonic() - self.last_heard
+        if quiet >= self.ping_timeout:
+            print(f"Haven't heard from the server for {quiet:.0f}s, it's gone.")
+            self.server_lost = True
+            self.connected = False
+            if self.on_update is not None:
+                self.on_update()
+        elif quiet >= self.ping_interval and not self.is_ping_sent:
+            self.is_ping_sent = True
+            self.send({"type": "PING"})
+        return self.connected
+
+    def listen(self):
+        """
+        Handle messages until the connection closes or close() is called.
+        """
+        try:
+            while self.running and self.poll():
+                pass
+        except Exception as error:
+            print("Server error:", error)
+
+    def start_listener(self):
+        """
+        Run listen() on a background thread.
+        """
+        self.listener = threading.Thread(target=self.listen, name='game-client', daemon=True)
+        self.listener.start()
+
+    def close(self):
+        self.running = False
+        if self.sock is None:
+            return
+        try:
+            # Wakes the listener thread (if there is one) so it can finish
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.listener is not None and self.listener is not threading.current_thread():
+            self.listener.join(timeout=1)
+        self.connected = False
+        self.selector.close()
+        self.sock.close()
+
+    def feed(self, data):
+        """
+        Handle bytes from the server. Returns the messages they completed.
+        """
+        self.decoder.feed(data)
+        messages = []
+        message = self.decoder.next_message()
+        while message is not None:
+            with self.lock:
+                self.apply_message(message)
+            messages.append(message)
+            if self.on_message is not None:
+                self.on_message(message)
+            message = self.decoder.next_message()
+        return messages
+
+    def apply_message(self, message, in_frame=False):
+        """
+        Apply one message to our copy of the game (call with lock held).
+        in_frame is True for events inside a STATE_UPDATE, whose score changes come with the frame instead.
+        """
+        msg_type = message.get("type")
+        if msg_type == "WELCOME":
+            self.queue_position = None
+            self.queue_eta = None
+            self.player_id = message["player_id"]
+            self.max_players = message["max_players"]
+            self.negotiate_encoding(message)
+            # Same for batched state updates; the server answers with a SNAPSHOT to start from
+            if self.use_state_updates and STATE_UPDATES in message.get("features", []):
+                self.send({"type": "ENABLE_FEATURE", "feature": STATE_UPDATES})
+            if self.use_heartbeat and HEARTBEAT in message.get("features", []):
+                self.send({"type": "ENABLE_FEATURE", "feature": HEARTBEAT})
+        elif msg_type == "HEARTBEAT":
+            self.ping_interval = message["interval"]
+            self.ping_timeout = message["timeout"]
+        elif msg_type == "PING":
+            self.send({"type": "PONG"})
+        elif msg_type == "QUEUED":
+            self.queue_position = message["position"]
+            self.queue_eta = message.get("eta_seconds")
+        elif msg_type == "SPECTATING":
+            # Spectators always get STATE_UPDATE frames, starting from the SNAPSHOT that follows
+            self.spectator = True
+            self.watching_room = message["room_id"]
+            self.negotiate_encoding(message)
+        elif msg_type == "ENCODING":
+            # Everything after this message comes in the new encoding
+            self.decoder.encoding = message["encoding"]
+        elif msg_type == "STATE_UPDATE":
+            self.apply_state_update(message)
+        elif msg_type == "SNAPSHOT":
+            self.apply_snapshot(message)
+        elif msg_type == "CARD_REVEALED":
+            idx = message["card_index"]
+            self.revealed_identities[idx] = message["identity"]
+            self.seen_identities[idx] = message["identity"]
+            self.pending_flips.pop(idx, None)
+        elif msg_type == "MATCH_RESULT":
+            for idx in message["cards"]:
+                self.matched_cards[idx] = 1
+            if not in_frame:
+                self.scores[str(message["player_id"])] += 1
+        elif msg_type == "HIDE_CARDS":
+            for idx in message["cards"]:
+                self.revealed_identities[idx] = None
+        elif msg_type == "GAME_START":
+            self.game_started = True
+            self.game_over = False
+            self.leaderboard = None
+            self.reset_board(message.get("num_cards", DEFAULT_NUM_CARDS))
+            if "scores" in message:
+                self.scores = message["scores"]
+            self.pid_list = message["players"]
+        elif msg_type == "GAME_OVER":
+            self.game_over = True
+            self.pending_flips.clear()
+        elif msg_type == "LEADERBOARD":
+            self.leaderboard = message
+        elif msg_type == "ERROR":
+            if message["message"] == "Sorry, game is full.":
+                self.game_full = True
+            # The server said no to a flip we're already showing: put it back
+            if "card_index" in message:
+                self.pending_flips.pop(message["card_index"], None)
+            else:
+                self.pending_flips.clear()
+        elif msg_type == "YOUR_TURN":
+            if message["player_id"] == self.player_id:
+                self.my_turn = True
+            else:
+                self.my_turn = False
+                self.current_player = message["current_player"]
+                self.pending_flips.clear()
+            if "scores" in message:
+                self.scores = message["scores"]
+        elif msg_type == "DISCONNECT":
+            self.player_disconnected = True, message["player_id"]
+            self.pending_flips.clear()
+            self.game_full = False
+        elif msg_type == "GAME_FULL":
+            self.game_full = True
+            self.player_disconnected = (False, None)
+        elif msg_type == "SHUTDOWN":
+            self.running = False
+
+    def negotiate_encoding(self, message):
+        # Newer servers can speak binary; older ones don't offer it and we stay on JSON
+        encoding = self.preferred_encoding
+        if encoding in message.get("encodings", []) and encoding != self.send_encoding:
+            self.send({"type": "SET_ENCODING", "encoding": encoding})
+            self.send_encoding = encoding
+
+    def apply_state_update(self, message):
+        """
+        Apply a batched STATE_UPDATE frame, or ask for a SNAPSHOT if we missed one.
+        """
+        if self.last_seq is None:
+            # Still waiting for a snapshot, it already includes this frame
+            return
+        if message["seq"] != self.last_seq + 1:
+            print(f"Missed an update (expected {self.last_seq + 1}, got {message['seq']}), asking for a snapshot.")
+            self.last_seq = None
+            self.send({"type": "SNAPSHOT_REQUEST"})
+            return
+        self.last_seq = message["seq"]
+        for event in message["events"]:
+            self.apply_message(event, in_frame=True)
+        if "scores" in message:
+            self.scores = {str(pid): score for pid, score in message["scores"].items()}
+        else:
+            for pid, delta in message["score_deltas"].items():
+                self.scores[str(pid)] = self.scores.get(str(pid), 0) + delta
+
+    def apply_snapshot(self, message):
+        """
+        Replace our whole copy of the table with the server's.
+        """
+        self.last_seq = message["seq"]
+        self.pid_list = message["players"]
+        self.scores = {str(pid): score for pid, score in message["scores"].items()}
+        self.game_started = message["started"]
+        self.game_over = message["game_over"]
+        self.reset_board(message.get("num_cards", DEFAULT_NUM_CARDS))
+        faces = iter(message["faces"])
+        for idx, state in enumerate(bytes.fromhex(message["states"])):
+            if state != CARD_DOWN:
+                self.revealed_identities[idx] = self.seen_identities[idx] = next(faces)
+            if state == CARD_MATCHED:
+                self.matched_cards[idx] = 1
+        if "player_id" in message:
+            self.my_turn = message["player_id"] == self.player_id
+            if not self.my_turn:
+                self.current_player = message["current_player"]
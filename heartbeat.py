@@ -0,0 +1,119 @@
+import threading
+
+import metrics
+from protocol import encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Heartbeats
+# ------------------------------------------------------------------------------------------------------------------------------
+# A player whose computer vanishes (pulled cable, laptop lid, crash) doesn't close their
+# connection, so recv() just keeps waiting and the kernel may take minutes to give up. If it
+# was their turn, the whole table waits with it. Heartbeats find them within seconds.
+#
+# It's an optional feature, like state updates: WELCOME offers "heartbeat" and a client that
+# wants it sends {"type": "ENABLE_FEATURE", "feature": "heartbeat"}. The server answers with
+#
+#   {"type": "HEARTBEAT", "interval": 2.0, "timeout": 6.0}
+#
+# and from then on:
+#   - every --ping-interval seconds, a player we haven't heard from since last time gets
+#     {"type": "PING"} and answers {"type": "PONG"}. Anything else they send counts too.
+#   - a player we haven't heard from for --ping-timeout seconds is disconnected, and the table
+#     is held for a replacement like for any other disconnect (see Room.hold_for_replacement),
+#     so the next person in line takes the seat and the game goes on.
+#   - the client does the same the other way around: it sends PING when the server has been
+#     quiet for interval seconds, and gives up on a server it hasn't heard from for timeout.
+#
+# Clients that never ask are never pinged or timed out, so older ones (which wouldn't answer) keep working.
+#
+# The checks run on the rooms' scheduler (the DeadlineScheduler thread, or the asyncio loop),
+# and only while someone has heartbeats on. The read loops just set conn.heard_from after every
+# read, so a busy connection costs nothing extra.
+
+DEFAULT_INTERVAL = 2.0  # Seconds between checks (0 = no heartbeats)
+DEFAULT_TIMEOUT = 6.0   # Seconds of silence before we give up on someone
+
+interval = DEFAULT_INTERVAL
+timeout = DEFAULT_TIMEOUT
+
+
+def is_enabled():
+    return interval > 0
+
+
+class HeartbeatMonitor:
+    """
+    Pings the quiet players in every room and disconnects the ones that stopped answering.
+    Uses the same scheduler as the rooms.
+    """
+
+    def __init__(self, registry, scheduler, lock_factory=threading.Lock):
+        self.registry = registry
+        self.scheduler = scheduler
+        self.lock = lock_factory()
+        self.is_tick_scheduled = False
+        self.pings = {}  # encoding -> encoded PING, they're all the same
+
+    def start(self, conn):
+        """
+        A player turned heartbeats on. Tell them how often we'll check.
+        """
+        conn.wants_heartbeat = True
+        conn.heard_from = True
+        conn.quiet_checks = 0
+        conn.send_payload(encode_message({"type": "HEARTBEAT", "interval": interval, "timeout": timeout}, conn.encoding))
+        with self.lock:
+            if not self.is_tick_scheduled:
+                self.is_tick_scheduled = True
+                self.scheduler.call_later(interval, self.tick)
+
+    def tick(self):
+        """
+        One round of checks: ping whoever has been quiet since the last one, hang up on whoever
+        has been quiet for longer than timeout.
+        """
+        watched = 0
+        pinged = 0
+        silent = []
+        for room in self.registry.all_rooms():
+            # The room's clients_lock keeps a SET_ENCODING from switching someone's encoding under us
+            with room.clients_lock:
+                for conn, _, _ in room.connected_clients:
+                    if not conn.wants_heartbeat:
+                        continue
+                    watched += 1
+                    if conn.heard_from:
+                        conn.heard_from = False
+                        conn.quiet_checks = 0
+                        continue
+                    conn.quiet_checks += 1
+                    # Quiet for this check and every one since, so at least this long without a word
+                    if (conn.quiet_checks - 1) * interval >= timeout:
+                        silent.append(conn)
+                        continue
+                    payload = self.pings.get(conn.encoding)
+                    if payload is None:
+                        payload = self.pings[conn.encoding] = encode_message({"type": "PING"}, conn.encoding)
+                    conn.send_payload(payload)
+                    pinged += 1
+        if pinged:
+            metrics.inc('pings_sent_total', amount=pinged)
+        for conn in silent:
+            print(f"{conn.name} stopped answering for {timeout:g}s, disconnecting them.")
+            metrics.inc('heartbeat_disconnects_total')
+            # Their reader sees the connection drop and runs the normal disconnect handling
+            conn.hang_up()
+        with self.lock:
+            if watched:
+                self.scheduler.call_later(interval, self.tick)
+            else:
+                self.is_tick_scheduled = False
+
+
+def configure(args):
+    """
+    Pick up --ping-interval and --ping-timeout.
+    """
+    global interval, timeout
+    interval = args.ping_interval
+    timeout = args.ping_timeout
@@ -0,0 +1,402 @@
+import argparse
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Game Journal
+# ------------------------------------------------------------------------------------------------------------------------------
+# An optional record of every game (server.py --journal FILE): the seed and deck it was dealt,
+# who sat where, and every flip, match, hide and turn change, so a game can be replayed later
+# to settle an argument or to study how people play.
+#
+# Every record is the same size, so the file can be read without parsing it: record i is at
+# HEADER.size + i * RECORD.size, and slicing every RECORD.size'th byte gives the kind of every
+# record in one go. Rooms only pack a record into a shared buffer (no file I/O while holding a
+# game lock); a background thread writes the buffer out in batches.
+#
+# Replay and analysis, from the project folder:
+#   python journal.py summary games.journal
+#   python journal.py replay games.journal --game 42
+
+MAGIC = b'MEMJRNL1'
+HEADER = struct.Struct('<8sII')          # magic, record size, reserved
+# kind, seat, card_a, card_b, count, game, player_id, value
+RECORD = struct.Struct('<BBHHHIIQ')
+FLUSH_BYTES = 64 * 1024    # Wake the writer early once this much is waiting
+FLUSH_INTERVAL = 1.0       # Otherwise write whatever is waiting this often (seconds)
+DECK_CARDS_PER_RECORD = 4  # Identities packed into one DECK record's value, 16 bits each
+
+# Record kinds. For the ones that happen during a game, value is microseconds since GAME_START.
+GAME_START = 1  # seat = players, count = cards, player_id = room, value = start time (microseconds since 1970)
+SEED = 2        # value = the seed the deck was shuffled with
+DECK = 3        # card_a = first card, count = how many cards (up to 4), value = their identities
+PLAYER = 4      # seat, player_id
+FLIP = 5        # player_id, card_a
+MATCH = 6       # player_id, card_a, card_b
+HIDE = 7        # card_a, card_b (a mismatch being turned back over)
+TURN = 8        # seat, player_id (whose turn it is now)
+GAME_OVER = 9   # every pair was found
+ABANDONED = 10  # player_id left before the end
+KIND_NAMES = {GAME_START: 'game_start', SEED: 'seed', DECK: 'deck', PLAYER: 'player', FLIP: 'flip',
+              MATCH: 'match', HIDE: 'hide', TURN: 'turn', GAME_OVER: 'game_over', ABANDONED: 'abandoned'}
+
+enabled = False
+_writer = None
+
+
+class JournalWriter:
+    """
+    Appends records to the journal file from a background thread. write() only copies bytes
+    into a buffer, so it's safe (and quick) to call with a game lock held.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.next_game_id = _prepare_file(path) + 1
+        self.file = open(path, 'ab')
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.write_forever, name='journal-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data
+            if len(self.buffer) >= FLUSH_BYTES:
+                self.wakeup.set()
+
+    def start_game(self, build_records):
+        """
+        Give a new game the next id and append its opening records, build_records(game_id), in
+        one go. Two rooms dealing at once can't land out of order, so game ids only go up
+        through the file (JournalReader.find_game counts on it).
+        """
+        with self.lock:
+            game_id = self.next_game_id
+            self.next_game_id += 1
+            self.buffer += build_records(game_id)
+            if len(self.buffer) >= FLUSH_BYTES:
+                self.wakeup.set()
+        return game_id
+
+    def write_forever(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.write_out()
+
+    def write_out(self):
+        with self.lock:
+            data, self.buffer = self.buffer, bytearray()
+        if data:
+            try:
+                self.file.write(data)
+                self.file.flush()
+            except OSError as error:
+                print(f"Oops, couldn't write to the journal {self.path}: {error}")
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.write_out()
+        self.file.close()
+
+
+def _prepare_file(path):
+    """
+    Get the file ready for appending: write the header if it's new, cut off a half-written record
+    left by a crash, and return the last game id in it so we carry on numbering from there.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        with open(path, 'wb') as journal_file:
+            journal_file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+        return 0
+    with JournalReader(path) as reader:
+        complete_size = HEADER.size + reader.count * RECORD.size
+        last = reader.kinds().rfind(bytes([GAME_START]))
+        last_game_id = reader.record(last)[5] if last >= 0 else 0
+    if os.path.getsize(path) != complete_size:
+        os.truncate(path, complete_size)
+    return last_game_id
+
+
+class GameRecorder:
+    """
+    Writes the records for one game. The room holding it calls these with its game_state_lock held.
+    """
+
+    __slots__ = ('writer', 'game_id', 'started')
+
+    def __init__(self, writer, game_id):
+        self.writer = writer
+        self.game_id = game_id
+        self.started = time.monotonic()
+
+    def event(self, kind, player_id=0, card_a=0, card_b=0, seat=0):
+        elapsed = int((time.monotonic() - self.started) * 1_000_000)
+        self.writer.write(RECORD.pack(kind, seat, card_a, card_b, 0, self.game_id, player_id, elapsed))
+
+    def flip(self, player_id, card_index):
+        self.event(FLIP, player_id, card_index)
+
+    def match(self, player_id, first, second):
+        self.event(MATCH, player_id, first, second)
+
+    def hide(self, first, second):
+        self.event(HIDE, 0, first, second)
+
+    def turn(self, seat, player_id):
+        self.event(TURN, player_id, seat=seat)
+
+    def game_over(self):
+        self.event(GAME_OVER)
+
+    def abandoned(self, player_id):
+        self.event(ABANDONED, player_id)
+
+
+def new_game(room_id, seed, deck, player_ids, first_seat):
+    """
+    Record a game that has just been dealt and return its recorder (None if the journal is off).
+    """
+    if not enabled:
+        return None
+    started_at = time.time_ns() // 1000
+    decks = []
+    for start in range(0, len(deck), DECK_CARDS_PER_RECORD):
+        chunk = deck[start:start + DECK_CARDS_PER_RECORD]
+        packed = 0
+        for i, identity in enumerate(chunk):
+            packed |= identity << (16 * i)
+        decks.append((start, len(chunk), packed))
+
+    def opening_records(game_id):
+        parts = [
+            RECORD.pack(GAME_START, len(player_ids), 0, 0, len(deck), game_id, room_id, started_at),
+            RECORD.pack(SEED, 0, 0, 0, 0, game_id, 0, seed),
+        ]
+        for start, count, packed in decks:
+            parts.append(RECORD.pack(DECK, 0, start, 0, count, game_id, 0, packed))
+        for seat, player_id in enumerate(player_ids):
+            parts.append(RECORD.pack(PLAYER, seat, 0, 0, 0, game_id, player_id, 0))
+        parts.append(RECORD.pack(TURN, first_seat, 0, 0, 0, game_id, player_ids[first_seat], 0))
+        return b''.join(parts)
+
+    return GameRecorder(_writer, _writer.start_game(opening_records))
+
+
+def configure(args):
+    """
+    Start the journal if the server was given --journal.
+    """
+    global enabled, _writer
+    if args.journal is None:
+        return
+    _writer = JournalWriter(args.journal)
+    enabled = True
+    print(f"Recording games to {args.journal}")
+
+
+def stop():
+    """
+    Write out anything still buffered and close the file.
+    """
+    global enabled, _writer
+    if _writer is not None:
+        enabled = False
+        _writer.close()
+        _writer = None
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Reading a Journal
+# ------------------------------------------------------------------------------------------------------------------------------
+
+
+class JournalReader:
+    """
+    A journal file mapped into memory. Nothing is read until it's asked for, so even huge
+    journals open instantly, and the OS pages in only what we touch.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f"{path} is not a game journal")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a game journal (or was written by a different version)")
+        # A crash can leave half a record at the end; we ignore it
+        self.count = (size - HEADER.size) // RECORD.size
+
+    def record(self, index):
+        return RECORD.unpack_from(self.map, HEADER.size + index * RECORD.size)
+
+    def kinds(self):
+        """
+        The kind of every record, one byte each (record i's kind is kinds()[i]).
+        """
+        return self.map[HEADER.size:HEADER.size + self.count * RECORD.size:RECORD.size]
+
+    def positions(self, kind, kinds=None):
+        """
+        Index of every record of this kind.
+        """
+        if kinds is None:
+            kinds = self.kinds()
+        return [match.start() for match in re.finditer(re.escape(bytes([kind])), kinds)]
+
+    def find_game(self, game_id, kinds=None):
+        """
+        Index of a game's GAME_START record, or None. Game ids only go up through the file,
+        so this is a binary search over the game starts.
+        """
+        starts = self.positions(GAME_START, kinds)
+        low, high = 0, len(starts)
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(starts[middle])[5] < game_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(starts) and self.record(starts[low])[5] == game_id:
+            return starts[low]
+        return None
+
+    def game_records(self, game_id):
+        """
+        Every record of one game, in order. Other games' records are mixed in between, we skip them.
+        """
+        start = self.find_game(game_id)
+        if start is None:
+            return []
+        records = []
+        offset = HEADER.size + start * RECORD.size
+        end = HEADER.size + self.count * RECORD.size
+        for record in RECORD.iter_unpack(memoryview(self.map)[offset:end]):
+            if record[5] != game_id:
+                continue
+            records.append(record)
+            if record[0] in (GAME_OVER, ABANDONED):
+                break
+        return records
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(reader):
+    """
+    Totals for a whole journal. Counting is done on the strided kinds() bytes, so it costs
+    about the same as copying one byte per record; only finished games are unpacked.
+    """
+    kinds = reader.kinds()
+    counts = {name: kinds.count(bytes([kind])) for kind, name in KIND_NAMES.items()}
+    durations = sorted(reader.record(i)[7] / 1_000_000 for i in reader.positions(GAME_OVER, kinds))
+    finished = counts['game_over']
+    return {
+        "records": reader.count,
+        "games": counts['game_start'],
+        "finished": finished,
+        "abandoned": counts['abandoned'],
+        "flips": counts['flip'],
+        "matches": counts['match'],
+        "mismatches": counts['hide'],
+        "match_rate": round(counts['match'] / max(1, counts['match'] + counts['hide']), 3),
+        "flips_per_finished_game": round(counts['flip'] / finished, 1) if finished else None,
+        "game_seconds_p50": _percentile(durations, 0.5),
+        "game_seconds_p95": _percentile(durations, 0.95),
+    }
+
+
+def replay(reader, game_id):
+    """
+    Play one game back from its records. Returns the lines of the replay; any flip or match
+    that doesn't agree with the recorded deck is called out.
+    """
+    records = reader.game_records(game_id)
+    if not records:
+        return [f"Game {game_id} is not in this journal."]
+    deck = []
+    seats = {}
+    scores = {}
+    lines = []
+    for kind, seat, card_a, card_b, count, _, player_id, value in records:
+        if kind == GAME_START:
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value / 1_000_000))
+            deck = [None] * count
+            lines.append(f"Game {game_id} in room {player_id}, {seat} players, {count} cards, started {started}")
+        elif kind == SEED:
+            lines.append(f"  dealt with seed {value}")
+        elif kind == DECK:
+            for i in range(count):
+                deck[card_a + i] = (value >> (16 * i)) & 0xFFFF
+        elif kind == PLAYER:
+            seats[player_id] = seat + 1
+            scores[player_id] = 0
+            lines.append(f"  seat {seat + 1}: player {player_id}")
+        else:
+            at = f"{value / 1_000_000:9.3f}s"
+            if kind == FLIP:
+                lines.append(f"{at}  player {player_id} flips card {card_a} ({deck[card_a]})")
+            elif kind == MATCH:
+                scores[player_id] += 1
+                note = '' if deck[card_a] == deck[card_b] else '  <-- those cards are NOT a pair!'
+                lines.append(f"{at}  player {player_id} matches cards {card_a} and {card_b}{note}")
+            elif kind == HIDE:
+                lines.append(f"{at}  cards {card_a} and {card_b} are turned back over")
+            elif kind == TURN:
+                lines.append(f"{at}  player {player_id}'s turn (seat {seat + 1})")
+            elif kind == GAME_OVER:
+                lines.append(f"{at}  game over")
+            elif kind == ABANDONED:
+                lines.append(f"{at}  player {player_id} left, game abandoned")
+    lines.append("  final scores: " + ", ".join(f"player {pid} {score}" for pid, score in scores.items()))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize or replay a game journal')
+    parser.add_argument('command', choices=('summary', 'replay'))
+    parser.add_argument('path', help='Journal file written by server.py --journal')
+    parser.add_argument('--game', type=int, help='Game to replay')
+    args = parser.parse_args()
+    with JournalReader(args.path) as reader:
+        if args.command == 'summary':
+            started = time.perf_counter()
+            summary = summarize(reader)
+            for name, value in summary.items():
+                print(f"  {name:<24} {value}")
+            print(f"  (read in {time.perf_counter() - started:.3f}s)")
+        else:
+            if args.game is None:
+                parser.error('replay needs --game')
+            print('\n'.join(replay(reader, args.game)))
+
+
+if __name__ == '__main__':
+    main()
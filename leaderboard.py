@@ -0,0 +1,238 @@
+import argparse
+import collections
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Leaderboard
+# ------------------------------------------------------------------------------------------------------------------------------
+# Everyone's results across games and server restarts (server.py --leaderboard FILE), in a
+# SQLite database. Players are known by the name they send in JOIN ({"type": "JOIN", "name":
+# "sam"}); players without a name still see the leaderboard but aren't on it.
+#
+# When a game ends the room only appends its results to a deque (no database work while holding
+# a game lock, or on the event loop). A background thread writes everything that finished in the
+# last FLUSH_INTERVAL in one transaction, runs the top-N query once for the whole batch, looks up
+# each of its players, and hands every table its LEADERBOARD message back on the room's scheduler:
+#
+#   {"type": "LEADERBOARD",
+#    "top": [{"name": "sam", "wins": 12, "games": 30, "points": 140}, ...],
+#    "you": {"name": "sam", "wins": 12, "games": 30, "points": 140, "best": 8, "rank": 1}}
+#
+# ("you" is None for players without a name.) Rank is by wins, then points; a win is finishing
+# with the most points, so a tie is a win for everybody in it. The top list and a player's totals
+# are index lookups. A rank means counting everyone ahead, so we stop counting at RANK_LIMIT
+# ("rank" is None past that) and the query costs the same with a million players as with a thousand.
+#
+# With --workers every worker writes to the same file (SQLite's WAL mode lets them take turns).
+#
+# To look at it from the project folder:
+#   python leaderboard.py leaderboard.db
+#   python leaderboard.py leaderboard.db --player sam
+
+DEFAULT_SIZE = 5        # Players in the top list we send
+FLUSH_INTERVAL = 0.5    # Seconds between writes, so games that end together share one transaction
+BUSY_TIMEOUT = 5.0      # Seconds to wait for another worker to finish writing
+RANK_LIMIT = 1000       # We count ranks this far down the board, no further
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    finished REAL NOT NULL,      -- time.time() when the game ended
+    room INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    won INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_name ON results (name, finished);
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    best INTEGER NOT NULL,       -- Most points in one game
+    last_played REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_by_rank ON players (wins DESC, points DESC, name);
+"""
+
+ADD_RESULT = "INSERT INTO results (finished, room, name, points, won) VALUES (?, ?, ?, ?, ?)"
+ADD_TO_TOTALS = """
+INSERT INTO players (name, games, wins, points, best, last_played) VALUES (?, 1, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    games = games + 1, wins = wins + excluded.wins, points = points + excluded.points,
+    best = max(best, excluded.best), last_played = excluded.last_played
+"""
+TOP = "SELECT name, wins, games, points FROM players ORDER BY wins DESC, points DESC, name LIMIT ?"
+PLAYER = "SELECT name, wins, games, points, best FROM players WHERE name = ?"
+# How many players are ahead, up to a limit (one range over players_by_rank; written with OR, SQLite won't use the index)
+AHEAD = "SELECT COUNT(*) FROM (SELECT 1 FROM players WHERE (wins, points) > (?, ?) LIMIT ?)"
+
+enabled = False
+_writer = None
+
+
+class FinishedGame:
+    """
+    One game's results waiting to be written, and the room to send the leaderboard to afterwards.
+    """
+
+    __slots__ = ('room', 'game_number', 'finished', 'results')
+
+    def __init__(self, room, game_number, results):
+        self.room = room
+        self.game_number = game_number
+        self.finished = time.time()
+        self.results = results  # [(player_id, name or None, points, won)]
+
+
+def open_database(path):
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def top_players(db, count):
+    return [{"name": name, "wins": wins, "games": games, "points": points}
+            for name, wins, games, points in db.execute(TOP, (count,))]
+
+
+def player_standing(db, name):
+    """
+    One player's totals and rank (None past RANK_LIMIT), or None if they haven't finished a game.
+    """
+    row = db.execute(PLAYER, (name,)).fetchone()
+    if row is None:
+        return None
+    name, wins, games, points, best = row
+    (ahead,) = db.execute(AHEAD, (wins, points, RANK_LIMIT)).fetchone()
+    rank = ahead + 1 if ahead < RANK_LIMIT else None
+    return {"name": name, "wins": wins, "games": games, "points": points, "best": best, "rank": rank}
+
+
+class LeaderboardWriter:
+    """
+    Writes finished games to the database from a background thread and sends each table its
+    LEADERBOARD. record() only appends to a deque, so it's safe (and quick) to call with a game lock held.
+    """
+
+    def __init__(self, path, top_size=DEFAULT_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.top_size = top_size
+        self.flush_interval = flush_interval
+        self.db = open_database(path)
+        self.pending = collections.deque()  # FinishedGames; appending is safe from any thread
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.write_forever, name='leaderboard-writer', daemon=True)
+        self.thread.start()
+
+    def write_forever(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.write_out()
+
+    def write_out(self):
+        games = []
+        pending = self.pending
+        while pending:
+            games.append(pending.popleft())
+        if not games:
+            return
+        started = time.perf_counter()
+        names = {name for game in games for _, name, _, _ in game.results if name is not None}
+        try:
+            with self.db:
+                # One transaction for the whole batch
+                self.db.executemany(ADD_RESULT, [
+                    (game.finished, game.room.room_id, name, points, won)
+                    for game in games for _, name, points, won in game.results if name is not None
+                ])
+                self.db.executemany(ADD_TO_TOTALS, [
+                    (name, won, points, points, game.finished)
+                    for game in games for _, name, points, won in game.results if name is not None
+                ])
+            top = top_players(self.db, self.top_size)
+            standings = {name: player_standing(self.db, name) for name in names}
+        except sqlite3.Error as error:
+            print(f"Oops, couldn't update the leaderboard {self.path}: {error}")
+            return
+        metrics.observe('leaderboard_write_seconds', time.perf_counter() - started)
+        metrics.inc('leaderboard_games_total', amount=len(games))
+        for game in games:
+            you = {player_id: standings.get(name) for player_id, name, _, _ in game.results}
+            try:
+                # Back to the room's own thread (or event loop) to send it
+                game.room.scheduler.call_soon_threadsafe(game.room.send_leaderboard, game.game_number, top, you)
+            except RuntimeError:
+                # The event loop has already closed, we're shutting down
+                pass
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.write_out()
+        self.db.close()
+
+
+def record(room, game_number, names, scores):
+    """
+    A game just ended: names is {player_id: name or None}, scores {player_id: points}. Call with the room's game_state_lock held.
+    """
+    if not enabled:
+        return
+    best = max(scores.values(), default=0)
+    results = [(player_id, names.get(player_id), points, int(points == best)) for player_id, points in scores.items()]
+    _writer.pending.append(FinishedGame(room, game_number, results))
+
+
+def configure(args):
+    """
+    Open the leaderboard if the server was given --leaderboard.
+    """
+    global enabled, _writer
+    if args.leaderboard is None:
+        return
+    _writer = LeaderboardWriter(args.leaderboard, args.leaderboard_size)
+    enabled = True
+    print(f"Keeping the leaderboard in {args.leaderboard}")
+
+
+def stop():
+    """
+    Write out the games still waiting and close the database.
+    """
+    global enabled, _writer
+    if _writer is not None:
+        enabled = False
+        _writer.close()
+        _writer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the leaderboard')
+    parser.add_argument('database', help='The file given to server.py --leaderboard')
+    parser.add_argument('--top', type=int, default=20, help='How many players to list (default 20)')
+    parser.add_argument('--player', help="Show one player's totals and rank instead")
+    args = parser.parse_args()
+    db = open_database(args.database)
+    if args.player is not None:
+        standing = player_standing(db, args.player)
+        if standing is None:
+            print(f"{args.player} hasn't finished a game yet.")
+        else:
+            rank = f"#{standing['rank']}" if standing['rank'] is not None else f"Past #{RANK_LIMIT}"
+            print(f"{rank} {standing['name']}: {standing['wins']} wins in {standing['games']} games, "
+                  f"{standing['points']} points (best game {standing['best']})")
+        return
+    for rank, player in enumerate(top_players(db, args.top), 1):
+        print(f"{rank:>4}. {player['name']:<24} {player['wins']:>6} wins {player['games']:>6} games {player['points']:>8} points")
+
+
+if __name__ == '__main__':
+    main()
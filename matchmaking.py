@@ -0,0 +1,326 @@
+import collections
+
+import metrics
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Matchmaking
+# ------------------------------------------------------------------------------------------------------------------------------
+# Every new player waits here until they have a seat, instead of being turned away when every
+# table is taken. A player may say what size of table they'd like first:
+#
+#   {"type": "JOIN", "players": 3}     (leave out "players" for any size)
+#
+# and what to call them on the leaderboard ({"type": "JOIN", "name": "sam"}, see leaderboard.py).
+#
+# Someone who doesn't send JOIN is treated as "any size" after JOIN_GRACE_SECONDS, so older
+# clients still get in. Anyone who can't be seated straight away goes in a line for their table
+# size and hears where they are:
+#
+#   {"type": "QUEUED", "position": 12, "players": 3, "eta_seconds": 40.0}
+#
+# eta_seconds is a guess from how fast that line has been moving lately (None until it has moved).
+#
+# Each line is a deque of spots, so joining and leaving the front are O(1) however long it gets.
+# Someone who hangs up (or switches lines) only empties their spot; empty spots are skipped when
+# they reach the front and swept out by the position reports. Those walk a line at most every
+# REPORT_SECONDS, and only once someone in it has left or sat down (nobody else's place changes
+# otherwise). Seating only looks at the front of each line, so it costs the same with ten people
+# waiting as with fifty thousand.
+#
+# When a table frees up it goes to a group that can fill it straight away if there is one, so
+# a room isn't held by one person waiting for three more while pairs queue up behind them.
+#
+# The engines do the talking: they own the connections, read JOIN while someone waits, call
+# seat_freed() when the registry says a seat opened up (RoomRegistry.on_seat_freed), call place()
+# and send what updates() returns whenever timeout() says there's something to do. Nothing polls:
+# with nobody joining and no seat opening up, place() doesn't look at the tables at all.
+# Everything here runs on one thread, the accept loop's or the event loop's, except seat_freed().
+
+TABLE_SIZES = (2, 3, 4)       # Table sizes people can ask for
+ANY_SIZE = 0                  # The line for people happy with any table
+JOIN_GRACE_SECONDS = 0.1      # How long we wait for a JOIN before seating someone anywhere
+REPORT_SECONDS = 2.0          # How often people waiting hear about their place in line
+CLOSE_TO_FRONT = 100          # People this near the front hear every step; further back, every tenth of the way
+DEFAULT_MAX_WAITING = 10000   # People one server process will hold before turning newcomers away
+MAX_NAME_LENGTH = 24          # Longest name we'll put on the leaderboard
+RATE_SAMPLES = 50             # Recent seatings per line we time to guess the wait
+
+
+class Ticket:
+    """
+    One player who has connected but doesn't have a seat yet.
+    """
+
+    def __init__(self, number, conn, addr, player_id, now):
+        self.number = number         # Order of arrival, so the lines are fair to each other
+        self.conn = conn             # Whatever the engine talks to them through
+        self.addr = addr
+        self.player_id = player_id
+        self.players = ANY_SIZE      # Table size they asked for
+        self.name = None             # What they'd like to be called on the leaderboard
+        self.arrived = now
+        self.is_ready = False        # Sent JOIN (or waited long enough), may be seated
+        self.spot = None             # Their spot in a line: [ticket], emptied when they leave it
+        self.is_gone = False         # Hung up or got a seat, we're done with them
+        self.joined_at = None        # Their place when they joined the line
+        self.position = None         # Place in line we last told them
+
+    def is_waiting(self):
+        return self.spot is not None
+
+
+class Matchmaker:
+    """
+    The lines of players waiting for a seat in one server process, and who sits down next.
+    """
+
+    def __init__(self, registry, max_waiting=DEFAULT_MAX_WAITING):
+        self.registry = registry
+        self.max_waiting = max_waiting
+        self.joining = collections.deque()  # Tickets in their grace period, oldest first
+        self.ready = []                     # Tickets that sent JOIN since the last place()
+        self.lines = {size: collections.deque() for size in (ANY_SIZE,) + TABLE_SIZES}
+        self.line_lengths = dict.fromkeys(self.lines, 0)  # People really in each line
+        self.seated_at = {size: collections.deque(maxlen=RATE_SAMPLES) for size in self.lines}
+        self.new_in_line = []               # Joined a line since the last updates(), tell them now
+        self.moved_lines = set()            # Lines someone left or got seated from since the last position reports
+        self.is_seat_check_due = False      # A seat may have opened, or someone joined a line, since place() last looked
+        self.next_number = 1
+        self.next_report = 0
+
+    def count(self):
+        """
+        Everyone we're holding: still deciding, or in a line.
+        """
+        return len(self.joining) + self.waiting_count()
+
+    def waiting_count(self):
+        return sum(self.line_lengths.values())
+
+    def register_gauges(self):
+        metrics.gauge('players_waiting', self.waiting_count)
+
+    def everyone(self):
+        """
+        Every ticket we're holding, for saying goodbye at shutdown.
+        """
+        tickets = [ticket for ticket in self.joining if not ticket.is_gone and not ticket.is_waiting()]
+        for line in self.lines.values():
+            tickets.extend(spot[0] for spot in line if spot[0] is not None)
+        return tickets
+
+    def admit(self, conn, addr, player_id, now):
+        """
+        A new connection. Returns its Ticket, or None if we're already holding as many people as we'll take.
+        """
+        if self.count() >= self.max_waiting:
+            metrics.inc('matchmaking_rejected_total')
+            return None
+        ticket = Ticket(self.next_number, conn, addr, player_id, now)
+        self.next_number += 1
+        self.joining.append(ticket)
+        return ticket
+
+    def handle_message(self, ticket, message):
+        """
+        Something a player without a seat sent. Returns a reply for them, or None.
+        """
+        if message.get("type") != "JOIN":
+            return {"type": "ERROR", "message": "You don't have a seat yet."}
+        players = message.get("players")
+        if players is not None and players not in TABLE_SIZES:
+            return {"type": "ERROR", "message": f"Tables are for {TABLE_SIZES[0]} to {TABLE_SIZES[-1]} players."}
+        name = message.get("name")
+        if name is not None:
+            if not isinstance(name, str) or not 0 < len(name.strip()) <= MAX_NAME_LENGTH:
+                return {"type": "ERROR", "message": f"Names are 1 to {MAX_NAME_LENGTH} characters."}
+            ticket.name = name.strip()
+        players = players or ANY_SIZE
+        if ticket.is_waiting():
+            if players != ticket.players:
+                # Changed their mind, to the back of the other line
+                self._step_out(ticket)
+                ticket.players = players
+                self._get_in_line(ticket)
+        else:
+            ticket.players = players
+            if not ticket.is_ready:
+                ticket.is_ready = True
+                self.ready.append(ticket)
+        return None
+
+    def seat_freed(self):
+        """
+        A seat opened up (or a room closed, making space for a new one). Safe to call from any
+        thread; the engine still has to wake up whoever calls place().
+        """
+        self.is_seat_check_due = True
+
+    def leave(self, ticket):
+        """
+        They hung up before getting a seat.
+        """
+        if ticket.is_waiting():
+            self._step_out(ticket)
+        ticket.is_gone = True
+
+    def _get_in_line(self, ticket):
+        ticket.spot = [ticket]
+        self.lines[ticket.players].append(ticket.spot)
+        self.line_lengths[ticket.players] += 1
+        ticket.position = None
+        ticket.joined_at = self.line_lengths[ticket.players]
+        self.new_in_line.append(ticket)
+        self.is_seat_check_due = True
+
+    def _step_out(self, ticket):
+        ticket.spot[0] = None
+        ticket.spot = None
+        self.line_lengths[ticket.players] -= 1
+        # Everyone behind them moved up
+        self.moved_lines.add(ticket.players)
+
+    def _front(self, size):
+        """
+        Who's at the front of a line, skipping spots people have left.
+        """
+        line = self.lines[size]
+        while line and line[0][0] is None:
+            line.popleft()
+        return line[0][0] if line else None
+
+    # ----------------------------------------------------------------------------------------------------------------------------
+    #  Who sits down next
+    # ----------------------------------------------------------------------------------------------------------------------------
+
+    def place(self, now, seat):
+        """
+        Seat everyone we can. seat(ticket, players) is the engine's: it must seat them with
+        registry.seat_player(..., players) before returning, so we see the seat as taken.
+        """
+        # People who said what they want (or had long enough to) join the back of their line
+        for ticket in self.ready:
+            if not ticket.is_gone and not ticket.is_waiting():
+                self._get_in_line(ticket)
+        self.ready.clear()
+        joining = self.joining
+        while joining:
+            ticket = joining[0]
+            if ticket.is_gone or ticket.is_ready:
+                # Already in a line (or seated, or left)
+                joining.popleft()
+            elif now - ticket.arrived >= JOIN_GRACE_SECONDS:
+                joining.popleft()
+                ticket.is_ready = True
+                self._get_in_line(ticket)
+            else:
+                break
+
+        if not self.is_seat_check_due:
+            # Nobody new in line and no seat has opened up since we last looked
+            return
+        # Cleared before we look, so a seat freed while we're looking still gets another look
+        self.is_seat_check_due = False
+        while True:
+            choice = self._next_seating()
+            if choice is None:
+                break
+            ticket, players = choice
+            self._step_out(ticket)
+            ticket.is_gone = True
+            self.seated_at[ticket.players].append(now)
+            metrics.observe('matchmaking_wait_seconds', now - ticket.arrived)
+            seat(ticket, players)
+
+    def _next_seating(self):
+        """
+        (ticket, table size) for the next person to seat, or None if nobody can be.
+        """
+        fronts = {size: self._front(size) for size in self.lines}
+        if not any(fronts.values()):
+            return None
+        anyone = fronts[ANY_SIZE]
+
+        # An empty seat at a table that's already open: the first in line for it
+        best = None
+        for size in self.registry.open_table_sizes():
+            for ticket in (fronts.get(size), anyone):
+                if ticket is not None and (best is None or ticket.number < best[0].number):
+                    best = (ticket, size)
+        if best is not None or not self.registry.can_open_room():
+            return best
+
+        # A new table: for whoever has been waiting longest among the groups that can fill one now
+        default = self.registry.players_per_room
+        sizes = (default,) + tuple(size for size in TABLE_SIZES if size != default)
+        for size in sizes:
+            if self.line_lengths[size] + self.line_lengths[ANY_SIZE] < size:
+                continue
+            for ticket in (fronts[size], anyone):
+                if ticket is not None and (best is None or ticket.number < best[0].number):
+                    best = (ticket, size)
+        if best is not None:
+            return best
+        # Nobody can fill a table yet, so the longest wait gets one and waits there for the rest
+        ticket = min((ticket for ticket in fronts.values() if ticket is not None), key=lambda t: t.number)
+        return ticket, ticket.players or default
+
+    # ----------------------------------------------------------------------------------------------------------------------------
+    #  Telling people where they are
+    # ----------------------------------------------------------------------------------------------------------------------------
+
+    def eta(self, size, position, now):
+        """
+        Seconds until position in line size gets a seat, at the rate that line has been moving. None if we can't tell yet.
+        """
+        seated_at = self.seated_at[size]
+        if len(seated_at) < 2 or now - seated_at[0] <= 0:
+            return None
+        rate = (len(seated_at) - 1) / (now - seated_at[0])
+        return round(position / rate, 1)
+
+    def updates(self, now):
+        """
+        (ticket, QUEUED message) for everyone who should hear where they are: people who just
+        joined a line, and at most every REPORT_SECONDS anyone who has moved up (see CLOSE_TO_FRONT).
+        """
+        updates = []
+        if self.moved_lines and now >= self.next_report:
+            self.next_report = now + REPORT_SECONDS
+            for size in self.moved_lines:
+                # Sweep out the spots people left while we're walking the line anyway
+                line = self.lines[size] = collections.deque(spot for spot in self.lines[size] if spot[0] is not None)
+                for position, (ticket,) in enumerate(line, 1):
+                    last = ticket.position
+                    if last is None or last != position and (position <= CLOSE_TO_FRONT or position * 10 <= last * 9):
+                        ticket.position = position
+                        updates.append((ticket, self._queued(ticket, now)))
+            self.moved_lines.clear()
+        for ticket in self.new_in_line:
+            if ticket.is_waiting() and ticket.position is None:
+                # Anyone seated since they joined was ahead of them
+                ticket.position = min(ticket.joined_at, self.line_lengths[ticket.players])
+                updates.append((ticket, self._queued(ticket, now)))
+        self.new_in_line.clear()
+        return updates
+
+    def _queued(self, ticket, now):
+        return {
+            "type": "QUEUED",
+            "position": ticket.position,
+            "players": ticket.players or None,
+            "eta_seconds": self.eta(ticket.players, ticket.position, now),
+        }
+
+    def timeout(self, now):
+        """
+        Seconds until place() or updates() next has something to do (None if nothing will until someone connects).
+        """
+        if self.ready or self.new_in_line or self.is_seat_check_due and self.waiting_count():
+            return 0
+        timeouts = []
+        if self.joining:
+            timeouts.append(self.joining[0].arrived + JOIN_GRACE_SECONDS - now)
+        if self.moved_lines:
+            timeouts.append(self.next_report - now)
+        return max(0, min(timeouts)) if timeouts else None
@@ -0,0 +1,354 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Server Metrics
+# ------------------------------------------------------------------------------------------------------------------------------
+# Counters and latency histograms for the server, readable while it runs.
+#
+# Collection is off until configure() turns it on (server.py does when it's given --metrics-port or
+# --metrics-file). While it's off, inc() and observe() return straight away and instrument_lock()
+# hands back the plain lock, so the hot path pays for one function call and nothing else.
+#
+# Every thread counts into its own shard, so recording never takes a lock that another player's
+# thread could be holding. The shards are only added up when somebody reads the numbers.
+
+PREFIX = 'memory_game_'
+# Histogram bucket upper bounds in seconds, 1 microsecond up to 10 seconds
+BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+DEFAULT_DUMP_INTERVAL = 10  # Seconds between writes of --metrics-file
+
+enabled = False
+
+
+class Shard:
+    """
+    One thread's counters and histograms. Only its own thread writes to it.
+    """
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}    # (name, label) -> count
+        self.histograms = {}  # (name, label) -> [bucket counts..., +Inf count, sum of values]
+
+    def merge_into(self, counters, histograms):
+        for key, value in list(self.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, values in list(self.histograms.items()):
+            total = histograms.get(key)
+            if total is None:
+                total = histograms[key] = [0] * len(values)
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+_local = threading.local()
+_shards = []                  # Every live thread's shard
+_retired = Shard(None)        # Numbers from threads that have finished
+_shards_lock = threading.Lock()
+_gauges = {}                  # name -> function returning the current value
+_started_at = time.time()
+_outputs = []                 # Things to stop at shutdown (HTTP server, dump thread)
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = Shard(threading.current_thread())
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def inc(name, label=None, amount=1):
+    """
+    Add to a counter, optionally split by one label (like a message type).
+    """
+    if not enabled:
+        return
+    counters = _shard().counters
+    key = (name, label)
+    counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, seconds, label=None):
+    """
+    Record one duration in a histogram.
+    """
+    if not enabled:
+        return
+    histograms = _shard().histograms
+    key = (name, label)
+    values = histograms.get(key)
+    if values is None:
+        values = histograms[key] = [0] * (len(BUCKETS) + 2)
+    values[bisect.bisect_left(BUCKETS, seconds)] += 1
+    values[-1] += seconds
+
+
+def gauge(name, read_value):
+    """
+    Register a value that is worked out when the metrics are read, like how many players are connected.
+    """
+    _gauges[name] = read_value
+
+
+class InstrumentedLock:
+    """
+    Wraps a Lock or RLock and records how long threads waited for it and how long they held it.
+    Nested acquires of an RLock count as one hold, timed from the outermost acquire.
+    """
+
+    __slots__ = ('_lock', '_name', '_depth', '_acquired_at')
+
+    def __init__(self, lock, name):
+        self._lock = lock
+        self._name = name
+        self._depth = 0           # Only the thread holding the lock touches these two
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            if self._depth == 0:
+                self._acquired_at = time.perf_counter()
+                observe('lock_wait_seconds', self._acquired_at - started, self._name)
+            self._depth += 1
+        return acquired
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            observe('lock_hold_seconds', time.perf_counter() - self._acquired_at, self._name)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+def instrument_lock(lock, name):
+    """
+    Time waits and holds on this lock, if metrics are on. Otherwise it's returned untouched.
+    """
+    if not enabled:
+        return lock
+    return InstrumentedLock(lock, name)
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Reading the Numbers
+# ------------------------------------------------------------------------------------------------------------------------------
+
+
+def collect():
+    """
+    Add up every shard. Shards of threads that have finished are folded into one, so
+    a server that sees lots of players come and go doesn't keep a shard per player.
+    """
+    counters = {}
+    histograms = {}
+    with _shards_lock:
+        live = []
+        for shard in _shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                shard.merge_into(_retired.counters, _retired.histograms)
+        _shards[:] = live
+        _retired.merge_into(counters, histograms)
+        for shard in live:
+            shard.merge_into(counters, histograms)
+    gauges = {}
+    for name, read_value in list(_gauges.items()):
+        try:
+            gauges[name] = read_value()
+        except Exception as error:
+            print(f"Oops, metrics gauge {name} failed: {error}")
+    return counters, histograms, gauges
+
+
+def _labels(name, label):
+    if label is None:
+        return ''
+    label_name = 'lock' if name.startswith('lock_') else 'type'
+    return f'{{{label_name}="{label}"}}'
+
+
+def _quantile(values, fraction):
+    """
+    Rough quantile from histogram buckets: the upper bound of the bucket it falls in.
+    """
+    count = sum(values[:-1])
+    if not count:
+        return None
+    target = fraction * count
+    running = 0
+    for i, bucket_count in enumerate(values[:-1]):
+        running += bucket_count
+        if running >= target:
+            return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+    return float('inf')
+
+
+def render_text():
+    """
+    Everything in the Prometheus text format, for the scrape endpoint.
+    """
+    counters, histograms, gauges = collect()
+    lines = []
+    for name, value in sorted(gauges.items()):
+        lines.append(f'# TYPE {PREFIX}{name} gauge')
+        lines.append(f'{PREFIX}{name} {value}')
+    typed = set()
+    for (name, label), value in sorted(counters.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {PREFIX}{name} counter')
+        lines.append(f'{PREFIX}{name}{_labels(name, label)} {value}')
+    for (name, label), values in sorted(histograms.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+        label_name = _labels(name, label)[1:-1]
+        prefix = label_name + ',' if label_name else ''
+        running = 0
+        for bound, bucket_count in zip(BUCKETS, values):
+            running += bucket_count
+            lines.append(f'{PREFIX}{name}_bucket{{{prefix}le="{bound}"}} {running}')
+        running += values[len(BUCKETS)]
+        lines.append(f'{PREFIX}{name}_bucket{{{prefix}le="+Inf"}} {running}')
+        suffix = _labels(name, label)
+        lines.append(f'{PREFIX}{name}_sum{suffix} {values[-1]}')
+        lines.append(f'{PREFIX}{name}_count{suffix} {running}')
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    """
+    Everything as a plain dict (for the dump file), with rough percentiles for each histogram.
+    """
+    counters, histograms, gauges = collect()
+    result = {"time": time.time(), "uptime_seconds": round(time.time() - _started_at, 3),
+              "gauges": gauges, "counters": {}, "histograms": {}}
+    for (name, label), value in counters.items():
+        result["counters"].setdefault(name, {})[label or "total"] = value
+    for (name, label), values in histograms.items():
+        count = sum(values[:-1])
+        result["histograms"].setdefault(name, {})[label or "all"] = {
+            "count": count,
+            "mean": values[-1] / count if count else None,
+            "p50": _quantile(values, 0.5),
+            "p95": _quantile(values, 0.95),
+            "p99": _quantile(values, 0.99),
+        }
+    return result
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Publishing the Numbers
+# ------------------------------------------------------------------------------------------------------------------------------
+
+
+def serve_http(host, port):
+    """
+    Scrape endpoint: GET /metrics for the Prometheus text format, /metrics.json for JSON.
+    Runs on its own daemon threads so it works the same beside either server engine.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = render_text().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(snapshot(), indent=2).encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # Keep scrapes out of the game log
+            pass
+
+    http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, name='metrics-http', daemon=True).start()
+    _outputs.append(http_server.shutdown)
+    print(f"Metrics on http://{host}:{port}/metrics")
+
+
+def write_dump(path):
+    """
+    Write the snapshot to a file in one go (write a temp file, then rename it over the old one).
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as dump:
+        json.dump(snapshot(), dump, indent=2)
+    os.replace(temp_path, path)
+
+
+def start_dump(path, interval=DEFAULT_DUMP_INTERVAL):
+    """
+    Rewrite the dump file every interval seconds, and once more at shutdown.
+    """
+    stop_event = threading.Event()
+
+    def dump_forever():
+        while not stop_event.wait(interval):
+            try:
+                write_dump(path)
+            except OSError as error:
+                print(f"Oops, couldn't write metrics to {path}: {error}")
+
+    thread = threading.Thread(target=dump_forever, name='metrics-dump', daemon=True)
+    thread.start()
+
+    def stop_dump():
+        stop_event.set()
+        thread.join(timeout=1)
+        write_dump(path)
+
+    _outputs.append(stop_dump)
+
+
+def configure(args):
+    """
+    Turn collection on if the server was asked to publish metrics anywhere. Call before any
+    rooms are created, so their locks get instrumented.
+    """
+    global enabled
+    if args.metrics_port is None and args.metrics_file is None:
+        return
+    enabled = True
+    if args.metrics_port is not None:
+        serve_http(args.metrics_host, args.metrics_port)
+    if args.metrics_file is not None:
+        start_dump(args.metrics_file, args.metrics_interval)
+
+
+def stop():
+    """
+    Shut down the scrape endpoint and write the final dump.
+    """
+    while _outputs:
+        _outputs.pop()()
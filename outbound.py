@@ -0,0 +1,222 @@
+import collections
+import socket
+import threading
+
+import metrics
+import tracing
+from protocol import JSON, MAX_CLIENT_FRAME_BYTES, Decoder
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Outbound Queues
+# ------------------------------------------------------------------------------------------------------------------------------
+# Every connection gets a bounded queue of already-encoded messages and its own writer.
+# Broadcasting only appends bytes to queues, so a slow or stalled client can never make
+# the rest of the table (or the game_state_lock) wait on its socket.
+
+SHUTDOWN_FLUSH_SECONDS = 2       # Longest we wait at shutdown for goodbye messages to go out
+DEFAULT_QUEUE_SIZE = 256          # Messages waiting for one client before we call it a slow consumer
+POLICY_DISCONNECT = 'disconnect'  # Slow consumer: cut them off, they'll get the normal disconnect handling
+POLICY_DROP = 'drop'              # Slow consumer: throw away new messages until they catch up
+SLOW_CLIENT_POLICIES = (POLICY_DISCONNECT, POLICY_DROP)
+
+
+class BackpressureTotals:
+    """
+    Server-wide counters for the outbound queues. Busy counters (queued/sent) live on each
+    connection so broadcasts never share a lock across rooms; they're folded in here when a
+    connection closes. Rare events (drops, slow disconnects, a new deepest queue) come straight here.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0            # Messages handed to a queue
+        self.sent = 0              # Messages actually written to a socket
+        self.dropped = 0           # Messages thrown away because a queue was full
+        self.slow_disconnects = 0  # Clients cut off because their queue was full
+        self.max_depth = 0         # Deepest any single queue has been
+
+    def add(self, queued=0, sent=0, dropped=0, slow_disconnects=0, depth=0):
+        with self.lock:
+            self.queued += queued
+            self.sent += sent
+            self.dropped += dropped
+            self.slow_disconnects += slow_disconnects
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def snapshot(self, connections=()):
+        """
+        Totals so far, including the live counters of the given open connections.
+        """
+        with self.lock:
+            stats = {
+                "queued": self.queued,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "slow_disconnects": self.slow_disconnects,
+                "max_depth": self.max_depth,
+                "current_depth": 0,
+            }
+        for conn in connections:
+            stats["queued"] += conn.queued
+            stats["sent"] += conn.sent
+            stats["current_depth"] += conn.queue_depth()
+        return stats
+
+
+totals = BackpressureTotals()
+
+
+def print_summary(connections=()):
+    """
+    Show how the outbound queues held up, so we can spot slow clients.
+    """
+    stats = totals.snapshot(connections)
+    print(
+        f"Outbound: {stats['queued']} queued, {stats['sent']} sent, {stats['dropped']} dropped, "
+        f"{stats['slow_disconnects']} slow clients disconnected, deepest queue {stats['max_depth']}, "
+        f"{stats['current_depth']} still waiting"
+    )
+
+
+class QueuedConnection:
+    """
+    A client socket with a bounded send queue drained by its own writer thread.
+    send_payload() never blocks: it queues bytes, or applies the slow-client policy
+    when the queue is full.
+    """
+
+    def __init__(self, sock, name, max_queue=DEFAULT_QUEUE_SIZE, policy=POLICY_DISCONNECT):
+        self.sock = sock
+        self.name = name
+        self.encoding = JSON      # What we send them in
+        # How we read what they send us
+        self.decoder = Decoder(max_frame=MAX_CLIENT_FRAME_BYTES)
+        self.wants_state_updates = False  # Batched STATE_UPDATE frames instead of single messages
+        self.wants_heartbeat = False      # Pinged when quiet, and disconnected when silent (see heartbeat.py)
+        self.heard_from = True            # They've sent something since the last heartbeat check
+        self.quiet_checks = 0             # Heartbeat checks in a row they've been quiet for
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = collections.deque()
+        lock = threading.Lock()
+        self.condition = threading.Condition(lock)  # The writer waits on this for something to send
+        self.drained = threading.Condition(lock)    # flush() waits on this for the queue to empty
+        self.is_sending = False                     # The writer is in the middle of a sendall()
+        self.is_closed = False
+        self.queued = 0       # Messages queued for this client
+        self.sent = 0         # Messages written to this client's socket
+        self.high_water = 0   # Deepest this queue has been
+        self.dropped = 0      # Messages we threw away for this client
+        self.writer = threading.Thread(target=self._drain, name=f'writer-{name}', daemon=True)
+        self.writer.start()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def is_backlogged(self):
+        # Half full: anything that can skip a send (like spectator frames) should
+        return len(self.queue) * 2 >= self.max_queue
+
+    def send_payload(self, payload):
+        """
+        Queue an already-encoded message for this client.
+        """
+        with self.condition:
+            if self.is_closed:
+                return
+            depth = len(self.queue)
+            if depth >= self.max_queue:
+                self._handle_slow_consumer()
+                return
+            self.queue.append(payload)
+            self.queued += 1
+            depth += 1
+            if depth == 1:
+                # The writer only sleeps when the queue is empty
+                self.condition.notify()
+            if depth > self.high_water:
+                self.high_water = depth
+                totals.add(depth=depth)
+
+    def _handle_slow_consumer(self):
+        # Called with self.condition held
+        self.dropped += 1
+        metrics.inc('outbound_dropped_total')
+        if self.policy == POLICY_DROP:
+            totals.add(dropped=1)
+            return
+        print(f"{self.name} is too slow to keep up, disconnecting them.")
+        metrics.inc('slow_client_disconnects_total')
+        totals.add(dropped=1, slow_disconnects=1)
+        self._shutdown_socket()
+
+    def _shutdown_socket(self):
+        # Called with self.condition held
+        self.is_closed = True
+        self.queue.clear()
+        self.condition.notify()
+        self.drained.notify_all()
+        try:
+            # Wakes up both the writer (stuck in sendall) and the reader (stuck in recv),
+            # and the reader then runs the normal disconnect handling
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def hang_up(self):
+        """
+        Disconnect them from another thread; their reader runs the normal disconnect handling.
+        """
+        with self.condition:
+            if not self.is_closed:
+                self._shutdown_socket()
+
+    def _drain(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.is_closed:
+                    self.condition.wait()
+                if self.is_closed:
+                    return
+                # Take everything that's waiting and send it with one write
+                batch = list(self.queue)
+                self.queue.clear()
+                self.is_sending = True
+            trace = tracing.start('send')
+            try:
+                data = b''.join(batch)
+                self.sock.sendall(data)
+            except OSError:
+                # Client might have gone away, the reader will notice and clean up
+                with self.condition:
+                    self._shutdown_socket()
+                return
+            self.sent += len(batch)
+            metrics.inc('bytes_out_total', amount=len(data))
+            if trace is not None:
+                trace.finish(to=self.name, messages=len(batch), bytes=len(data))
+            with self.condition:
+                self.is_sending = False
+                if not self.queue:
+                    self.drained.notify_all()
+
+    def flush(self, timeout):
+        """
+        Wait (up to timeout seconds) until everything queued so far has been written to the socket.
+        Returns True if it all went out (False if it timed out, or the connection closed and threw the rest away).
+        """
+        with self.condition:
+            self.drained.wait_for(lambda: self.is_closed or (not self.queue and not self.is_sending), timeout)
+            return not self.queue and not self.is_sending and not self.is_closed
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.queue.clear()
+            self.condition.notify()
+            self.drained.notify_all()
+        # Fold this connection's counters into the server-wide totals
+        totals.add(queued=self.queued, sent=self.sent)
+        self.queued = self.sent = 0
+        self.sock.close()
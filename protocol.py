@@ -0,0 +1,397 @@
+import json
+import struct
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Wire Protocol
+# ------------------------------------------------------------------------------------------------------------------------------
+# Two ways to put a message on the wire:
+#   - JSON:   one JSON object per line (what every client speaks)
+#   - binary: 2-byte big-endian length, then a 1-byte opcode and packed fields
+#
+# Everyone starts in JSON. The server offers "binary" in WELCOME; a client that wants it
+# replies {"type": "SET_ENCODING", "encoding": "binary"} and switches its own sends right away.
+# The server answers {"type": "ENCODING", "encoding": "binary"} as its last JSON line and
+# sends binary from then on. Clients that never ask keep getting JSON.
+#
+# WELCOME also lists optional features. A client sends {"type": "ENABLE_FEATURE", "feature": ...}
+# to turn one on:
+#   - state_updates: everything from one change to the game (a flip, a hide, a new game) arrives
+#     as one STATE_UPDATE frame {"seq", "events", "score_deltas" or "scores"} instead of separate
+#     messages. Events leave out their scoreboards; "score_deltas" says how scores changed since
+#     the previous frame ("scores" is sent instead when the players changed). The server starts
+#     with a SNAPSHOT of the table; a client that sees a gap in seq asks for a new one with
+#     {"type": "SNAPSHOT_REQUEST"}.
+#   - heartbeat: the server answers {"type": "HEARTBEAT", "interval", "timeout"}, then PINGs a
+#     quiet client every interval seconds and disconnects one that's silent for timeout. Either
+#     side answers {"type": "PING"} with {"type": "PONG"}. Only offered while the server has
+#     heartbeats on (see heartbeat.py).
+#
+# Board size: GAME_START (and SNAPSHOT) carry "num_cards"; clients that don't find it assume 16.
+# A SNAPSHOT describes the board with "states", one hex byte per card (CARD_DOWN, CARD_UP or
+# CARD_MATCHED), and "faces", the identity of every card that isn't face-down, in card order.
+
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = (JSON, BINARY)
+
+STATE_UPDATES = 'state_updates'
+HEARTBEAT = 'heartbeat'
+FEATURES = (STATE_UPDATES, HEARTBEAT)
+
+CARD_DOWN = 0     # Card states, as kept by the server and sent in a SNAPSHOT
+CARD_UP = 1
+CARD_MATCHED = 2
+
+MAX_BINARY_FRAME = 0xFFFF  # Biggest body that fits behind the 2-byte length
+MAX_FRAME_BYTES = 64 * 1024  # Longest message we'll read (a SNAPSHOT of the biggest board is about half this)
+MAX_CLIENT_FRAME_BYTES = 1024  # Longest message the server reads from a player (theirs are all tiny)
+
+_length = struct.Struct('!H')
+_u8 = struct.Struct('!B')
+_u16 = struct.Struct('!H')
+_u32 = struct.Struct('!I')
+_card = struct.Struct('!BH')              # opcode, card_index
+_card_identity = struct.Struct('!BHH')    # opcode, card_index, identity
+_two_cards = struct.Struct('!BHH')        # opcode, card, card
+_player_two_cards = struct.Struct('!BIHH')  # opcode, player_id, card, card
+_player = struct.Struct('!BI')            # opcode, player_id
+_turn = struct.Struct('!BIB')             # opcode, player_id, current_player
+_welcome = struct.Struct('!BBIB')         # opcode, player_index, player_id, max_players
+_score = struct.Struct('!IH')             # player_id, score
+_score_delta = struct.Struct('!Ih')       # player_id, change in score
+_frame_header = struct.Struct('!BIB')     # opcode, seq, flags
+
+# Opcodes. OP_JSON carries any message that has no packed form (or has extra fields) as JSON.
+OP_JSON = 0
+OP_FLIP_CARD = 1
+OP_PLAY_AGAIN = 2
+OP_WELCOME = 10
+OP_CARD_REVEALED = 11
+OP_MATCH_RESULT = 12
+OP_HIDE_CARDS = 13
+OP_YOUR_TURN = 14
+OP_GAME_START = 15
+OP_GAME_OVER = 16
+OP_DISCONNECT = 17
+OP_GAME_FULL = 18
+OP_SHUTDOWN = 19
+OP_ERROR = 20
+OP_STATE_UPDATE = 21
+OP_TURN = 22       # YOUR_TURN without the scoreboard (inside a STATE_UPDATE)
+
+FRAME_FULL_SCORES = 1  # STATE_UPDATE flag: "scores" instead of "score_deltas"
+
+
+def encode_json(message):
+    """
+    One JSON object per line.
+    """
+    return (json.dumps(message) + '\n').encode()
+
+
+def encode_message(message, encoding=JSON):
+    """
+    Turn a message into the bytes we put on the wire for the given encoding.
+    """
+    if encoding == BINARY:
+        return encode_binary(message)
+    return encode_json(message)
+
+
+# -------------------------------------------------------------------------------------------------------------------
+#  Binary Encoding
+# ------------------------------------------------------------------------------------------------------------------
+
+def _pack_scores(scores):
+    parts = [_u8.pack(len(scores))]
+    for pid, score in scores.items():
+        parts.append(_score.pack(int(pid), score))
+    return b''.join(parts)
+
+
+def _unpack_scores(body, offset):
+    (count,) = _u8.unpack_from(body, offset)
+    offset += 1
+    scores = {}
+    for _ in range(count):
+        pid, score = _score.unpack_from(body, offset)
+        offset += _score.size
+        # Same as a JSON round trip: object keys come back as strings
+        scores[str(pid)] = score
+    return scores, offset
+
+
+def _pack_score_deltas(deltas):
+    parts = [_u8.pack(len(deltas))]
+    for pid, delta in deltas.items():
+        parts.append(_score_delta.pack(int(pid), delta))
+    return b''.join(parts)
+
+
+def _unpack_score_deltas(body, offset):
+    (count,) = _u8.unpack_from(body, offset)
+    offset += 1
+    deltas = {}
+    for _ in range(count):
+        pid, delta = _score_delta.unpack_from(body, offset)
+        offset += _score_delta.size
+        deltas[str(pid)] = delta
+    return deltas, offset
+
+
+def _pack_state_update(message):
+    events = message["events"]
+    if len(events) > 0xFF:
+        return None
+    full_scores = "scores" in message
+    parts = [_frame_header.pack(OP_STATE_UPDATE, message["seq"], FRAME_FULL_SCORES if full_scores else 0)]
+    if full_scores:
+        parts.append(_pack_scores(message["scores"]))
+    else:
+        parts.append(_pack_score_deltas(message["score_deltas"]))
+    parts.append(_u8.pack(len(events)))
+    for event in events:
+        body = _encode_body(event)
+        if body is None:
+            body = _u8.pack(OP_JSON) + json.dumps(event).encode()
+        if len(body) > MAX_BINARY_FRAME:
+            return None
+        parts.append(_length.pack(len(body)))
+        parts.append(body)
+    return b''.join(parts)
+
+
+def _unpack_state_update(body):
+    _, seq, flags = _frame_header.unpack_from(body)
+    message = {"type": "STATE_UPDATE", "seq": seq}
+    if flags & FRAME_FULL_SCORES:
+        message["scores"], offset = _unpack_scores(body, _frame_header.size)
+    else:
+        message["score_deltas"], offset = _unpack_score_deltas(body, _frame_header.size)
+    (count,) = _u8.unpack_from(body, offset)
+    offset += 1
+    events = []
+    for _ in range(count):
+        (size,) = _length.unpack_from(body, offset)
+        offset += _length.size
+        events.append(decode_binary(body[offset:offset + size]))
+        offset += size
+    message["events"] = events
+    return message
+
+
+def _pack_text(opcode, text):
+    data = text.encode()
+    return _u8.pack(opcode) + _u16.pack(len(data)) + data
+
+
+def _unpack_text(body):
+    (size,) = _u16.unpack_from(body, 1)
+    return str(body[3:3 + size], 'utf-8')
+
+
+def _encode_body(message):
+    """
+    Packed body for a message, or None if it has no packed form.
+    """
+    msg_type = message.get("type")
+    keys = len(message)
+    if msg_type == "FLIP_CARD" and keys == 2:
+        return _card.pack(OP_FLIP_CARD, message["card_index"])
+    if msg_type == "CARD_REVEALED" and keys == 3:
+        return _card_identity.pack(OP_CARD_REVEALED, message["card_index"], message["identity"])
+    if msg_type == "HIDE_CARDS" and keys == 2 and len(message["cards"]) == 2:
+        return _two_cards.pack(OP_HIDE_CARDS, *message["cards"])
+    if msg_type == "MATCH_RESULT" and keys == 3 and len(message["cards"]) == 2:
+        return _player_two_cards.pack(OP_MATCH_RESULT, message["player_id"], *message["cards"])
+    if msg_type == "YOUR_TURN" and keys == 4:
+        return _turn.pack(OP_YOUR_TURN, message["player_id"], message["current_player"]) + _pack_scores(message["scores"])
+    if msg_type == "YOUR_TURN" and keys == 3:
+        return _turn.pack(OP_TURN, message["player_id"], message["current_player"])
+    if msg_type == "STATE_UPDATE" and keys == 4:
+        return _pack_state_update(message)
+    if msg_type == "GAME_START" and keys == 4:
+        players = message["players"]
+        # num_cards goes last, so decoders that don't know about it just ignore it
+        return (_u8.pack(OP_GAME_START) + _u8.pack(len(players)) +
+                b''.join(_u32.pack(pid) for pid in players) + _pack_scores(message["scores"]) +
+                _u16.pack(message["num_cards"]))
+    if msg_type == "GAME_OVER" and keys == 2:
+        return _u8.pack(OP_GAME_OVER) + _pack_scores(message["scores"])
+    if msg_type == "PLAY_AGAIN" and keys == 1:
+        return _u8.pack(OP_PLAY_AGAIN)
+    if msg_type == "GAME_FULL" and keys == 1:
+        return _u8.pack(OP_GAME_FULL)
+    if msg_type == "DISCONNECT" and keys == 2:
+        return _player.pack(OP_DISCONNECT, message["player_id"])
+    if msg_type == "WELCOME" and keys == 4:
+        return _welcome.pack(OP_WELCOME, message["player_index"], message["player_id"], message["max_players"])
+    if msg_type == "ERROR" and keys == 2:
+        return _pack_text(OP_ERROR, message["message"])
+    if msg_type == "SHUTDOWN" and keys == 2:
+        return _pack_text(OP_SHUTDOWN, message["message"])
+    return None
+
+
+def encode_binary(message):
+    """
+    Length-prefixed binary frame. Messages without a packed form go inside as JSON.
+    """
+    body = _encode_body(message)
+    if body is None:
+        body = _u8.pack(OP_JSON) + json.dumps(message).encode()
+    if len(body) > MAX_BINARY_FRAME:
+        raise ValueError(f"message too big for a binary frame ({len(body)} bytes)")
+    return _length.pack(len(body)) + body
+
+
+def decode_binary(body):
+    """
+    Turn a binary frame body (without the length) back into a message dict.
+    body can be bytes or a memoryview into the receive buffer.
+    """
+    opcode = body[0]
+    if opcode == OP_FLIP_CARD:
+        _, card_index = _card.unpack_from(body)
+        return {"type": "FLIP_CARD", "card_index": card_index}
+    if opcode == OP_CARD_REVEALED:
+        _, card_index, identity = _card_identity.unpack_from(body)
+        return {"type": "CARD_REVEALED", "card_index": card_index, "identity": identity}
+    if opcode == OP_HIDE_CARDS:
+        _, first, second = _two_cards.unpack_from(body)
+        return {"type": "HIDE_CARDS", "cards": [first, second]}
+    if opcode == OP_MATCH_RESULT:
+        _, player_id, first, second = _player_two_cards.unpack_from(body)
+        return {"type": "MATCH_RESULT", "player_id": player_id, "cards": [first, second]}
+    if opcode == OP_YOUR_TURN:
+        _, player_id, current_player = _turn.unpack_from(body)
+        scores, _ = _unpack_scores(body, _turn.size)
+        return {"type": "YOUR_TURN", "player_id": player_id, "scores": scores, "current_player": current_player}
+    if opcode == OP_TURN:
+        _, player_id, current_player = _turn.unpack_from(body)
+        return {"type": "YOUR_TURN", "player_id": player_id, "current_player": current_player}
+    if opcode == OP_STATE_UPDATE:
+        return _unpack_state_update(body)
+    if opcode == OP_GAME_START:
+        count = body[1]
+        players = [_u32.unpack_from(body, 2 + 4 * i)[0] for i in range(count)]
+        scores, offset = _unpack_scores(body, 2 + 4 * count)
+        message = {"type": "GAME_START", "players": players, "scores": scores}
+        if len(body) >= offset + _u16.size:
+            (message["num_cards"],) = _u16.unpack_from(body, offset)
+        return message
+    if opcode == OP_GAME_OVER:
+        scores, _ = _unpack_scores(body, 1)
+        return {"type": "GAME_OVER", "scores": scores}
+    if opcode == OP_PLAY_AGAIN:
+        return {"type": "PLAY_AGAIN"}
+    if opcode == OP_GAME_FULL:
+        return {"type": "GAME_FULL"}
+    if opcode == OP_DISCONNECT:
+        _, player_id = _player.unpack_from(body)
+        return {"type": "DISCONNECT", "player_id": player_id}
+    if opcode == OP_WELCOME:
+        _, player_index, player_id, max_players = _welcome.unpack_from(body)
+        return {"type": "WELCOME", "player_index": player_index, "player_id": player_id, "max_players": max_players}
+    if opcode == OP_ERROR:
+        return {"type": "ERROR", "message": _unpack_text(body)}
+    if opcode == OP_SHUTDOWN:
+        return {"type": "SHUTDOWN", "message": _unpack_text(body)}
+    if opcode == OP_JSON:
+        return json.loads(str(body[1:], 'utf-8'))
+    raise ValueError(f"unknown opcode {opcode}")
+
+
+# -------------------------------------------------------------------------------------------------------------------
+#  Decoding a Stream
+# ------------------------------------------------------------------------------------------------------------------
+
+class FrameTooLarge(ValueError):
+    """
+    The peer sent (or is in the middle of sending) a message bigger than the decoder allows.
+    """
+
+
+class Decoder:
+    """
+    Collects bytes from recv() and hands back whole messages, one at a time.
+    The encoding can be switched between two messages (after SET_ENCODING/ENCODING);
+    bytes already buffered after that point are read in the new encoding.
+
+    Messages are read in place: a read position moves through the buffer, and the bytes
+    we've used are only cut off the front once per feed(), so a burst of messages doesn't
+    shift what's left after every single one. A message longer than max_frame raises
+    FrameTooLarge as soon as we can tell (from a binary length, or from that many bytes
+    without a newline), so a peer can't make us buffer more than that.
+    """
+
+    def __init__(self, encoding=JSON, max_frame=MAX_FRAME_BYTES):
+        self.encoding = encoding
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.start = 0    # Where the next message begins
+        self.scanned = 0  # How far we've already looked for a newline
+
+    def feed(self, data):
+        if self.start:
+            # Drop the messages we've already handed out, in one go
+            del self.buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+        self.buffer += data
+
+    def buffered(self):
+        """
+        Bytes received that aren't part of a message we've handed out yet.
+        """
+        return len(self.buffer) - self.start
+
+    def next_message(self):
+        """
+        The next complete message, or None if we need more bytes.
+        """
+        frame = self._next_frame()
+        if frame is None:
+            return None
+        start, end = frame
+        with memoryview(self.buffer) as view:
+            if self.encoding == BINARY:
+                return decode_binary(view[start:end])
+            # Straight from the buffer to text, no bytes copy in between
+            return json.loads(str(view[start:end], 'utf-8'))
+
+    def skip_message(self):
+        """
+        Throw the next complete message away without reading it. False if we need more bytes first.
+        """
+        return self._next_frame() is not None
+
+    def _next_frame(self):
+        """
+        Move past the next complete message and return where its body is, as (start, end).
+        """
+        buffer = self.buffer
+        start = self.start
+        if self.encoding == BINARY:
+            if len(buffer) - start < _length.size:
+                return None
+            (size,) = _length.unpack_from(buffer, start)
+            if size > self.max_frame:
+                raise FrameTooLarge(f"{size} byte frame (limit {self.max_frame})")
+            body_start = start + _length.size
+            end = body_start + size
+            if len(buffer) < end:
+                return None
+            self.start = self.scanned = end
+            return body_start, end
+        end = buffer.find(b'\n', max(self.scanned, start))
+        if end < 0:
+            # Remember how far we got, so the next feed() only searches the new bytes
+            self.scanned = len(buffer)
+            if self.scanned - start > self.max_frame:
+                raise FrameTooLarge(f"no end of line after {self.scanned - start} bytes (limit {self.max_frame})")
+            return None
+        self.start = self.scanned = end + 1
+        if end - start > self.max_frame:
+            raise FrameTooLarge(f"{end - start} byte line (limit {self.max_frame})")
+        return start, end
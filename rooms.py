@@ -0,0 +1,663 @@
+import threading
+import random
+import time
+
+import heartbeat
+import journal
+import leaderboard
+import metrics
+import outbound
+import tracing
+from heartbeat import HeartbeatMonitor
+from spectators import DEFAULT_FRAME_SECONDS, DEFAULT_MAX_SPECTATORS, SpectatorHub
+from protocol import CARD_DOWN, ENCODINGS, FEATURES, HEARTBEAT, encode_message
+from rules import GameState, IllegalMove, deal
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Rooms and the Room Registry
+# ---------------------------------------------------------------------------------------------------------------------
+# Everything about a single game table lives here so that both server engines
+# (one thread per player, or one asyncio event loop) can share the same game rules.
+
+MISMATCH_REVEAL_SECONDS = 2  # Default time a mismatched pair stays face-up before it's hidden again
+DEFAULT_PAIRS = 8            # Pairs on the board (8 pairs = 16 cards)
+MIN_PAIRS = 2
+MAX_PAIRS = 2048             # Keeps a SNAPSHOT of the whole board inside one binary frame
+# Message types players can send us. Anything else is counted as "unknown" in the metrics.
+CLIENT_MESSAGE_TYPES = ('FLIP_CARD', 'PLAY_AGAIN', 'SNAPSHOT_REQUEST', 'ENABLE_FEATURE', 'SET_ENCODING', 'PING', 'PONG')
+
+
+def send_message_to_client(client_conn, message):
+    """
+    Send a message to a single client, in whichever encoding they asked for. Connections
+    queue the bytes and send them on their own time, so this never waits on the network.
+    """
+    client_conn.send_payload(encode_message(message, client_conn.encoding))
+    metrics.inc('messages_out_total', message["type"])
+
+
+class NullLock:
+    """
+    A lock that never blocks. Used when everything runs on one event loop,
+    where nothing else can sneak in between two lines of code anyway.
+    """
+
+    def acquire(self, blocking=True, timeout=-1):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Game Room (one table, protected by its own locks)
+# ---------------------------------------------------------------------------------------------------------------------
+
+class Room:
+    """
+    One game table. Each room owns its deck, scores, turn pointer and players,
+    and has its own locks so a busy room never blocks any other room.
+
+    The scheduler is anything with call_later(delay, callback, *args) (a DeadlineScheduler
+    or an asyncio loop); it hides mismatched cards later so nobody sleeps holding a lock.
+    lock_factory/rlock_factory pick the kind of lock to use (real threading locks,
+    or NullLock on the event loop).
+
+    The rules themselves live in a GameState (see rules.py); the room decides when to ask it
+    things and tells everyone what happened. Every flip already happens under game_state_lock,
+    so the game doesn't need locks of its own.
+    """
+
+    def __init__(self, room_id, expected_players, scheduler, lock_factory=threading.Lock,
+                 rlock_factory=threading.RLock, reveal_seconds=MISMATCH_REVEAL_SECONDS,
+                 num_pairs=DEFAULT_PAIRS, heartbeats=None):
+        self.room_id = room_id
+        self.expected_players = expected_players
+        self.scheduler = scheduler
+        self.reveal_seconds = reveal_seconds
+        self.num_pairs = num_pairs
+        self.heartbeats = heartbeats   # The registry's HeartbeatMonitor, for players who turn heartbeats on
+        # We'll keep a list of everyone at this table (connection, address, player_id)
+        self.connected_clients = []
+        self.player_names = {}         # player_id -> the name they gave in JOIN (None if they didn't), for the leaderboard
+        self.clients_lock = metrics.instrument_lock(rlock_factory(), 'clients_lock')
+
+        self.game = None               # The GameState being played (None until the first deal)
+        self.player_scores = {}        # The game's scoreboard (the same dict as self.game.scores)
+        self.game_number = 0           # Goes up every new game, so old scheduled hides can tell they're stale
+        self.seq = 0                   # Goes up with every publish(), so STATE_UPDATE clients can spot gaps
+        self.recorder = None           # Writes this game to the journal (None when there's no journal)
+        self.spectator_feed = None     # Collects what we publish for spectators (None when nobody's watching)
+        # The table as of the last publish(), what new spectators start from (see published_snapshot)
+        self.published = (0, [], {}, False, False, bytes(2 * num_pairs), None, None)
+        self.published_scores = {}     # Scores as of the last STATE_UPDATE, what score_deltas count from
+        self.is_game_started = False
+        self.is_waiting_for_players = False  # Someone left and we're holding the table for a replacement
+        self.is_closed = False               # Everyone left, the registry has thrown this room away
+        self.game_state_lock = metrics.instrument_lock(lock_factory(), 'game_state_lock')
+
+    def is_full(self):
+        return len(self.connected_clients) >= self.expected_players
+
+    def player_index_of(self, player_id):
+        """
+        Seat number (1-4) of a player at this table.
+        """
+        with self.clients_lock:
+            for i, (_, _, pid) in enumerate(self.connected_clients):
+                if pid == player_id:
+                    return i + 1
+        return None
+
+    def welcome_message(self, player_id):
+        """
+        Hi! Your seat number, and which optional protocol extras this server speaks.
+        """
+        return {
+            "type": "WELCOME",
+            "player_index": self.player_index_of(player_id),
+            "player_id": player_id,
+            "max_players": self.expected_players,
+            "encodings": list(ENCODINGS),
+            "features": self.offered_features(),
+        }
+
+    def offered_features(self):
+        # Heartbeats are only offered while this server is sending them
+        if heartbeat.is_enabled() and self.heartbeats is not None:
+            return list(FEATURES)
+        return [feature for feature in FEATURES if feature != HEARTBEAT]
+
+    def broadcast_message(self, message):
+        """
+        Send a message to everyone at this table (and nobody else).
+        """
+        with self.game_state_lock:
+            self.publish([message])
+
+    def publish(self, events):
+        """
+        Send everything that came out of one change to the game. Call with game_state_lock held,
+        so changes go out in the same order they happened (this only queues bytes, it never waits).
+
+        Players who turned on state updates get all the events in a single STATE_UPDATE frame,
+        numbered with seq and carrying score changes instead of whole scoreboards. Everyone else
+        gets the events one message at a time, like always. Each message is encoded once per encoding.
+        """
+        with self.clients_lock:
+            self.seq += 1
+            frame = None
+            event_payloads = {}
+            frame_payloads = {}
+            frame_recipients = 0
+            for client_conn, _, _ in self.connected_clients:
+                encoding = client_conn.encoding
+                if client_conn.wants_state_updates:
+                    payload = frame_payloads.get(encoding)
+                    if payload is None:
+                        if frame is None:
+                            frame = self._state_update_frame(events)
+                        payload = frame_payloads[encoding] = encode_message(frame, encoding)
+                    client_conn.send_payload(payload)
+                    frame_recipients += 1
+                else:
+                    payloads = event_payloads.get(encoding)
+                    if payloads is None:
+                        payloads = event_payloads[encoding] = [encode_message(event, encoding) for event in events]
+                    for payload in payloads:
+                        client_conn.send_payload(payload)
+            if frame is None:
+                # Nobody wanted a frame this time, but deltas in the next one still count from here
+                self.published_scores = dict(self.player_scores)
+            players = [int(pid) for _, _, pid in self.connected_clients]
+            scores = dict(self.player_scores)
+            game = self.game
+            turn = None
+            if self.is_game_started:
+                turn = (game.current_player_id(), game.current_player_index + 1)
+            # Set before we look for a feed, so a feed that's attaching right now either gets these
+            # events pushed to it or already sees them here (SpectatorFeed.start sorts it out by seq)
+            self.published = (self.seq, players, scores, self.is_game_started, self.is_game_over(),
+                              bytes(game.card_states) if game is not None else bytes(2 * self.num_pairs),
+                              game.deck if game is not None else None, turn)
+            feed = self.spectator_feed
+            if feed is not None:
+                # Spectators get these on the hub's next tick, see spectators.py
+                feed.push(self.seq, events, scores, players)
+            if metrics.enabled:
+                event_recipients = len(self.connected_clients) - frame_recipients
+                if frame_recipients:
+                    metrics.inc('messages_out_total', 'STATE_UPDATE', frame_recipients)
+                if event_recipients:
+                    for event in events:
+                        metrics.inc('messages_out_total', event["type"], event_recipients)
+
+    def _state_update_frame(self, events):
+        """
+        One STATE_UPDATE frame: the events without their scoreboards, plus what changed in
+        the scores since the last frame. If the set of players changed we send the whole scoreboard.
+        """
+        frame = {
+            "type": "STATE_UPDATE",
+            "seq": self.seq,
+            "events": [{k: v for k, v in event.items() if k != "scores"} for event in events],
+        }
+        if self.player_scores.keys() != self.published_scores.keys():
+            frame["scores"] = dict(self.player_scores)
+        else:
+            frame["score_deltas"] = {
+                pid: score - self.published_scores[pid]
+                for pid, score in self.player_scores.items()
+                if score != self.published_scores[pid]
+            }
+        self.published_scores = dict(self.player_scores)
+        return frame
+
+    def snapshot(self):
+        """
+        Everything a client needs to draw the table right now. Call with game_state_lock held.
+        """
+        game = self.game
+        if game is None:
+            # Nothing dealt yet: a face-down board of the size we're going to deal
+            card_states, faces = bytes(2 * self.num_pairs), []
+        else:
+            card_states, faces = game.card_states, game.faces()
+        snapshot = {
+            "type": "SNAPSHOT",
+            "seq": self.seq,
+            "players": [int(pid) for _, _, pid in self.connected_clients],
+            "scores": dict(self.player_scores),
+            "started": self.is_game_started,
+            "game_over": self.is_game_over(),
+            "num_cards": len(card_states),
+            # One hex byte per card, then the identity of every card that isn't face-down, in order
+            "states": card_states.hex(),
+            "faces": faces,
+        }
+        if self.is_game_started:
+            snapshot["player_id"] = game.current_player_id()
+            snapshot["current_player"] = game.current_player_index + 1
+        return snapshot
+
+    def published_snapshot(self):
+        """
+        The table as of the last publish(), in the same shape as snapshot(). Takes no lock, so
+        spectators can start watching without ever making the game wait.
+        """
+        seq, players, scores, started, game_over, card_states, deck, turn = self.published
+        snapshot = {
+            "type": "SNAPSHOT",
+            "seq": seq,
+            "players": list(players),
+            "scores": dict(scores),
+            "started": started,
+            "game_over": game_over,
+            "num_cards": len(card_states),
+            "states": card_states.hex(),
+            "faces": [deck[i] for i, state in enumerate(card_states) if state != CARD_DOWN],
+        }
+        if turn is not None:
+            snapshot["player_id"], snapshot["current_player"] = turn
+        return snapshot
+
+    def send_snapshot(self, client_conn):
+        """
+        Send one client the whole table. Frames after this one continue from its seq.
+        """
+        with self.game_state_lock:
+            send_message_to_client(client_conn, self.snapshot())
+
+    def is_game_over(self):
+        return self.game is not None and self.game.is_over()
+
+    def handle_message(self, player_id, client_conn, message):
+        """
+        Act on one message from a player.
+        """
+        msg_type = message.get('type')
+        metrics.inc('messages_in_total', msg_type if msg_type in CLIENT_MESSAGE_TYPES else 'unknown')
+        if msg_type == 'FLIP_CARD':
+            started = time.perf_counter()
+            self.process_flip_request(player_id, message.get('card_index'), client_conn)
+            metrics.observe('flip_request_seconds', time.perf_counter() - started)
+        elif msg_type == 'PLAY_AGAIN':
+            self.play_again()
+        elif msg_type == 'SNAPSHOT_REQUEST':
+            # The client noticed a gap in the STATE_UPDATE seq numbers
+            self.send_snapshot(client_conn)
+        elif msg_type == 'ENABLE_FEATURE':
+            self.enable_feature(client_conn, message.get('feature'))
+        elif msg_type == 'SET_ENCODING':
+            self.switch_encoding(client_conn, message.get('encoding'))
+        elif msg_type == 'PING':
+            # The client is checking we're still here (a PONG from them needs no answer)
+            send_message_to_client(client_conn, {"type": "PONG"})
+
+    def enable_feature(self, client_conn, feature):
+        """
+        Turn on an optional protocol feature for one client.
+        state_updates: batched STATE_UPDATE frames, starting with a SNAPSHOT of the table.
+        heartbeat: PINGs while they're quiet, and a disconnect if they go silent (see heartbeat.py).
+        """
+        if feature not in self.offered_features():
+            send_message_to_client(client_conn, {"type": "ERROR", "message": "Unknown feature."})
+            return
+        if feature == HEARTBEAT:
+            with self.clients_lock:
+                self.heartbeats.start(client_conn)
+            return
+        with self.game_state_lock:
+            client_conn.wants_state_updates = True
+            send_message_to_client(client_conn, self.snapshot())
+
+    def switch_encoding(self, client_conn, encoding):
+        """
+        A client asked for a different wire encoding. From now on we read theirs in the new
+        encoding, and our ENCODING reply is the last thing we send them in the old one.
+        Holding the locks means no broadcast can slip in between the reply and the switch.
+        """
+        if encoding not in ENCODINGS:
+            send_message_to_client(client_conn, {"type": "ERROR", "message": "Unknown encoding."})
+            return
+        client_conn.decoder.encoding = encoding
+        with self.game_state_lock, self.clients_lock:
+            send_message_to_client(client_conn, {"type": "ENCODING", "encoding": encoding})
+            client_conn.encoding = encoding
+
+    # ----------------------------------------------------------------------------------------------------------------------------
+    #  Starting the Game
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def start_game(self):
+        """
+        Shuffle the cards, pick who goes first, and let everyone know the game is on!
+        """
+        with self.game_state_lock:
+            self._start_game_locked()
+
+    def play_again(self):
+        """
+        Someone at the end screen wants another game. Only the first request after a game ends
+        deals again; the rest (more clicks, other players asking too) are folded into it.
+        """
+        with self.game_state_lock:
+            # handling disconnect at end screen while other player clicks play again
+            if self.is_full() and self.is_game_over():
+                self._start_game_locked()
+            else:
+                metrics.inc('play_again_ignored_total')
+
+    def start_if_full(self):
+        """
+        Call after a player sits down. Starts the game once everyone is here, or restarts it
+        straight away if we were holding the table for a replacement. Returns True if a game started.
+        """
+        with self.game_state_lock:
+            if not self.is_full():
+                return False
+            if self.is_waiting_for_players:
+                # Somebody took the empty seat
+                self.is_waiting_for_players = False
+                self.publish([{"type": "GAME_FULL"}])
+            elif self.is_game_started:
+                return False
+            self._start_game_locked()
+        return True
+
+    def hold_for_replacement(self, player_id):
+        """
+        Call before a player is taken out of a game in progress: the table waits for someone to take
+        their seat, and start_if_full() restarts the game when they do. Nobody has to sit and wait for it.
+        """
+        with self.game_state_lock:
+            if self.is_game_started and not self.is_closed:
+                self.is_waiting_for_players = True
+            if self.recorder is not None:
+                self.recorder.abandoned(player_id)
+                self.recorder = None
+
+    def _start_game_locked(self):
+        # Deal a shuffled deck of pairs (8 pairs = 16 cards unless the server says otherwise),
+        # from a seed we keep so the journal can say exactly how this deal came about
+        seed = random.getrandbits(64)
+        deck = deal(self.num_pairs, seed)
+        player_ids = [int(pid) for _, _, pid in self.connected_clients]
+        # Everyone starts with zero points, and somebody random goes first
+        self.game = GameState(deck, player_ids, random.randrange(len(player_ids)))
+        self.player_scores = self.game.scores
+        self.game_number += 1
+        self.is_game_started = True
+        if self.recorder is not None:
+            # The last game never finished (somebody asked for a new one part way through)
+            self.recorder.abandoned(0)
+        self.recorder = journal.new_game(self.room_id, seed, deck, player_ids, self.game.current_player_index)
+
+        # Let all players know we've started, and whose turn it is
+        self.publish([
+            {
+                "type": "GAME_START",
+                "players": player_ids,
+                "scores": self.player_scores,
+                "num_cards": len(deck),
+            },
+            self._turn_event(),
+        ])
+
+    # --------------------------------------------------------------------------------------------------------------------
+    #  Turn Notification
+    # ---------------------------------------------------------------------------------------------------------------------
+
+    def _turn_event(self):
+        """
+        The message that tells everyone whose turn it is now. Call with game_state_lock held.
+        """
+        return {
+            "type": "YOUR_TURN",
+            "player_id": self.game.current_player_id(),
+            "scores": self.player_scores,
+            "current_player": self.game.current_player_index + 1
+        }
+
+    # -------------------------------------------------------------------------------------------------------------------
+    #  Handling a card Flip
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def process_flip_request(self, player_id, card_index, client_conn):
+        """
+        When a player asks to flip a card:
+          - Check turn order
+          - Validate that card can be flipped
+          - Reveal it, compare if it's the second flip
+          - Handle matches or mismatches, update scores or change turns
+        Everything this flip causes goes out together in one publish().
+        A refused flip gets an ERROR naming the card, so a client that already shows it face-up can put it back.
+        """
+        trace = tracing.current()
+        if trace is not None:
+            trace.mark('lock_wait')
+        with self.game_state_lock:
+            if trace is not None:
+                trace.mark('rules')
+            # 0) Nobody plays while the table is missing someone
+            if not self.is_game_started or not self.is_full():
+                send_message_to_client(client_conn, {"type": "ERROR", "message": "Waiting for players.", "card_index": card_index})
+                return
+            # 1) Ask the rules: their turn, nothing still on show, and a card that's face-down
+            try:
+                flip = self.game.flip(player_id, card_index)
+            except IllegalMove as error:
+                if trace is not None:
+                    trace.args["error"] = str(error)
+                send_message_to_client(client_conn, {"type": "ERROR", "message": str(error), "card_index": card_index})
+                return
+            # 2) Reveal the card to everyone
+            events = [{"type": "CARD_REVEALED", "card_index": card_index, "identity": flip.identity}]
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.flip(player_id, card_index)
+
+            if flip.is_match:
+                # Great! Those two cards stay face-up and count for a point
+                if recorder is not None:
+                    recorder.match(player_id, flip.other_index, card_index)
+                events.append({
+                    "type": "MATCH_RESULT",
+                    "player_id": player_id,
+                    "cards": [flip.other_index, card_index],
+                })
+                # If every pair is matched, the game is then over
+                if self.game.is_over():
+                    events.append({"type": "GAME_OVER", "scores": self.player_scores})
+                    if recorder is not None:
+                        recorder.game_over()
+                        self.recorder = None
+                    # Written out (and a LEADERBOARD sent back, see send_leaderboard) on another thread
+                    leaderboard.record(self, self.game_number, self.player_names, self.player_scores)
+            elif flip.other_index is not None:
+                # Let everyone see the mismatch for a moment, then hide_mismatch flips them
+                # back down and moves the turn on. Nobody waits on the lock in the meantime.
+                self.scheduler.call_later(self.reveal_seconds, self.hide_mismatch, self.game_number)
+            if trace is not None:
+                trace.mark('publish')
+            self.publish(events)
+
+    def send_leaderboard(self, game_number, top, standings):
+        """
+        Called on the scheduler once a finished game is on the leaderboard: tell each player at the
+        table the top players and where they stand (standings is {player_id: standing or None}).
+        """
+        with self.game_state_lock, self.clients_lock:
+            if game_number != self.game_number or self.is_closed:
+                # They've already started another game (or left)
+                return
+            for client_conn, _, player_id in self.connected_clients:
+                send_message_to_client(client_conn, {"type": "LEADERBOARD", "top": top, "you": standings.get(player_id)})
+
+    def hide_mismatch(self, game_number):
+        """
+        Called by the scheduler once a mismatched pair has been on show long enough:
+        flip the pair back down and move on to the next player.
+        """
+        trace = tracing.start('HIDE_CARDS', 'lock_wait', {"room": self.room_id, "game": game_number})
+        with self.game_state_lock:
+            if trace is not None:
+                trace.mark('rules')
+            if game_number != self.game_number or not self.is_full():
+                # A new game started (or someone left) while we were waiting
+                return
+            pair = self.game.hide_mismatch()
+            if pair is None:
+                return
+            pidx, cidx = pair
+            if self.recorder is not None:
+                self.recorder.hide(pidx, cidx)
+                self.recorder.turn(self.game.current_player_index, self.game.current_player_id())
+            if trace is not None:
+                trace.mark('publish')
+            self.publish([
+                {"type": "HIDE_CARDS", "cards": [pidx, cidx]},
+                self._turn_event(),
+            ])
+        if trace is not None:
+            trace.finish()
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Room Registry (finds a seat for every new player)
+# ---------------------------------------------------------------------------------------------------------------------
+
+class RoomRegistry:
+    """
+    Keeps track of every room on this server. New players are seated at a room
+    with an empty seat (oldest first), and a new room is opened when all are full.
+    Rooms are --players big unless the player asked for another table size (see matchmaking.py).
+    """
+
+    def __init__(self, players_per_room, max_rooms, scheduler, lock_factory=threading.Lock,
+                 rlock_factory=threading.RLock, reveal_seconds=MISMATCH_REVEAL_SECONDS,
+                 num_pairs=DEFAULT_PAIRS, spectator_seconds=DEFAULT_FRAME_SECONDS,
+                 max_spectators=DEFAULT_MAX_SPECTATORS):
+        self.players_per_room = players_per_room
+        self.max_rooms = max_rooms
+        self.scheduler = scheduler
+        self.lock_factory = lock_factory
+        self.rlock_factory = rlock_factory
+        self.reveal_seconds = reveal_seconds
+        self.num_pairs = num_pairs
+        self.rooms = {}        # room_id -> Room
+        self.open_rooms = {}   # room_id -> Room, only rooms with an empty seat (kept in insertion order)
+        self.next_room_id = 1
+        self.lock = lock_factory()
+        self.on_seats_changed = None  # Called (outside our lock) after every seat_player() and remove_player()
+        self.on_seat_freed = None     # Called (outside our lock, from whichever thread) when remove_player() opens a seat
+        self.spectators = SpectatorHub(self, scheduler, lock_factory, spectator_seconds, max_spectators)
+        self.heartbeats = HeartbeatMonitor(self, scheduler, lock_factory)
+
+    def seat_player(self, client_conn, client_addr, player_id, players=None, name=None):
+        """
+        Put a player at a table for players people (any size if None) and queue their WELCOME.
+        Returns the Room, or None if every such room is full and we're not allowed to open another
+        one. name is what they're called on the leaderboard.
+        """
+        with self.lock:
+            room = self._open_room_for(players)
+            if room is None and len(self.rooms) < self.max_rooms:
+                room = Room(self.next_room_id, players or self.players_per_room, self.scheduler,
+                            self.lock_factory, self.rlock_factory, self.reveal_seconds, self.num_pairs,
+                            self.heartbeats)
+                self.next_room_id += 1
+                self.rooms[room.room_id] = room
+                self.open_rooms[room.room_id] = room
+            if room is not None:
+                with room.clients_lock:
+                    room.connected_clients.append((client_conn, client_addr, player_id))
+                    room.player_names[player_id] = name
+                    # Queued before we let go of clients_lock, so no broadcast (another seat's
+                    # GAME_START, say) can reach them ahead of it
+                    send_message_to_client(client_conn, room.welcome_message(player_id))
+                    if room.is_full():
+                        self.open_rooms.pop(room.room_id, None)
+        if self.on_seats_changed is not None:
+            self.on_seats_changed()
+        return room
+
+    def _open_room_for(self, players):
+        """
+        The oldest room with an empty seat at a table for players people (call with self.lock held).
+        """
+        for room in self.open_rooms.values():
+            if players is None or room.expected_players == players:
+                return room
+        return None
+
+    def open_table_sizes(self):
+        """
+        The table sizes that have an empty seat somewhere, the oldest such room's first.
+        """
+        with self.lock:
+            return list(dict.fromkeys(room.expected_players for room in self.open_rooms.values()))
+
+    def can_open_room(self):
+        return len(self.rooms) < self.max_rooms
+
+    def remove_player(self, room, player_id):
+        """
+        Take a player out of their room. Empty rooms are thrown away,
+        otherwise the room opens its seat back up for a replacement.
+        """
+        with self.lock:
+            with room.clients_lock:
+                room.connected_clients[:] = [c for c in room.connected_clients if c[2] != player_id]
+                room.player_names.pop(player_id, None)
+                is_empty = not room.connected_clients
+            if is_empty:
+                room.is_closed = True
+                self.rooms.pop(room.room_id, None)
+                self.open_rooms.pop(room.room_id, None)
+            else:
+                self.open_rooms[room.room_id] = room
+        if self.on_seats_changed is not None:
+            self.on_seats_changed()
+        if self.on_seat_freed is not None:
+            # Somebody waiting in line can have it (or the room we just closed makes space for a new one)
+            self.on_seat_freed()
+
+    def all_rooms(self):
+        with self.lock:
+            return list(self.rooms.values())
+
+    def open_seat_count(self):
+        """
+        Empty seats across all rooms that have one.
+        """
+        with self.lock:
+            return sum(room.expected_players - len(room.connected_clients) for room in self.open_rooms.values())
+
+    def player_count(self):
+        return sum(len(room.connected_clients) for room in self.all_rooms())
+
+    def active_game_count(self):
+        return sum(1 for room in self.all_rooms() if room.is_game_started and not room.is_game_over())
+
+    def register_gauges(self):
+        """
+        Let the metrics ask us how many players and games there are, and how backed up their send queues are.
+        """
+        metrics.gauge('connected_clients', self.player_count)
+        metrics.gauge('active_games', self.active_game_count)
+        metrics.gauge('rooms', lambda: len(self.rooms))
+        # Messages (threads) or bytes (asyncio) waiting for players right now, and the deepest one queue has been
+        metrics.gauge('outbound_queue_depth', lambda: outbound.totals.snapshot(self.all_connections())["current_depth"])
+        metrics.gauge('outbound_queue_max_depth', lambda: outbound.totals.snapshot()["max_depth"])
+
+    def all_connections(self):
+        connections = []
+        for room in self.all_rooms():
+            with room.clients_lock:
+                connections.extend(conn for conn, _, _ in room.connected_clients)
+        return connections
@@ -0,0 +1,110 @@
+import random
+from array import array
+from collections import namedtuple
+
+from protocol import CARD_DOWN, CARD_MATCHED, CARD_UP
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Game Rules
+# ---------------------------------------------------------------------------------------------------------------------
+# The rules of Memory and nothing else: no sockets, no locks, no messages and no clocks.
+# Room (rooms.py) keeps one GameState per game, asks it whether a flip is allowed and turns
+# what happened into messages. Anything that wants to play games without a server (tests,
+# bots, simulate.py) can use the same rules.
+#
+# A turn is two flips. A pair stays up and scores a point, and the same player goes again.
+# A mismatch stays on show until hide_mismatch() is called (the server waits --reveal-delay
+# first), which turns the pair back down and passes the turn on. The game is over when every
+# pair has been found.
+
+# What happened on a flip. other_index is the first card of the turn (None if this was the first card).
+Flip = namedtuple('Flip', 'card_index identity other_index is_match')
+
+
+class IllegalMove(ValueError):
+    """
+    A flip the rules don't allow. The message is what we tell the player.
+    """
+
+
+def deal(num_pairs, seed):
+    """
+    A shuffled deck of num_pairs pairs (the identity of each card). The same seed always deals the same deck.
+    """
+    deck = array('H', range(num_pairs)) * 2
+    random.Random(seed).shuffle(deck)
+    return deck
+
+
+class GameState:
+    """
+    One game in progress: the cards, the scores and whose turn it is.
+    """
+
+    def __init__(self, deck, player_ids, first_player=0):
+        self.deck = deck                            # The identity of each card
+        self.card_states = bytearray(len(deck))     # CARD_DOWN, CARD_UP or CARD_MATCHED for each card
+        self.num_pairs = len(deck) // 2
+        self.matched_pairs = 0                      # How many pairs have been found, so "is it over?" is one comparison
+        self.player_ids = list(player_ids)          # In seat order
+        self.scores = {pid: 0 for pid in self.player_ids}  # How many pairs each player has found
+        self.current_player_index = first_player    # Whose turn it is
+        self.first_flipped_card = None              # The first card flipped this turn, to compare the second against
+        self.pending_hide = None                    # A mismatched pair that is still on show
+
+    def current_player_id(self):
+        return self.player_ids[self.current_player_index]
+
+    def is_over(self):
+        return self.matched_pairs == self.num_pairs
+
+    def faces(self):
+        """
+        The identity of every card that isn't face-down, in board order.
+        """
+        return [self.deck[i] for i, state in enumerate(self.card_states) if state != CARD_DOWN]
+
+    def flip(self, player_id, card_index):
+        """
+        player_id turns over card_index. Returns a Flip, or raises IllegalMove if they can't.
+        """
+        if self.current_player_id() != player_id:
+            raise IllegalMove("It's not your turn.")
+        if self.pending_hide is not None:
+            raise IllegalMove("Please wait, cards are being hidden.")
+        if (not isinstance(card_index, int) or card_index < 0 or card_index >= len(self.deck) or
+                self.card_states[card_index] != CARD_DOWN):
+            raise IllegalMove("Cannot flip that card.")
+
+        self.card_states[card_index] = CARD_UP
+        identity = self.deck[card_index]
+        other_index = self.first_flipped_card
+        if other_index is None:
+            # Wait for the second card
+            self.first_flipped_card = card_index
+            return Flip(card_index, identity, None, False)
+
+        self.first_flipped_card = None
+        is_match = self.deck[other_index] == identity
+        if is_match:
+            self.card_states[other_index] = CARD_MATCHED
+            self.card_states[card_index] = CARD_MATCHED
+            self.matched_pairs += 1
+            self.scores[player_id] += 1
+        else:
+            # Stays on show until hide_mismatch()
+            self.pending_hide = (other_index, card_index)
+        return Flip(card_index, identity, other_index, is_match)
+
+    def hide_mismatch(self):
+        """
+        Turn the mismatched pair back down and pass the turn on. Returns the pair, or None if there wasn't one.
+        """
+        if self.pending_hide is None:
+            return None
+        pair = self.pending_hide
+        for idx in pair:
+            self.card_states[idx] = CARD_DOWN
+        self.pending_hide = None
+        self.current_player_index = (self.current_player_index + 1) % len(self.player_ids)
+        return pair
@@ -0,0 +1,89 @@
+import heapq
+import itertools
+import threading
+import time
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Deadline Scheduler
+# ------------------------------------------------------------------------------------------------------------------------------
+# Runs callbacks at a later time on one background thread, so nobody has to sleep while
+# holding a lock. It has the same call_later(delay, callback, *args) and
+# call_soon_threadsafe(callback, *args) shapes as an asyncio event loop, which lets a Room use either one.
+
+
+class ScheduledCall:
+    """
+    Handle returned by call_later(). cancel() stops the callback if it hasn't run yet.
+    """
+
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DeadlineScheduler:
+    """
+    A min-heap of deadlines served by a single daemon thread. The thread sleeps on a
+    condition variable until the earliest deadline (or until something earlier is added).
+    """
+
+    def __init__(self, name='scheduler'):
+        self._heap = []                 # (deadline, sequence number, ScheduledCall)
+        self._sequence = itertools.count()  # Breaks ties so calls with the same deadline run in order
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run callback(*args) on the scheduler thread after delay seconds.
+        """
+        call = ScheduledCall(time.monotonic() + delay, callback, args)
+        with self._condition:
+            heapq.heappush(self._heap, (call.deadline, next(self._sequence), call))
+            # Only wake the thread up if this is now the first thing due
+            if self._heap[0][2] is call:
+                self._condition.notify()
+        return call
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Run callback(*args) on the scheduler thread as soon as it can (safe from any thread, like everything here).
+        """
+        return self.call_later(0, callback, *args)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    wait_for = self._heap[0][0] - time.monotonic()
+                    if wait_for <= 0:
+                        break
+                    self._condition.wait(wait_for)
+                if not self._running:
+                    return
+                _, _, call = heapq.heappop(self._heap)
+            # Run the callback without holding our own lock, so it can schedule more work
+            if call.cancelled:
+                continue
+            try:
+                call.callback(*call.args)
+            except Exception as error:
+                print(f"Oops, scheduled callback {call.callback.__name__} failed: {error}")
@@ -1,11 +1,24 @@
+import selectors
 import socket
 import threading
-import json
-import random
 import time
 import argparse
 import signal
 
+import admission
+import heartbeat
+import journal
+import leaderboard
+import metrics
+import tracing
+import outbound
+from matchmaking import DEFAULT_MAX_WAITING, Matchmaker
+from outbound import QueuedConnection
+from protocol import MAX_CLIENT_FRAME_BYTES, Decoder, encode_message
+from rooms import DEFAULT_PAIRS, MAX_PAIRS, MIN_PAIRS, MISMATCH_REVEAL_SECONDS, RoomRegistry, send_message_to_client
+from scheduler import DeadlineScheduler
+from spectators import DEFAULT_FRAME_SECONDS, DEFAULT_MAX_SPECTATORS
+
 # --------------------------------------------------------------------------------------------------------------------------------
 #  Server Configuration
 # ------------------------------------------------------------------------------------------------------------------------------
@@ -14,53 +27,172 @@ SERVER_HOST = '0.0.0.0'  # Listen on all network interfaces
 SERVER_PORT = 12345      # Clients will connect to this port
 MIN_PLAYERS = 2          # Minimum number of players required to start
 MAX_PLAYERS = 4          # Maximum players allowed in a single game
-
-# -------------------------------------------------------------------------------------------------------------------------------
-#  Tracking Connections
-# ---------------------------------------------------------------------------------------------------------------------------------
-# We'll keep a list of all connected clients (connection, address, player_id)
-connected_clients = []
-clients_lock = threading.RLock()
+DEFAULT_MAX_ROOMS = 100  # How many games one server process will host at once
 
 
 def parse_args():
     """
-    Read command-line arguments so we can set the number of players (2-4).
+    Read command-line arguments so we can set the number of players (2-4) per room
+    and how many rooms this server is allowed to host.
     """
     parser = argparse.ArgumentParser(description='Memory Card Game Server')
+    parser.add_argument('--host', default=SERVER_HOST, help=f'Address to listen on (default {SERVER_HOST})')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help=f'Port to listen on (default {SERVER_PORT})')
     parser.add_argument(
         '--players', '-p',
         type=int,
         choices=range(MIN_PLAYERS, MAX_PLAYERS+1),
         default=MIN_PLAYERS,
-        help='How many players will join the game (2-4)'
+        help='How many players will join each game (2-4)'
     )
-    return parser.parse_args()
-
-# ---------------------------------------------------------------------------------------------------------------------
-#  Game State (protected by a lock)
-# ---------------------------------------------------------------------------------------------------------------------
-card_deck = []            # Our shuffled pairs of cards
-faceup_cards = []         # Which cards are currently faceup
-matched_cards = []        # Which cards have been permanently matched
-player_scores = {}        # How many pairs each player has found
-current_player_index = 0  # Whose turn it is
-first_flipped_card = None # Remember the first flip to compare it on the second flip
-is_game_started = False
-per_card_locks = []       # A lock for each individual card to prevent race conditions
-game_state_lock = threading.Lock()
-running = True
-
-# -------------------------------------------------------------------------------------------------------------------
-#  Networking Helper Functions
-# ------------------------------------------------------------------------------------------------------------------
-
-def broadcast_message(message):
-    global clients_lock
-    with clients_lock:
-        for client_conn, _, _ in connected_clients:
-            send_message_to_client(client_conn, message)
+    parser.add_argument(
+        '--max-rooms', '-r',
+        type=int,
+        default=DEFAULT_MAX_ROOMS,
+        help=f'How many games can run at the same time (default {DEFAULT_MAX_ROOMS})'
+    )
+    parser.add_argument(
+        '--engine', '-e',
+        choices=('threads', 'asyncio'),
+        default='threads',
+        help='threads: one thread per player (default), asyncio: every player on one event loop'
+    )
+    parser.add_argument(
+        '--pairs',
+        type=int,
+        default=DEFAULT_PAIRS,
+        help=f'Pairs of cards on each board ({MIN_PAIRS}-{MAX_PAIRS}, default {DEFAULT_PAIRS})'
+    )
+    parser.add_argument(
+        '--reveal-delay',
+        type=float,
+        default=MISMATCH_REVEAL_SECONDS,
+        help=f'Seconds a mismatched pair stays face-up before it is hidden (default {MISMATCH_REVEAL_SECONDS})'
+    )
+    parser.add_argument(
+        '--send-queue-size',
+        type=int,
+        default=outbound.DEFAULT_QUEUE_SIZE,
+        help=f'Messages we hold for one client before it counts as too slow (default {outbound.DEFAULT_QUEUE_SIZE})'
+    )
+    parser.add_argument(
+        '--slow-client-policy',
+        choices=outbound.SLOW_CLIENT_POLICIES,
+        default=outbound.POLICY_DISCONNECT,
+        help='What to do with a client whose send queue is full: disconnect it (default) or drop new messages'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve metrics at http://<metrics-host>:<port>/metrics (metrics are off unless this or --metrics-file is given)'
+    )
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='Address for the metrics endpoint (default 127.0.0.1)')
+    parser.add_argument('--metrics-file', help='Write a JSON snapshot of the metrics to this file every --metrics-interval seconds')
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=metrics.DEFAULT_DUMP_INTERVAL,
+        help=f'Seconds between metrics file writes (default {metrics.DEFAULT_DUMP_INTERVAL})'
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=1,
+        help='Worker processes to spread games over, one per CPU core is a good start (default 1, Unix only)'
+    )
+    parser.add_argument(
+        '--journal',
+        help='Record every game (deal, flips, matches, turns) to this file; see journal.py to replay it'
+    )
+    parser.add_argument(
+        '--spectator-port',
+        type=int,
+        help='Let people watch games (without playing) by connecting to this port (off unless given)'
+    )
+    parser.add_argument(
+        '--spectator-interval',
+        type=float,
+        default=DEFAULT_FRAME_SECONDS,
+        help=f'Seconds between updates sent to spectators; one frame per room covers everything since the last (default {DEFAULT_FRAME_SECONDS})'
+    )
+    parser.add_argument(
+        '--max-spectators',
+        type=int,
+        default=DEFAULT_MAX_SPECTATORS,
+        help=f'How many spectators one server process will take (default {DEFAULT_MAX_SPECTATORS})'
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=admission.DEFAULT_RATE,
+        help=f'Messages a second one client may send on average; the rest are ignored, and clients that keep it up are disconnected (default {admission.DEFAULT_RATE}, 0 = no limit)'
+    )
+    parser.add_argument(
+        '--rate-burst',
+        type=int,
+        default=admission.DEFAULT_BURST,
+        help=f'Messages one client may send at once (default {admission.DEFAULT_BURST})'
+    )
+    parser.add_argument(
+        '--trace',
+        help='Trace a sample of messages (where each one spent its time) to this file, for chrome://tracing or ui.perfetto.dev'
+    )
+    parser.add_argument(
+        '--trace-sample',
+        type=float,
+        default=tracing.DEFAULT_SAMPLE,
+        help=f'Share of messages to trace, from 0 to 1 (default {tracing.DEFAULT_SAMPLE})'
+    )
+    parser.add_argument(
+        '--leaderboard',
+        help='Keep everyone\'s results across games and restarts in this SQLite file, and show the top players after each game'
+    )
+    parser.add_argument(
+        '--leaderboard-size',
+        type=int,
+        default=leaderboard.DEFAULT_SIZE,
+        help=f'Players in the top list sent after each game (default {leaderboard.DEFAULT_SIZE})'
+    )
+    parser.add_argument(
+        '--ping-interval',
+        type=float,
+        default=heartbeat.DEFAULT_INTERVAL,
+        help=f'Seconds between heartbeat checks for clients that ask for them (default {heartbeat.DEFAULT_INTERVAL:g}, 0 = no heartbeats)'
+    )
+    parser.add_argument(
+        '--ping-timeout',
+        type=float,
+        default=heartbeat.DEFAULT_TIMEOUT,
+        help=f'Disconnect a player we haven\'t heard from for this many seconds (default {heartbeat.DEFAULT_TIMEOUT:g})'
+    )
+    parser.add_argument(
+        '--max-waiting',
+        type=int,
+        default=DEFAULT_MAX_WAITING,
+        help=f'Players one server process will hold in line while every table is taken (default {DEFAULT_MAX_WAITING})'
+    )
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and not hasattr(socket, 'send_fds'):
+        parser.error('--workers needs a system that can pass sockets between processes (Linux, macOS)')
+    if not MIN_PAIRS <= args.pairs <= MAX_PAIRS:
+        parser.error(f'--pairs must be between {MIN_PAIRS} and {MAX_PAIRS}')
+    if args.spectator_interval <= 0:
+        parser.error('--spectator-interval must be more than 0')
+    if args.rate_limit < 0 or args.rate_burst < 1:
+        parser.error('--rate-limit must be 0 or more and --rate-burst at least 1')
+    if args.max_waiting < 0:
+        parser.error('--max-waiting must be 0 or more')
+    if args.ping_interval < 0 or args.ping_interval and args.ping_timeout < args.ping_interval:
+        parser.error('--ping-interval must be 0 or more, and --ping-timeout at least as long')
+    if args.leaderboard_size < 1:
+        parser.error('--leaderboard-size must be at least 1')
+    if not 0 < args.trace_sample <= 1:
+        parser.error('--trace-sample must be more than 0 and at most 1')
+    return args
 
+running = True
 
 # -------------------------------------------------------------------------------------------------------------------
 #  CTRL + c handler
@@ -70,278 +202,404 @@ def signal_handler(sig, frame):
     global running
     running = False
 
-signal.signal(signal.SIGINT, signal_handler)
 
-def send_message_to_client(client_conn, message):
+def signal_wakeup_socket():
     """
-    Send a JSON message to a single client.
+    A socket that becomes readable whenever a signal (like CTRL + c) arrives, so a select()
+    that's waiting for players wakes up straight away instead of checking in every second.
+    Call from the main thread. Returns both ends; hang on to the sending end too.
     """
-    try:
-        client_conn.sendall((json.dumps(message) + '\n').encode())
-    except BrokenPipeError:
-        # Client might have gone away, we can't do much.
-        pass
+    receive, send = socket.socketpair()
+    receive.setblocking(False)
+    send.setblocking(False)
+    signal.set_wakeup_fd(send.fileno(), warn_on_full_buffer=False)
+    return receive, send
 
-# ----------------------------------------------------------------------------------------------------------------------------
-#  Starting the Game
-# -----------------------------------------------------------------------------------------------------------------------------
 
-def start_game():
-    """
-    Shuffle the cards, set up locks, pick who goes first, and let everyone know the game is on!
-    """
-    global card_deck, faceup_cards, matched_cards, player_scores
-    global current_player_index, first_flipped_card, is_game_started, per_card_locks
-
-    with game_state_lock:
-        # Build and shuffle our deck of 8 pairs (=16 cards)
-        num_pairs = 8
-        card_deck = list(range(num_pairs)) * 2
-        random.shuffle(card_deck)
-        # Initially, all cards are face-down and unmatched
-        faceup_cards = [False] * len(card_deck)
-        matched_cards = [False] * len(card_deck)
-        # Give each card its own lock to avoid race conditions on flips
-        per_card_locks = [threading.Lock() for _ in card_deck]
-        # Everyone starts with zero points
-        player_scores = {int(pid): 0 for _, _, pid in connected_clients}
-        # Randomly pick who goes first
-        current_player_index = random.randrange(len(connected_clients))
-        first_flipped_card = None
-        is_game_started = True
-
-    # Let all players know we've started
-    broadcast_message({
-        "type": "GAME_START",
-        "players": [int(pid) for _, _, pid in connected_clients],
-        "scores": player_scores
-    })
-    send_turn_notification()
-
-# --------------------------------------------------------------------------------------------------------------------
-#  Turn Notification
-# ---------------------------------------------------------------------------------------------------------------------
-
-def send_turn_notification():
-    """
-    Tell everyone whose turn it is now.
-    """
-    global current_player_index
-    
-    with game_state_lock:
-        player_id = connected_clients[current_player_index][2]
-    broadcast_message({
-        "type": "YOUR_TURN",
-        "player_id": player_id,
-        "scores": player_scores,
-        "current_player": current_player_index + 1
-    })
-
-# -------------------------------------------------------------------------------------------------------------------
-#  Handling a card Flip
-# -------------------------------------------------------------------------------------------------------------------
-
-def process_flip_request(player_id, card_index, client_conn):
-    """
-    When a player asks to flip a card:
-      - Check turn order
-      - Validate that card can be flipped
-      - Lock the card, reveal it, compare if it's the second flip
-      - Handle matches or mismatches, update scores or change turns
-    """
-    global first_flipped_card, current_player_index
-    is_next_turn = False
-    pidx = 0
-    with game_state_lock:
-        # 1) Make sure it's really this player's turn
-        if connected_clients[current_player_index][2] != player_id:
-            send_message_to_client(client_conn, {"type": "ERROR", "message": "It's not your turn."})
-            return
-        # 2) Make sure the chosen card is in range and not already revealed/matched
-        if (card_index < 0 or card_index >= len(card_deck) or
-            faceup_cards[card_index] or matched_cards[card_index]):
-            send_message_to_client(client_conn, {"type": "ERROR", "message": "Cannot flip that card."})
-            return
-        # 3) Try locking that card so no one else flips it at the same time
-        if not per_card_locks[card_index].acquire(blocking=False):
-            send_message_to_client(client_conn, {"type": "ERROR", "message": "That card is busy."})
-            return
-        # 4) Reveal the card to everyone
-        faceup_cards[card_index] = True
-        card_identity = card_deck[card_index]
-        broadcast_message({"type": "CARD_REVEALED", "card_index": card_index, "identity": card_identity})
-
-        # Was this the first flip or the second in this player's turn?
-        if first_flipped_card is None:
-            # Remember this flip and wait for the next one
-            first_flipped_card = (player_id, card_index)
-        else:
-            prev_pid, prev_index = first_flipped_card
-            is_match = (card_deck[prev_index] == card_identity)
-
-            if is_match:
-                # Great! Those two cards stay face-up and count for a point
-                matched_cards[prev_index] = True
-                matched_cards[card_index] = True
-                player_scores[player_id] += 1
-                broadcast_message({
-                    "type": "MATCH_RESULT",
-                    "player_id": player_id,
-                    "cards": [prev_index, card_index],
-                })
-            else:
-                # Let everyone see the mismatch for a moment
-                time.sleep(2)
-                # Then flip them back down
-                faceup_cards[prev_index] = False
-                faceup_cards[card_index] = False
-                is_next_turn = True
-                
-
-            # Clean up locks and reset for the next turn
-            per_card_locks[prev_index].release()
-            per_card_locks[card_index].release()
-            pidx = prev_index
-            first_flipped_card = None
-
-            # If every pair is matched, the game is then over
-            if all(matched_cards):
-                broadcast_message({"type": "GAME_OVER", "scores": player_scores})
-    
-    if (is_next_turn):
-        cidx = card_index
-        broadcast_message({"type": "HIDE_CARDS", "cards": [pidx, cidx]})
-        # Move on to the next player's turn
-        current_player_index = (current_player_index + 1) % len(connected_clients)
-        send_turn_notification()
+def drain_wakeup_socket(wakeup):
+    try:
+        while wakeup.recv(512):
+            pass
+    except (BlockingIOError, InterruptedError):
+        pass
 
 # -----------------------------------------------------------------------------------------------------
 #  New Client Handler
 # ----------------------------------------------------------------------------------------------------
 
-def handle_client_connection(client_conn, client_addr, player_id, expected_count):
+def handle_client_connection(client_conn, client_addr, player_id, room, registry):
     """
     When someone joins:
-      - Say hi and tell them their player number
-      - Once enough players are here, start the game
+      - (RoomRegistry.seat_player already said hi and told them their player number)
+      - Once enough players are at their table, start the game
       - Listen for their flip requests until they disconnect
     """
-    global is_game_started
-    print(f"Player {player_id} connected from {client_addr}")
-    player_index = connected_clients.index((client_conn, client_addr, player_id)) + 1
-    send_message_to_client(client_conn, {"type": "WELCOME", "player_index": player_index, "player_id": player_id, "max_players": expected_count})
-
-    # If we've reached the expected player count, kick off the game
-    with clients_lock:
-        if len(connected_clients) == expected_count and not is_game_started:
-            print(f"All {expected_count} players connected, starting the game!")
-            start_game()
-
-    recv_buffer = ""
+    print(f"Player {player_id} connected from {client_addr} (room {room.room_id})")
+
+    # If we've reached the expected player count, kick off (or restart) the game
+    if room.start_if_full():
+        print(f"All {room.expected_players} players connected to room {room.room_id}, the game has started!")
+
+    decoder = client_conn.decoder
+    gate = admission.Admission()
     try:
         while True:
-            data = client_conn.recv(4096).decode()
+            data = client_conn.sock.recv(4096)
             if not data:
                 # Client closed the connection
                 break
-            recv_buffer += data
-            while '\n' in recv_buffer:
-                line, recv_buffer = recv_buffer.split('\n', 1)
-                message = json.loads(line)
-                if message.get('type') == 'FLIP_CARD':
-                    process_flip_request(
-                        player_id,
-                        message.get('card_index'),
-                        client_conn
-                    )
-                elif message.get('type') == 'PLAY_AGAIN':
-                    # handling disconnect at end screen while other player clicks play again
-                    if len(connected_clients) != expected_count:
-                        continue # waiting for disconnect to be handled
-                    else:
-                        start_game()
+            metrics.inc('bytes_in_total', amount=len(data))
+            client_conn.heard_from = True
+            decoder.feed(data)
+            for message in tracing.messages(gate.messages(decoder), player_id, room):
+                room.handle_message(player_id, client_conn, message)
     except Exception as error:
         print(f"Oops, error with player {player_id}: {error}")
     finally:
-        handle_client_disconnection(client_conn, player_id, expected_count)
+        handle_client_disconnection(client_conn, player_id, room, registry)
 
 # ----------------------------------------------------------------------------------------------------
 #  Handle Client Disconnection
 # ----------------------------------------------------------------------------------------------------
-def handle_client_disconnection(client_conn, player_id, expected_count):
+def handle_client_disconnection(client_conn, player_id, room, registry):
     """
     When someone disconnects:
-      - Remove them from the list of connected clients
-      - Tell every other client they left
-      - Wait for new player(s) to join and restart game
+      - Remove them from their room
+      - Tell everyone else at that table they left
+      - Hold the table, the game restarts as soon as someone takes their seat (see Room.start_if_full)
     """
-    print(f"Player {player_id} disconnected.")
-    with clients_lock:
-        # Remove them from our list
-        connected_clients[:] = [c for c in connected_clients if c[2] != player_id]
+    print(f"Player {player_id} disconnected from room {room.room_id}.")
+    room.hold_for_replacement(player_id)
+    registry.remove_player(room, player_id)
     client_conn.close()
-    # Let every client know who left
-    broadcast_message({"type": "DISCONNECT", "player_id": player_id, })
-    time.sleep(3)
-    # Waiting for new players to join
-    while len(connected_clients) < expected_count:
-        time.sleep(1)
-    # Enough players have joined, restart game
-    broadcast_message({"type": "GAME_FULL"})
-    start_game()
-    
+    # Let every client at the table know who left
+    room.broadcast_message({"type": "DISCONNECT", "player_id": player_id, })
+
+# ----------------------------------------------------------------------------------------------------
+#  Spectators
+# ----------------------------------------------------------------------------------------------------
+def handle_spectator_connection(client_conn, client_addr, registry):
+    """
+    Someone who only wants to watch. The hub sends them the game (see spectators.py),
+    we just listen in case they want another room or encoding.
+    """
+    hub = registry.spectators
+    if not hub.add(client_conn):
+        send_message_to_client(client_conn, {"type": "ERROR", "message": "Sorry, too many spectators."})
+        client_conn.flush(outbound.SHUTDOWN_FLUSH_SECONDS)
+        client_conn.close()
+        return
+    print(f"Spectator connected from {client_addr}")
+    decoder = client_conn.decoder
+    gate = admission.Admission()
+    try:
+        while True:
+            data = client_conn.sock.recv(4096)
+            if not data:
+                break
+            metrics.inc('bytes_in_total', amount=len(data))
+            decoder.feed(data)
+            for message in gate.messages(decoder):
+                hub.handle_message(client_conn, message)
+    except Exception as error:
+        print(f"Oops, error with spectator {client_addr}: {error}")
+    finally:
+        print(f"Spectator {client_addr} left.")
+        hub.remove(client_conn)
+        client_conn.close()
+
+
+def seat_new_spectator(client_sock, client_addr, registry, args):
+    client_conn = QueuedConnection(client_sock, f"Spectator {client_addr}",
+                                   args.send_queue_size, args.slow_client_policy)
+    thread = threading.Thread(
+        target=handle_spectator_connection,
+        args=(client_conn, client_addr, registry),
+        daemon=True
+    )
+    thread.start()
+
+
+def open_listener(host, port):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen()
+    server_socket.setblocking(False)
+    return server_socket
+
 # --------------------------------------------------------------------------------------
 #  Main Server Loop
 # -----------------------------------------------------------------------------------------
 
+def create_registry(args):
+    """
+    The rooms for the threaded engine. One background thread hides mismatched pairs for
+    every room, so no player thread ever sleeps.
+    """
+    scheduler = DeadlineScheduler()
+    registry = RoomRegistry(args.players, args.max_rooms, scheduler, reveal_seconds=args.reveal_delay,
+                            num_pairs=args.pairs, spectator_seconds=args.spectator_interval,
+                            max_spectators=args.max_spectators)
+    registry.register_gauges()
+    return registry
+
+
+def seat_new_player(client_sock, client_addr, player_id, registry, args, players=None, decoder=None, name=None):
+    """
+    Find a new player a seat (at a table for players people, any if None) and give them their own
+    thread. decoder has whatever they sent while waiting, name is their leaderboard name. Returns False if every table is full.
+    """
+    client_conn = QueuedConnection(client_sock, f"Player {player_id}",
+                                   args.send_queue_size, args.slow_client_policy)
+    if decoder is not None:
+        client_conn.decoder = decoder
+    room = registry.seat_player(client_conn, client_addr, player_id, players, name)
+    if room is None:
+        # Every table is full—tell them to come back later
+        try:
+            client_sock.sendall(encode_message({"type": "ERROR", "message": "Sorry, game is full."}))
+        except OSError:
+            pass
+        client_conn.close()
+        return False
+
+    # Spin up a thread just for this player
+    thread = threading.Thread(
+        target=handle_client_connection,
+        args=(client_conn, client_addr, player_id, room, registry),
+        daemon=True
+    )
+    thread.start()
+    return True
+
+
+# --------------------------------------------------------------------------------------
+#  Players Waiting For A Seat
+# -----------------------------------------------------------------------------------------
+
+class Lobby:
+    """
+    Players who have connected but aren't at a table yet (see matchmaking.py). Their sockets sit
+    in the accept loop's selector, so waiting costs a ticket and a socket, not a thread. Only
+    the accept loop's thread uses this, except seat_freed(). wakeup_sender is the sending end of
+    signal_wakeup_socket(), which is already in the selector.
+    """
+
+    def __init__(self, registry, selector, args, wakeup_sender):
+        self.registry = registry
+        self.selector = selector
+        self.args = args
+        self.wakeup_sender = wakeup_sender
+        self.matchmaker = Matchmaker(registry, args.max_waiting)
+        self.matchmaker.register_gauges()
+        registry.on_seat_freed = self.seat_freed
+
+    def add(self, client_sock, client_addr, player_id):
+        """
+        Hold a new player until there's a seat for them. Returns False if the line is already full.
+        """
+        ticket = self.matchmaker.admit(client_sock, client_addr, player_id, time.monotonic())
+        if ticket is None:
+            # Every table is full and so is the line—tell them to come back later
+            try:
+                client_sock.sendall(encode_message({"type": "ERROR", "message": "Sorry, game is full."}))
+            except OSError:
+                pass
+            client_sock.close()
+            return False
+        ticket.decoder = Decoder(max_frame=MAX_CLIENT_FRAME_BYTES)
+        ticket.gate = admission.Admission()
+        client_sock.setblocking(False)
+        self.selector.register(client_sock, selectors.EVENT_READ, ticket)
+        return True
+
+    def handle_readable(self, ticket):
+        """
+        A waiting player sent something (probably JOIN), or hung up.
+        """
+        try:
+            data = ticket.conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        try:
+            if not data:
+                raise ConnectionError("hung up while waiting")
+            metrics.inc('bytes_in_total', amount=len(data))
+            ticket.decoder.feed(data)
+            for message in ticket.gate.messages(ticket.decoder):
+                reply = self.matchmaker.handle_message(ticket, message)
+                if reply is not None:
+                    self.send(ticket, reply)
+        except Exception as error:
+            print(f"Player {ticket.player_id} left while waiting for a seat ({error}).")
+            self.drop(ticket)
+
+    def send(self, ticket, message):
+        """
+        Waiting players get small, rare messages. One that doesn't fit in their socket's buffer means they
+        stopped reading, so they lose their place.
+        """
+        payload = encode_message(message)
+        try:
+            sent = ticket.conn.send(payload)
+        except OSError:
+            sent = 0
+        if sent != len(payload):
+            print(f"Player {ticket.player_id} isn't reading while waiting for a seat, letting them go.")
+            self.drop(ticket)
+            return
+        metrics.inc('bytes_out_total', amount=len(payload))
+
+    def drop(self, ticket):
+        if ticket.is_gone:
+            return
+        self.matchmaker.leave(ticket)
+        self.selector.unregister(ticket.conn)
+        ticket.conn.close()
+
+    def seat(self, ticket, players):
+        self.selector.unregister(ticket.conn)
+        ticket.conn.setblocking(True)
+        seat_new_player(ticket.conn, ticket.addr, ticket.player_id, self.registry, self.args, players, ticket.decoder, ticket.name)
+
+    def seat_freed(self):
+        """
+        A player thread just gave up a seat. Wake the accept loop so tick() can hand it to whoever is waiting.
+        """
+        self.matchmaker.seat_freed()
+        if self.matchmaker.waiting_count():
+            try:
+                self.wakeup_sender.send(b'\0')
+            except (BlockingIOError, InterruptedError):
+                # Full of wakeups already, the loop is on its way
+                pass
+
+    def timeout(self):
+        """
+        How long the accept loop may sleep before tick() has something to do.
+        """
+        return self.matchmaker.timeout(time.monotonic())
+
+    def tick(self):
+        """
+        Seat whoever we can and tell the rest where they are in line.
+        """
+        now = time.monotonic()
+        self.matchmaker.place(now, self.seat)
+        for ticket, message in self.matchmaker.updates(now):
+            if not ticket.is_gone:
+                self.send(ticket, message)
+
+    def shutdown(self):
+        for ticket in self.matchmaker.everyone():
+            try:
+                ticket.conn.send(encode_message({"type": "SHUTDOWN", "message": "Server is shutting down."}))
+            except OSError:
+                pass
+            self.drop(ticket)
+
+
+def shutdown_rooms(registry):
+    """
+    Let every table know we're going away.
+    """
+    for room in registry.all_rooms():
+        room.broadcast_message({"type": "SHUTDOWN", "message": "Server is shutting down."})
+    spectators = registry.spectators.shutdown()
+    # Wait until the goodbyes have actually been sent (but not forever, for clients that stopped reading)
+    connections = registry.all_connections() + spectators
+    deadline = time.monotonic() + outbound.SHUTDOWN_FLUSH_SECONDS
+    for client_conn in connections:
+        client_conn.flush(max(0, deadline - time.monotonic()))
+    outbound.print_summary(connections)
+
+
 def main():
     global running
-    # Figure out how many players we expect
+    # Figure out how many players we expect at each table
     args = parse_args()
+    if args.workers > 1:
+        # A coordinator process hands players to worker processes, each running its own engine
+        import workers
+        workers.run(args)
+        return
+    metrics.configure(args)
+    journal.configure(args)
+    leaderboard.configure(args)
+    tracing.configure(args)
+    admission.configure(args)
+    heartbeat.configure(args)
+    if args.engine == 'asyncio':
+        # Only pull in asyncio when it's asked for
+        import async_server
+        async_server.run(args, args.host, args.port)
+        tracing.stop()
+        leaderboard.stop()
+        journal.stop()
+        metrics.stop()
+        return
     expected_players = args.players
+    registry = create_registry(args)
     next_player_id = 1
 
-    # Open up our listening socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((SERVER_HOST, SERVER_PORT))
-        server_socket.listen()
-        server_socket.settimeout(1)  # Non-blocking accept
+    signal.signal(signal.SIGINT, signal_handler)
+    wakeup, wakeup_sender = signal_wakeup_socket()
+
+    # Open up our listening socket (and one for spectators, if they're welcome)
+    with open_listener(args.host, args.port) as server_socket:
+        spectator_socket = None
+        # Sleep until a player connects or CTRL + c is pressed, whichever comes first
+        selector = selectors.DefaultSelector()
+        selector.register(server_socket, selectors.EVENT_READ)
+        selector.register(wakeup, selectors.EVENT_READ)
+        if args.spectator_port is not None:
+            spectator_socket = open_listener(args.host, args.spectator_port)
+            selector.register(spectator_socket, selectors.EVENT_READ)
+            print(f"Spectators can watch on {args.host}:{args.spectator_port}")
         print(
-            f"Ready on {SERVER_HOST}:{SERVER_PORT}, "
-            f"waiting for {expected_players} players..."
+            f"Ready on {args.host}:{args.port}, "
+            f"hosting up to {args.max_rooms} games of {expected_players} players..."
         )
 
+        # Everyone waits in the lobby until there's a seat for them
+        lobby = Lobby(registry, selector, args, wakeup_sender)
+
         # Keep accepting new players
         while running:
-            try:
-                client_conn, client_addr = server_socket.accept()
-            except socket.timeout:
-                continue
-
-            with clients_lock:
-                if len(connected_clients) >= expected_players:
-                    # Too many folks—tell them to come back later
-                    send_message_to_client(
-                        client_conn,
-                        {"type": "ERROR", "message": "Sorry, game is full."}
-                    )
-                    client_conn.close()
+            for key, _ in selector.select(lobby.timeout()):
+                if key.fileobj is wakeup:
+                    # A signal arrived (the handler has already decided whether we keep going), or a seat opened up
+                    drain_wakeup_socket(wakeup)
                     continue
-                # Assign them a player number and save their connection
-                player_id = next_player_id
-                next_player_id += 1
-                connected_clients.append((client_conn, client_addr, player_id))
-
-            # Spin up a thread just for this player
-            thread = threading.Thread(
-                target=handle_client_connection,
-                args=(client_conn, client_addr, player_id, expected_players),
-                daemon=True
-            )
-            thread.start()
-        broadcast_message({"type": "SHUTDOWN", "message": "Server is shutting down."})
-        time.sleep(1) # A "hack" to allow all clients to receive the shutdown message
+                if key.data is not None:
+                    lobby.handle_readable(key.data)
+                    continue
+                try:
+                    client_sock, client_addr = key.fileobj.accept()
+                except (BlockingIOError, InterruptedError):
+                    # They gave up before we got to them
+                    continue
+                client_sock.setblocking(True)
+                if key.fileobj is spectator_socket:
+                    seat_new_spectator(client_sock, client_addr, registry, args)
+                    continue
+
+                # Assign them a player number and find them a seat
+                if lobby.add(client_sock, client_addr, next_player_id):
+                    next_player_id += 1
+            lobby.tick()
+        lobby.shutdown()
+        selector.close()
+        if spectator_socket is not None:
+            spectator_socket.close()
+        shutdown_rooms(registry)
+        tracing.stop()
+        leaderboard.stop()
+        journal.stop()
+        metrics.stop()
 
 if __name__ == '__main__':
     main()
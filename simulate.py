@@ -0,0 +1,364 @@
+import argparse
+import json
+import time
+from array import array
+
+import numpy as np
+
+from rules import GameState
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Monte Carlo Simulator
+# ------------------------------------------------------------------------------------------------------------------------------
+# Plays huge numbers of games with no server, no sockets and no bots, to see how long games
+# last and how the points are spread for different boards, player counts and kinds of player.
+#
+# The rules are the same as rules.GameState (two flips a turn, a pair scores and the same player
+# goes again, a mismatch passes the turn on), but a whole batch of games lives in NumPy arrays,
+# one row per game. Every step plays one turn in every game that hasn't finished yet.
+#
+# How well each seat remembers the cards it has seen is up to its Strategy. Every player sees
+# every card that gets turned over; the strategy decides which of those they remember, and for
+# how long. On their turn a player takes a pair they know, otherwise turns over a card they don't
+# know and, if they know where its partner is, takes it. Add a strategy by subclassing Strategy
+# and putting it in STRATEGIES.
+#
+#   python simulate.py --pairs 8 16 32 --players 2 4 --games 200000 --strategy perfect forgetful:0.5
+#
+# Needs NumPy (pip install numpy); nothing else in the project does.
+
+DEFAULT_GAMES = 100000
+BATCH_CELLS = 1 << 25  # Games per batch are picked so one batch's memory table stays around this many cells
+NEVER = -1             # "Turn we last saw this card" for cards a player hasn't seen (or has forgotten)
+CHECK_GAMES = 20       # Games --check replays through rules.GameState
+
+
+class Strategy:
+    """
+    How a player remembers cards. memory holds the turn each card was last seen on (NEVER if it
+    wasn't) for one seat, one row per game.
+    """
+    name = None
+
+    def remember(self, rng, count):
+        """
+        Which of count cards that were just turned over this player remembers (a bool array).
+        """
+        return np.ones(count, dtype=bool)
+
+    def known(self, memory, turn):
+        """
+        Which cards this player can still place, as of turn.
+        """
+        return memory != NEVER
+
+    def __str__(self):
+        return self.name
+
+
+class PerfectMemory(Strategy):
+    """
+    Never forgets a card.
+    """
+    name = 'perfect'
+
+
+class NoMemory(Strategy):
+    """
+    Remembers nothing and turns over cards at random (but never takes back the card they just flipped).
+    """
+    name = 'random'
+
+    def remember(self, rng, count):
+        return np.zeros(count, dtype=bool)
+
+
+class Forgetful(Strategy):
+    """
+    Remembers each card they see with probability recall, and then for good.
+    """
+    name = 'forgetful'
+
+    def __init__(self, recall=0.5):
+        self.recall = float(recall)
+
+    def remember(self, rng, count):
+        return rng.random(count) < self.recall
+
+    def __str__(self):
+        return f'{self.name}:{self.recall:g}'
+
+
+class RecentMemory(Strategy):
+    """
+    Remembers only the cards seen in the last turns turns.
+    """
+    name = 'recent'
+
+    def __init__(self, turns=4):
+        self.turns = int(turns)
+
+    def known(self, memory, turn):
+        return (memory != NEVER) & (memory > turn - self.turns)
+
+    def __str__(self):
+        return f'{self.name}:{self.turns}'
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (PerfectMemory, NoMemory, Forgetful, RecentMemory)}
+
+
+def parse_strategy(text):
+    """
+    'perfect', 'random', 'forgetful:0.3', 'recent:6', ...
+    """
+    name, _, parameter = text.partition(':')
+    if name not in STRATEGIES:
+        raise argparse.ArgumentTypeError(f"unknown strategy {name!r} (choose from {', '.join(STRATEGIES)})")
+    try:
+        return STRATEGIES[name](parameter) if parameter else STRATEGIES[name]()
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(f"bad setting for {name}: {parameter!r}")
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Playing a batch
+# ------------------------------------------------------------------------------------------------------------------------------
+
+
+def pick(rng, candidates):
+    """
+    One random True column from each row of candidates (every row needs at least one).
+    """
+    keys = rng.random(candidates.shape)
+    keys[~candidates] = -1.0
+    return keys.argmax(axis=1)
+
+
+def deal_batch(rng, games, num_pairs):
+    """
+    A shuffled deck for every game, where each card's partner is, and where each pair is.
+    """
+    decks = rng.permuted(np.tile(np.repeat(np.arange(num_pairs, dtype=np.int32), 2), (games, 1)), axis=1)
+    # Sorting by identity puts each pair's two positions next to each other
+    positions = np.argsort(decks, axis=1, kind='stable').reshape(games, num_pairs, 2)
+    partners = np.empty_like(decks, dtype=np.intp)
+    np.put_along_axis(partners, positions[:, :, 0], positions[:, :, 1], axis=1)
+    np.put_along_axis(partners, positions[:, :, 1], positions[:, :, 0], axis=1)
+    return decks, partners, positions
+
+
+def play_batch(rng, games, num_pairs, strategies, trace=None):
+    """
+    Play games games to the end. Returns (turns taken, points per seat, first seat) arrays.
+    Give a trace dict to get the first game's deck and every (seat, card, card) turn in it.
+    """
+    num_players = len(strategies)
+    num_cards = 2 * num_pairs
+    decks, partners, positions = deal_batch(rng, games, num_pairs)
+    matched = np.zeros((games, num_cards), dtype=bool)
+    memory = np.full((games, num_players, num_cards), NEVER, dtype=np.int32)
+    scores = np.zeros((games, num_players), dtype=np.int32)
+    pairs_left = np.full(games, num_pairs, dtype=np.int32)
+    turns = np.zeros(games, dtype=np.int32)
+    first_seat = rng.integers(num_players, size=games)
+    current = first_seat.copy()
+    if trace is not None:
+        trace["deck"] = decks[0].tolist()
+        trace["turns"] = []
+
+    turn = 0
+    active = np.arange(games)
+    while active.size:
+        # Who's up in each game, before anybody plays (a mismatch passes the turn to the next seat)
+        to_move = current[active]
+        for seat, strategy in enumerate(strategies):
+            rows = active[to_move == seat]
+            if rows.size:
+                first, second = play_turn(rng, rows, seat, strategy, strategies, turn, partners, positions,
+                                          matched, memory, scores, pairs_left, current)
+                if trace is not None and rows[0] == 0:
+                    trace["turns"].append((seat, int(first[0]), int(second[0])))
+        turns[active] += 1
+        turn += 1
+        active = active[pairs_left[active] > 0]
+    return turns, scores, first_seat
+
+
+def play_turn(rng, rows, seat, strategy, strategies, turn, partners, positions, matched, memory,
+              scores, pairs_left, current):
+    """
+    One turn (two flips) in each of rows, all of which have seat's player to move.
+    """
+    count = rows.size
+    index = np.arange(count)
+    hidden = ~matched[rows]
+    known = strategy.known(memory[rows, seat], turn) & hidden
+    unknown = hidden & ~known
+    row_partners = partners[rows]
+
+    # First card: one half of a pair they know, or else a card they haven't seen
+    row_positions = positions[rows]
+    known_pairs = (np.take_along_axis(known, row_positions[:, :, 0], axis=1) &
+                   np.take_along_axis(known, row_positions[:, :, 1], axis=1))
+    has_pair = known_pairs.any(axis=1)
+    first = pick(rng, np.where(unknown.any(axis=1, keepdims=True), unknown, hidden))
+    if has_pair.any():
+        pair = pick(rng, known_pairs[has_pair])
+        first[has_pair] = row_positions[has_pair, pair, 0]
+
+    # Second card: its partner if they know where it is, or else another card they haven't seen
+    partner = row_partners[index, first]
+    hidden[index, first] = False
+    unknown[index, first] = False
+    second = pick(rng, np.where(unknown.any(axis=1, keepdims=True), unknown, hidden))
+    takes_partner = known[index, partner]
+    second[takes_partner] = partner[takes_partner]
+
+    # Everyone at the table sees both cards
+    is_match = second == partner
+    for other_seat, other in enumerate(strategies):
+        for card in (first, second):
+            seen = other.remember(rng, count)
+            memory[rows[seen], other_seat, card[seen]] = turn
+
+    matched_rows = rows[is_match]
+    matched[matched_rows, first[is_match]] = True
+    matched[matched_rows, second[is_match]] = True
+    scores[matched_rows, seat] += 1
+    pairs_left[matched_rows] -= 1
+    # A pair means they go again, a mismatch passes the turn on
+    current[rows[~is_match]] = (seat + 1) % len(strategies)
+    return first, second
+
+
+def simulate(num_pairs, strategies, games, rng):
+    """
+    Play games games in batches and sum up what happened.
+    """
+    batch = max(1, min(games, BATCH_CELLS // (2 * num_pairs * len(strategies))))
+    started = time.perf_counter()
+    results = []
+    for start in range(0, games, batch):
+        results.append(play_batch(rng, min(batch, games - start), num_pairs, strategies))
+    elapsed = time.perf_counter() - started
+    turns = np.concatenate([r[0] for r in results])
+    scores = np.concatenate([r[1] for r in results])
+    first_seat = np.concatenate([r[2] for r in results])
+    return summarize(num_pairs, strategies, turns, scores, first_seat, elapsed)
+
+
+def percentiles(values):
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return {"mean": round(float(values.mean()), 2), "p50": float(p50), "p90": float(p90), "p99": float(p99),
+            "max": int(values.max())}
+
+
+def summarize(num_pairs, strategies, turns, scores, first_seat, elapsed):
+    games = len(turns)
+    best = scores.max(axis=1)
+    winners = scores == best[:, None]
+    outright = winners.sum(axis=1) == 1
+    ordered = np.sort(scores, axis=1)
+    margins = ordered[:, -1] - ordered[:, -2]
+    first_won = outright & winners[np.arange(games), first_seat]
+    return {
+        "pairs": num_pairs,
+        "players": len(strategies),
+        "strategies": [str(strategy) for strategy in strategies],
+        "games": games,
+        "seconds": round(elapsed, 3),
+        "turns": percentiles(turns),
+        "winning_margin": percentiles(margins),
+        "tie_rate": round(float(1 - outright.mean()), 4),
+        "first_player_win_rate": round(float(first_won.mean()), 4),
+        "seats": [
+            {
+                "strategy": str(strategy),
+                "win_rate": round(float((outright & winners[:, seat]).mean()), 4),
+                "score": percentiles(scores[:, seat]),
+            }
+            for seat, strategy in enumerate(strategies)
+        ],
+    }
+
+
+def print_summary(summary):
+    rate = summary['games'] / summary['seconds'] if summary['seconds'] else float('inf')
+    print(f"{summary['pairs']} pairs, {summary['players']} players ({', '.join(summary['strategies'])}): "
+          f"{summary['games']} games in {summary['seconds']}s ({rate:,.0f} games/s)")
+    for label, key in (('turns', 'turns'), ('winning margin', 'winning_margin')):
+        stats = summary[key]
+        print(f"  {label:<15} mean {stats['mean']}  p50 {stats['p50']:g}  p90 {stats['p90']:g}  "
+              f"p99 {stats['p99']:g}  max {stats['max']}")
+    print(f"  {'ties':<15} {summary['tie_rate']:.1%}    first player wins {summary['first_player_win_rate']:.1%}")
+    for seat, stats in enumerate(summary['seats'], 1):
+        score = stats['score']
+        print(f"  seat {seat} {stats['strategy']:<13} wins {stats['win_rate']:.1%}  "
+              f"score mean {score['mean']}  p50 {score['p50']:g}  p90 {score['p90']:g}")
+
+
+def check_against_rules(num_pairs, strategies, rng):
+    """
+    Play one game here and again through rules.GameState, flip for flip, and make sure both agree
+    on whose turn it was, what matched and the final score. Raises AssertionError if they don't.
+    """
+    trace = {}
+    turns, scores, first_seat = play_batch(rng, 1, num_pairs, strategies, trace)
+    game = GameState(array('H', trace["deck"]), range(len(strategies)), int(first_seat[0]))
+    for seat, first, second in trace["turns"]:
+        assert game.current_player_index == seat, "turn order differs from rules.py"
+        game.flip(seat, first)
+        if not game.flip(seat, second).is_match:
+            game.hide_mismatch()
+    assert game.is_over(), "game didn't finish under rules.py"
+    assert [game.scores[seat] for seat in range(len(strategies))] == scores[0].tolist(), "scores differ from rules.py"
+    assert len(trace["turns"]) == turns[0]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Play lots of games of Memory without a server and sum them up')
+    parser.add_argument('--pairs', type=int, nargs='+', default=[8], help='Board sizes to try, in pairs (default 8)')
+    parser.add_argument('--players', type=int, nargs='+', default=[2], help='Player counts to try (default 2)')
+    parser.add_argument('--games', '-n', type=int, default=DEFAULT_GAMES,
+                        help=f'Games for each board size and player count (default {DEFAULT_GAMES})')
+    parser.add_argument(
+        '--strategy', '-s',
+        type=parse_strategy,
+        nargs='+',
+        default=[PerfectMemory()],
+        help=f"How each seat remembers cards, repeated to fill the table: {', '.join(STRATEGIES)} "
+             "(forgetful:<recall 0-1>, recent:<turns>; default perfect)"
+    )
+    parser.add_argument('--seed', type=int, help='Seed for a repeatable run')
+    parser.add_argument('--check', action='store_true',
+                        help='Also replay a few simulated games through rules.GameState to make sure the rules agree')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    if min(args.pairs) < 1 or args.games < 1:
+        parser.error('--pairs and --games must be at least 1')
+    if min(args.players) < 2:
+        # Memory needs someone to beat (and summarize() needs a runner-up for the winning margin)
+        parser.error('--players must be at least 2')
+    return args
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for num_players in args.players:
+        strategies = [args.strategy[seat % len(args.strategy)] for seat in range(num_players)]
+        for num_pairs in args.pairs:
+            if args.check:
+                for _ in range(CHECK_GAMES):
+                    check_against_rules(num_pairs, strategies, rng)
+            summary = simulate(num_pairs, strategies, args.games, rng)
+            print_summary(summary)
+            results.append(summary)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
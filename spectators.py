@@ -0,0 +1,306 @@
+import collections
+import threading
+
+import metrics
+from protocol import CARD_DOWN, CARD_MATCHED, CARD_UP, ENCODINGS, encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Spectators
+# ------------------------------------------------------------------------------------------------------------------------------
+# People who connect to --spectator-port watch a game instead of playing one. They don't count
+# against --players and can't flip anything.
+#
+# A watched room hands each publish() to its SpectatorFeed, which only appends the events to
+# a deque: no encoding, no sockets, and nothing that waits on a spectator. Every few hundred
+# milliseconds the hub drains each feed, turns everything that happened since the last tick
+# into ONE STATE_UPDATE frame, encodes it once per encoding and queues the same bytes for every
+# spectator of that room. A lot of flips in one tick still cost the audience one frame.
+#
+# The feed keeps its own copy of the board, built from those events, so a spectator who joins
+# gets a SNAPSHOT of that copy. The first spectator of a room starts the copy from the table as
+# of the room's last publish() (Room.published_snapshot), so nobody watching ever takes
+# game_state_lock, however often they switch rooms. A spectator who falls behind is skipped
+# instead of disconnected, and gets a fresh SNAPSHOT once they've caught up.
+
+DEFAULT_FRAME_SECONDS = 0.2    # Spectators get at most one frame per room this often
+DEFAULT_MAX_SPECTATORS = 1000  # Spectators one server process will take
+MAX_FRAME_EVENTS = 200         # More than this since the last frame and a SNAPSHOT is cheaper
+
+
+class SpectatorFeed:
+    """
+    One watched room: what happened there since the last frame, and our copy of its board.
+    """
+
+    def __init__(self, room):
+        self.room = room
+        self.pending = collections.deque()  # (seq, events, scores, players) from Room.publish, oldest first
+        self.room_seq = 0                   # The room's seq our copy of the board is up to
+        self.spectators = {}                # connection -> True if they need a SNAPSHOT before more frames
+        self.seq = 0                        # Numbers our frames, separately from the room's own seq
+        self.players = []
+        self.scores = {}
+        self.started = False
+        self.game_over = False
+        self.card_states = bytearray()
+        self.faces = {}                     # card_index -> identity, for cards that are face-up
+        self.turn = None                    # (player_id, current_player) once someone has a turn
+
+    def start(self):
+        """
+        Have the room feed us from now on, and start our copy from what it last published.
+        """
+        room = self.room
+        # Attach first: whatever the room publishes from here on is either pushed to us or
+        # already in the snapshot, and take_events() skips anything the snapshot covers
+        room.spectator_feed = self
+        snapshot = room.published_snapshot()
+        self.room_seq = snapshot["seq"]
+        self.players = snapshot["players"]
+        self.scores = snapshot["scores"]
+        self.started = snapshot["started"]
+        self.game_over = snapshot["game_over"]
+        self.card_states = bytearray.fromhex(snapshot["states"])
+        faces = iter(snapshot["faces"])
+        self.faces = {i: next(faces) for i, state in enumerate(self.card_states) if state != CARD_DOWN}
+        if "player_id" in snapshot:
+            self.turn = (snapshot["player_id"], snapshot["current_player"])
+
+    def stop(self):
+        if self.room.spectator_feed is self:
+            self.room.spectator_feed = None
+
+    def push(self, seq, events, scores, players):
+        """
+        Called by Room.publish() with its locks held, so it only appends.
+        """
+        self.pending.append((seq, events, scores, players))
+
+    def take_events(self):
+        """
+        Everything published since the last call, applied to our copy of the board.
+        """
+        events = []
+        pending = self.pending
+        while pending:
+            seq, published, scores, players = pending.popleft()
+            if seq <= self.room_seq:
+                # Published while we were attaching, our snapshot already has it
+                continue
+            self.room_seq, self.scores, self.players = seq, scores, players
+            for event in published:
+                event = {k: v for k, v in event.items() if k != "scores"}
+                self._apply(event)
+                events.append(event)
+        return events
+
+    def _apply(self, event):
+        msg_type = event["type"]
+        if msg_type == "CARD_REVEALED":
+            self.card_states[event["card_index"]] = CARD_UP
+            self.faces[event["card_index"]] = event["identity"]
+        elif msg_type == "MATCH_RESULT":
+            for idx in event["cards"]:
+                self.card_states[idx] = CARD_MATCHED
+        elif msg_type == "HIDE_CARDS":
+            for idx in event["cards"]:
+                self.card_states[idx] = CARD_DOWN
+                self.faces.pop(idx, None)
+        elif msg_type == "YOUR_TURN":
+            self.turn = (event["player_id"], event["current_player"])
+        elif msg_type == "GAME_START":
+            self.started = True
+            self.game_over = False
+            self.card_states = bytearray(event["num_cards"])
+            self.faces = {}
+        elif msg_type == "GAME_OVER":
+            self.game_over = True
+
+    def snapshot(self):
+        """
+        Our copy of the table, in the same shape as Room.snapshot().
+        """
+        snapshot = {
+            "type": "SNAPSHOT",
+            "seq": self.seq,
+            "players": list(self.players),
+            "scores": dict(self.scores),
+            "started": self.started,
+            "game_over": self.game_over,
+            "num_cards": len(self.card_states),
+            "states": self.card_states.hex(),
+            "faces": [self.faces[i] for i, state in enumerate(self.card_states) if state != CARD_DOWN],
+        }
+        if self.turn is not None:
+            snapshot["player_id"], snapshot["current_player"] = self.turn
+        return snapshot
+
+
+class SpectatorHub:
+    """
+    Every spectator on this server, and the ticks that send them what happened. Uses the same
+    scheduler as the rooms (a DeadlineScheduler or the asyncio loop), and only while someone is watching.
+    """
+
+    def __init__(self, registry, scheduler, lock_factory=threading.Lock,
+                 frame_seconds=DEFAULT_FRAME_SECONDS, max_spectators=DEFAULT_MAX_SPECTATORS):
+        self.registry = registry
+        self.scheduler = scheduler
+        self.frame_seconds = frame_seconds
+        self.max_spectators = max_spectators
+        self.lock = lock_factory()  # Spectators only; players never wait on it
+        self.feeds = {}             # room_id -> SpectatorFeed of a room someone is watching
+        self.watching = {}          # connection -> SpectatorFeed, or None while there's no game to watch
+        self.is_tick_scheduled = False
+
+    def count(self):
+        return len(self.watching)
+
+    def add(self, conn, room_id=None):
+        """
+        A new spectator. Returns False if we already have as many as we'll take.
+        """
+        with self.lock:
+            if len(self.watching) >= self.max_spectators:
+                return False
+            self.watching[conn] = None
+            self._watch(conn, room_id)
+            self._schedule_tick()
+        return True
+
+    def remove(self, conn):
+        with self.lock:
+            if conn in self.watching:
+                self._leave(conn)
+                del self.watching[conn]
+
+    def handle_message(self, conn, message):
+        """
+        Spectators can pick a room ({"type": "SPECTATE", "room_id": n}) and switch encodings, nothing else.
+        """
+        msg_type = message.get("type")
+        metrics.inc('spectator_messages_in_total', msg_type if msg_type in ('SPECTATE', 'SET_ENCODING') else 'other')
+        with self.lock:
+            if conn not in self.watching:
+                return
+            if msg_type == "SPECTATE":
+                self._leave(conn)
+                self._watch(conn, message.get("room_id"))
+            elif msg_type == "SET_ENCODING":
+                encoding = message.get("encoding")
+                if encoding not in ENCODINGS:
+                    self._send(conn, {"type": "ERROR", "message": "Unknown encoding."})
+                    return
+                # Same as for players: the reply is the last thing they get in the old encoding
+                conn.decoder.encoding = encoding
+                self._send(conn, {"type": "ENCODING", "encoding": encoding})
+                conn.encoding = encoding
+            else:
+                self._send(conn, {"type": "ERROR", "message": "Spectators can't play."})
+
+    def featured_room(self):
+        """
+        The room new spectators watch: the oldest one with a game going, else the oldest one at all,
+        so everybody who didn't ask for a room shares one stream.
+        """
+        rooms = [room for room in self.registry.all_rooms() if not room.is_closed]
+        playing = [room for room in rooms if room.is_game_started]
+        candidates = playing or rooms
+        return min(candidates, key=lambda room: room.room_id) if candidates else None
+
+    def _watch(self, conn, room_id):
+        """
+        Start conn watching a room (call with self.lock held).
+        """
+        room = self.registry.rooms.get(room_id) if room_id is not None else None
+        if room is None or room.is_closed:
+            room = self.featured_room()
+        if room is None:
+            # Nobody is playing yet; a tick will find them a game
+            self._send(conn, {"type": "SPECTATING", "room_id": None, "encodings": list(ENCODINGS)})
+            return
+        feed = self.feeds.get(room.room_id)
+        if feed is None:
+            feed = self.feeds[room.room_id] = SpectatorFeed(room)
+            feed.start()
+        feed.spectators[conn] = False
+        self.watching[conn] = feed
+        self._send(conn, {"type": "SPECTATING", "room_id": room.room_id, "encodings": list(ENCODINGS)})
+        self._send(conn, feed.snapshot())
+
+    def _leave(self, conn):
+        feed = self.watching.get(conn)
+        if feed is None:
+            return
+        self.watching[conn] = None
+        feed.spectators.pop(conn, None)
+        if not feed.spectators:
+            feed.stop()
+            self.feeds.pop(feed.room.room_id, None)
+
+    def _send(self, conn, message):
+        conn.send_payload(encode_message(message, conn.encoding))
+
+    def _schedule_tick(self):
+        if not self.is_tick_scheduled and self.watching:
+            self.is_tick_scheduled = True
+            self.scheduler.call_later(self.frame_seconds, self.tick)
+
+    def tick(self):
+        """
+        Send every watched room's news to its spectators, one frame per room.
+        """
+        with self.lock:
+            self.is_tick_scheduled = False
+            for feed in list(self.feeds.values()):
+                if feed.room.is_closed:
+                    # Everyone left that table, go and watch another one
+                    for conn in list(feed.spectators):
+                        self._leave(conn)
+                        self._watch(conn, None)
+                    continue
+                self._send_frame(feed)
+            for conn, feed in list(self.watching.items()):
+                if feed is None:
+                    self._watch(conn, None)
+            self._schedule_tick()
+
+    def _send_frame(self, feed):
+        events = feed.take_events()
+        payloads = {}
+        if len(events) > MAX_FRAME_EVENTS:
+            # Too much at once for one frame, everyone starts again from a snapshot
+            for conn in feed.spectators:
+                feed.spectators[conn] = True
+            events = []
+        elif events:
+            feed.seq += 1
+            frame = {"type": "STATE_UPDATE", "seq": feed.seq, "events": events, "scores": dict(feed.scores)}
+        sent = 0
+        for conn, needs_snapshot in feed.spectators.items():
+            if conn.is_backlogged():
+                # Don't pile more onto a spectator who can't keep up, they'll resync when they're through
+                if events:
+                    feed.spectators[conn] = True
+                continue
+            if needs_snapshot:
+                feed.spectators[conn] = False
+                self._send(conn, feed.snapshot())
+            elif events:
+                payload = payloads.get(conn.encoding)
+                if payload is None:
+                    payload = payloads[conn.encoding] = encode_message(frame, conn.encoding)
+                conn.send_payload(payload)
+                sent += 1
+        if sent:
+            metrics.inc('spectator_frames_total', amount=sent)
+
+    def shutdown(self):
+        """
+        Say goodbye to every spectator. Returns their connections so they can be flushed and closed.
+        """
+        with self.lock:
+            connections = list(self.watching)
+            for conn in connections:
+                self._send(conn, {"type": "SHUTDOWN", "message": "Server is shutting down."})
+        return connections
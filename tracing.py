@@ -0,0 +1,216 @@
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Message Tracing
+# ------------------------------------------------------------------------------------------------------------------------------
+# Where the time goes for one message (server.py --trace FILE). The metrics say flips are slow;
+# a trace says whether it was decoding, waiting for game_state_lock, the rules, or encoding and
+# queueing the messages for everyone at the table.
+#
+# Each traced message is one span (named after its type, tagged with the player, room and game)
+# split into back-to-back phases:
+#
+#   decode     finding the frame and json.loads / binary decoding
+#   handle     everything the room does that isn't one of the below
+#   lock_wait  waiting for game_state_lock
+#   rules      asking rules.py, and writing the journal
+#   publish    encoding the events and queueing them for every player (and spectator feed)
+#
+# A mismatch being hidden (HIDE_CARDS, on the scheduler) is traced the same way, since that's
+# where the turn changes hands. The socket writes happen later on each player's writer thread
+# and are traced as separate "send" spans there (the asyncio engine has no separate writes).
+#
+# Only --trace-sample of them are traced (1% by default), chosen at random, so it can stay on
+# in production. Tracing is off unless asked for; when it's off the hot path pays one function
+# call. Spans are only appended to a deque while a player waits; a background thread turns them
+# into JSON and writes them out.
+#
+# The file is in Chrome's trace event format: open it at https://ui.perfetto.dev or chrome://tracing.
+# Each thread (player, writer, scheduler) gets its own row.
+
+DEFAULT_SAMPLE = 0.01              # Share of messages we trace
+FLUSH_INTERVAL = 1.0               # Seconds between writes
+MAX_FILE_BYTES = 256 * 1024 * 1024  # Stop tracing once the file is this big, so it can be left on
+
+enabled = False
+sample = DEFAULT_SAMPLE
+_writer = None
+_local = threading.local()
+_started = time.perf_counter()     # Trace timestamps count from here
+
+
+class Trace:
+    """
+    One traced span and its phases. Only the thread that started it touches it.
+    """
+
+    __slots__ = ('name', 'args', 'marks')
+
+    def __init__(self, name, phase, started, args):
+        self.name = name
+        self.args = args
+        self.marks = [(phase, started)]  # (phase, when it started), in order
+
+    def mark(self, phase):
+        """
+        The current phase is over, phase starts now.
+        """
+        self.marks.append((phase, time.perf_counter()))
+
+    def finish(self, **args):
+        self.args.update(args)
+        writer = _writer
+        if writer is not None:
+            writer.pending.append((self.name, self.args, self.marks, time.perf_counter(), threading.get_ident()))
+
+
+def start(name, phase=None, args=None):
+    """
+    Start a span, if this one is sampled. Returns a Trace, or None (always None while tracing is off).
+    """
+    if not enabled or random.random() >= sample:
+        return None
+    return Trace(name, phase, time.perf_counter(), args if args is not None else {})
+
+
+def current():
+    """
+    The message this thread is handling, if it's being traced (see messages()).
+    """
+    if not enabled:
+        return None
+    return getattr(_local, 'trace', None)
+
+
+def messages(decoded, player_id, room):
+    """
+    Wrap the messages coming out of a connection's Decoder (or Admission) so a sample of them are traced.
+    """
+    if not enabled:
+        return decoded
+    return _traced_messages(decoded, player_id, room)
+
+
+def _traced_messages(decoded, player_id, room):
+    while True:
+        started = time.perf_counter()
+        try:
+            message = next(decoded)
+        except StopIteration:
+            return
+        if random.random() >= sample:
+            yield message
+            continue
+        trace = Trace(str(message.get("type")), 'decode', started, {"player": player_id, "room": room.room_id})
+        trace.mark('handle')
+        _local.trace = trace
+        try:
+            yield message
+        finally:
+            _local.trace = None
+            trace.finish(game=room.game_number)
+
+
+class TraceWriter:
+    """
+    Writes finished spans to the trace file from a background thread.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = collections.deque()  # Finished spans; appending is safe from any thread
+        self.pid = os.getpid()
+        self.thread_names = {}              # Threads we've already named in the file
+        self.file = open(path, 'w')
+        # The closing ] is optional in this format, so a trace cut short by a crash still loads
+        self.file.write('[\n')
+        self.size = 2
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.write_forever, name='trace-writer', daemon=True)
+        self.thread.start()
+
+    def write_forever(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.write_out()
+
+    def events(self, name, args, marks, ended, tid):
+        """
+        Chrome trace events for one span: the whole thing, then each phase.
+        """
+        if tid not in self.thread_names:
+            thread = next((t for t in threading.enumerate() if t.ident == tid), None)
+            self.thread_names[tid] = thread.name if thread is not None else str(tid)
+            yield {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                   "args": {"name": self.thread_names[tid]}}
+        started = marks[0][1]
+        yield {"name": name, "cat": "message", "ph": "X", "pid": self.pid, "tid": tid,
+               "ts": _micros(started), "dur": _micros(ended) - _micros(started), "args": args}
+        ends = [when for _, when in marks[1:]] + [ended]
+        for (phase, began), finished in zip(marks, ends):
+            if phase is not None:
+                yield {"name": phase, "cat": "phase", "ph": "X", "pid": self.pid, "tid": tid,
+                       "ts": _micros(began), "dur": _micros(finished) - _micros(began)}
+
+    def write_out(self):
+        global enabled
+        lines = []
+        pending = self.pending
+        while pending:
+            lines.extend(json.dumps(event) + ',\n' for event in self.events(*pending.popleft()))
+        if not lines:
+            return
+        data = ''.join(lines)
+        try:
+            self.file.write(data)
+            self.file.flush()
+        except OSError as error:
+            print(f"Oops, couldn't write to the trace {self.path}: {error}")
+        self.size += len(data)
+        if self.size >= MAX_FILE_BYTES and enabled:
+            print(f"The trace {self.path} is {self.size // (1024 * 1024)} MB, tracing has stopped.")
+            enabled = False
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.write_out()
+        name = {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": f"memory game server {self.pid}"}}
+        self.file.write(json.dumps(name) + '\n]\n')
+        self.file.close()
+
+
+def _micros(when):
+    return round((when - _started) * 1_000_000, 1)
+
+
+def configure(args):
+    """
+    Start tracing if the server was given --trace.
+    """
+    global enabled, sample, _writer
+    if args.trace is None:
+        return
+    sample = args.trace_sample
+    _writer = TraceWriter(args.trace)
+    enabled = True
+    print(f"Tracing {sample:.1%} of messages to {args.trace}")
+
+
+def stop():
+    """
+    Write out the spans still waiting and finish the file.
+    """
+    global enabled, _writer
+    if _writer is not None:
+        enabled = False
+        _writer.close()
+        _writer = None
@@ -0,0 +1,385 @@
+import collections
+import copy
+import json
+import math
+import multiprocessing
+import os
+import selectors
+import signal
+import socket
+import struct
+
+from protocol import encode_message
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Worker Processes
+# ------------------------------------------------------------------------------------------------------------------------------
+# One Python process can only use one core for game logic, so with --workers N the server
+# becomes a small coordinator plus N worker processes. The coordinator owns the listening
+# socket: it accepts every player, decides which worker they play on, and passes the
+# connection's file descriptor to that worker over a Unix socket. The worker runs the normal
+# threads or asyncio engine, so a game lives entirely inside one worker.
+#
+# Workers report their empty seats back after every seat change. The coordinator sends a
+# new player to a worker with an empty seat (so tables fill up), otherwise to the worker
+# hosting the fewest games, which then opens a new table. When every worker is full, new
+# players are dealt out to the workers in turn and wait in that worker's line (matchmaking.py).
+#
+# We pass descriptors rather than use SO_REUSEPORT because the kernel would spread players
+# at random, and two halves of the same table could end up waiting on different workers.
+#
+# Spectators (--spectator-port) are handed over the same way, with player_id SPECTATOR, to the
+# worker hosting the most games. They can watch any game on that worker.
+
+_handoff = struct.Struct('!II')  # handoff number, player_id
+SPECTATOR = 0                    # player_id for a spectator handoff (real players start at 1)
+
+
+class WorkerChannel:
+    """
+    The worker's end of the connection to the coordinator.
+    """
+
+    def __init__(self, sock, index):
+        self.sock = sock
+        self.index = index
+        self.last_handoff = 0  # Number of the last player the coordinator sent us
+
+    def receive(self):
+        """
+        The next player from the coordinator as (socket, player_id), or None if the coordinator is gone.
+        player_id is SPECTATOR for someone who only wants to watch.
+        """
+        data, fds, _, _ = socket.recv_fds(self.sock, _handoff.size, 1)
+        if not data or not fds:
+            return None
+        handoff, player_id = _handoff.unpack(data)
+        self.last_handoff = handoff
+        return socket.socket(fileno=fds[0]), player_id
+
+    def report(self, registry):
+        """
+        Tell the coordinator how many empty seats and rooms we have, as of the last player it sent us.
+        """
+        status = {"handoff": self.last_handoff, "open": registry.open_seat_count(), "rooms": len(registry.rooms)}
+        try:
+            self.sock.send(json.dumps(status).encode())
+        except OSError:
+            # It's only a hint, the next report will catch the coordinator up
+            pass
+
+
+def worker_args(args, index):
+    """
+    This worker's share of the settings. Each worker gets its own metrics port and file, its own journal and its own trace
+    (the leaderboard is shared, see leaderboard.py).
+    """
+    args = copy.copy(args)
+    args.max_rooms = math.ceil(args.max_rooms / args.workers)
+    if args.metrics_port is not None:
+        args.metrics_port += index
+    if args.metrics_file is not None:
+        root, ext = os.path.splitext(args.metrics_file)
+        args.metrics_file = f"{root}.worker{index}{ext}"
+    if args.journal is not None:
+        args.journal = f"{args.journal}.worker{index}"
+    if args.trace is not None:
+        root, ext = os.path.splitext(args.trace)
+        args.trace = f"{root}.worker{index}{ext}"
+    return args
+
+
+def worker_main(args, sock, index, inherited_fds):
+    """
+    Runs in each worker process.
+    """
+    import admission
+    import heartbeat
+    import journal
+    import leaderboard
+    import metrics
+    import tracing
+    for fd in inherited_fds:
+        # The coordinator's ends, so it going away still looks like an end of file to us
+        os.close(fd)
+    args = worker_args(args, index)
+    channel = WorkerChannel(sock, index)
+    metrics.configure(args)
+    journal.configure(args)
+    leaderboard.configure(args)
+    tracing.configure(args)
+    admission.configure(args)
+    heartbeat.configure(args)
+    if args.engine == 'asyncio':
+        import async_server
+        async_server.run_worker(args, channel)
+    else:
+        run_threads_worker(args, channel)
+    tracing.stop()
+    leaderboard.stop()
+    journal.stop()
+    metrics.stop()
+
+
+def run_threads_worker(args, channel):
+    """
+    The threaded engine, fed by the coordinator instead of its own accept() loop.
+    """
+    import server
+    registry = server.create_registry(args)
+    registry.on_seats_changed = lambda: channel.report(registry)
+    signal.signal(signal.SIGINT, server.signal_handler)
+    wakeup, wakeup_sender = server.signal_wakeup_socket()
+    # Sleep until the coordinator sends a player or CTRL + c is pressed
+    selector = selectors.DefaultSelector()
+    selector.register(channel.sock, selectors.EVENT_READ)
+    selector.register(wakeup, selectors.EVENT_READ)
+    # Players wait here for a seat, same as without workers
+    lobby = server.Lobby(registry, selector, args, wakeup_sender)
+    print(f"Worker {channel.index} ready, hosting up to {args.max_rooms} games...")
+    while server.running:
+        ready = []
+        for key, _ in selector.select(lobby.timeout()):
+            if key.data is not None:
+                lobby.handle_readable(key.data)
+            else:
+                ready.append(key.fileobj)
+        if wakeup in ready:
+            server.drain_wakeup_socket(wakeup)
+        if channel.sock in ready and server.running:
+            handoff = channel.receive()
+            if handoff is None:
+                # The coordinator is gone
+                break
+            receive_player(handoff, registry, lobby, channel, args)
+        lobby.tick()
+    lobby.shutdown()
+    selector.close()
+    server.shutdown_rooms(registry)
+
+def receive_player(handoff, registry, lobby, channel, args):
+    """
+    A player (or spectator) the coordinator just sent us, for the threaded engine.
+    """
+    import server
+    client_sock, player_id = handoff
+    client_sock.settimeout(None)
+    try:
+        client_addr = client_sock.getpeername()
+    except OSError:
+        # They hung up while being handed over
+        client_sock.close()
+        channel.report(registry)
+        return
+    if player_id == SPECTATOR:
+        server.seat_new_spectator(client_sock, client_addr, registry, args)
+    elif not lobby.add(client_sock, client_addr, player_id):
+        channel.report(registry)
+
+# --------------------------------------------------------------------------------------------------------------------------------
+#  Coordinator
+# ------------------------------------------------------------------------------------------------------------------------------
+
+
+class Worker:
+    """
+    The coordinator's view of one worker: its process, its channel, and how many empty seats and
+    rooms we think it has. Players we've sent but it hasn't reported on yet are counted on top.
+    """
+
+    def __init__(self, index, process, sock, max_rooms):
+        self.index = index
+        self.process = process
+        self.sock = sock
+        self.max_rooms = max_rooms
+        self.open_seats = 0
+        self.rooms = 0
+        self.pending = collections.deque()  # (handoff number, seat change, room change) not reported yet
+        self.is_alive = True
+
+    def expect(self, handoff, seat_change, room_change):
+        self.pending.append((handoff, seat_change, room_change))
+        self.open_seats += seat_change
+        self.rooms += room_change
+
+    def apply_report(self, report):
+        while self.pending and self.pending[0][0] <= report["handoff"]:
+            self.pending.popleft()
+        self.open_seats = report["open"] + sum(seats for _, seats, _ in self.pending)
+        self.rooms = report["rooms"] + sum(rooms for _, _, rooms in self.pending)
+
+
+class Coordinator:
+    """
+    Accepts players and hands each one to a worker.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = []
+        self.next_player_id = 1
+        self.next_handoff = 1
+        self.next_overflow = 0  # Worker that gets the next player when every table is taken
+        self.running = True
+
+    def start_workers(self):
+        # fork: the workers start instantly and inherit everything already imported
+        context = multiprocessing.get_context('fork')
+        max_rooms = math.ceil(self.args.max_rooms / self.args.workers)
+        for index in range(self.args.workers):
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            # Our ends of the channels get copied into this child too, it closes them straight away
+            inherited = [worker.sock.fileno() for worker in self.workers] + [ours.fileno()]
+            process = context.Process(target=worker_main, args=(self.args, theirs, index, inherited),
+                                      name=f'worker-{index}', daemon=True)
+            process.start()
+            theirs.close()
+            self.workers.append(Worker(index, process, ours, max_rooms))
+
+    def choose_worker(self):
+        """
+        A worker with an empty seat if there is one, otherwise the one hosting the fewest games.
+        When every table everywhere is taken, the workers take turns holding new players in line.
+        Returns (worker, seat change, room change), or None if every worker has stopped.
+        """
+        alive = [worker for worker in self.workers if worker.is_alive]
+        for worker in alive:
+            if worker.open_seats > 0:
+                return worker, -1, 0
+        roomy = [worker for worker in alive if worker.rooms < worker.max_rooms]
+        if not roomy:
+            if not alive:
+                return None
+            self.next_overflow = (self.next_overflow + 1) % len(alive)
+            return alive[self.next_overflow], 0, 0
+        worker = min(roomy, key=lambda w: w.rooms)
+        return worker, self.args.players - 1, 1
+
+    def hand_off_spectator(self, client_sock):
+        """
+        Spectators go to the worker with the most games to watch. They don't take a seat,
+        so the handoff reuses the last player's number and the worker's reports don't change.
+        """
+        alive = [worker for worker in self.workers if worker.is_alive]
+        if not alive:
+            client_sock.close()
+            return
+        worker = max(alive, key=lambda w: w.rooms)
+        try:
+            socket.send_fds(worker.sock, [_handoff.pack(self.next_handoff - 1, SPECTATOR)], [client_sock.fileno()])
+        except OSError as error:
+            print(f"Oops, couldn't hand a spectator to worker {worker.index}: {error}")
+            worker.is_alive = False
+        client_sock.close()
+
+    def hand_off(self, client_sock):
+        choice = self.choose_worker()
+        if choice is None:
+            # Every worker has stopped—tell them to come back later
+            try:
+                client_sock.sendall(encode_message({"type": "ERROR", "message": "Sorry, game is full."}))
+            except OSError:
+                pass
+            client_sock.close()
+            return
+        worker, seat_change, room_change = choice
+        handoff = self.next_handoff
+        try:
+            socket.send_fds(worker.sock, [_handoff.pack(handoff, self.next_player_id)], [client_sock.fileno()])
+        except OSError as error:
+            print(f"Oops, couldn't hand a player to worker {worker.index}: {error}")
+            worker.is_alive = False
+            client_sock.close()
+            return
+        # The worker has its own copy of the connection now
+        client_sock.close()
+        worker.expect(handoff, seat_change, room_change)
+        self.next_handoff += 1
+        self.next_player_id += 1
+
+    def read_report(self, worker):
+        try:
+            data = worker.sock.recv(4096)
+        except OSError:
+            data = b''
+        if not data:
+            print(f"Worker {worker.index} has stopped.")
+            worker.is_alive = False
+            return False
+        worker.apply_report(json.loads(data))
+        return True
+
+    def stop(self, sig=None, frame=None):
+        self.running = False
+
+    def serve(self):
+        import server
+        args = self.args
+        self.start_workers()
+        signal.signal(signal.SIGINT, self.stop)
+        wakeup, _wakeup_sender = server.signal_wakeup_socket()
+        selector = selectors.DefaultSelector()
+        selector.register(wakeup, selectors.EVENT_READ, 'wakeup')
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((args.host, args.port))
+            server_socket.listen(1024)
+            server_socket.setblocking(False)
+            selector.register(server_socket, selectors.EVENT_READ)
+            spectator_socket = None
+            if args.spectator_port is not None:
+                spectator_socket = server.open_listener(args.host, args.spectator_port)
+                selector.register(spectator_socket, selectors.EVENT_READ, 'spectator')
+                print(f"Spectators can watch on {args.host}:{args.spectator_port}")
+            for worker in self.workers:
+                selector.register(worker.sock, selectors.EVENT_READ, worker)
+            print(
+                f"Ready on {args.host}:{args.port} with {args.workers} workers ({args.engine}), "
+                f"hosting up to {args.max_rooms} games of {args.players} players..."
+            )
+            while self.running:
+                for key, _ in selector.select():
+                    if key.data == 'wakeup':
+                        # CTRL + c, self.stop has already run
+                        server.drain_wakeup_socket(wakeup)
+                    elif key.data is None:
+                        try:
+                            client_sock, _ = server_socket.accept()
+                        except (BlockingIOError, InterruptedError):
+                            continue
+                        self.hand_off(client_sock)
+                    elif key.data == 'spectator':
+                        try:
+                            client_sock, _ = spectator_socket.accept()
+                        except (BlockingIOError, InterruptedError):
+                            continue
+                        self.hand_off_spectator(client_sock)
+                    elif not self.read_report(key.data):
+                        selector.unregister(key.fileobj)
+            selector.close()
+            if spectator_socket is not None:
+                spectator_socket.close()
+        self.stop_workers()
+
+    def stop_workers(self):
+        """
+        Ask every worker to shut down (they say goodbye to their players), then wait for them.
+        """
+        for worker in self.workers:
+            if worker.process.is_alive():
+                try:
+                    os.kill(worker.process.pid, signal.SIGINT)
+                except OSError:
+                    pass
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.sock.close()
+
+
+def run(args):
+    """
+    Entry point used by server.py when started with --workers.
+    """
+    Coordinator(args).serve()